@@ -55,7 +55,7 @@
 # 2. Password must be in local .pgpass file or client authentication changed to trust or peer
 # 3. psql must be in the user's path
 # 4. Make sure timing and pager are turned off (see .psqlrc)
-# 5. slack webhook must be in specified file, ~/.slackhook
+# 5. slack webhook must be in specified file, ~/.slackhook, or in the url of a [notifier.NAME] config section
 #
 # Cron Job Info:
 #    View cron job output: view /var/log/cron
@@ -79,18 +79,21 @@
 # Michael Vitale     12/26/2023     Enhancement: Add warnings from current PG log file (local only)
 # Michael Vitale     01/05/2024     Enhancement: Use calculated formula for size to determe vacuum freeze candidates since the pg_table_size() func can cause wait/lock conditions
 ################################################################################################################
-import string, sys, os, time
+import sys, os, time, re
+# start of the run for the startup budget (time to the first query)
+PROCSTART = time.time()
 #import datetime
 from datetime import datetime, timedelta
 from datetime import date
 
-import tempfile, platform, math
+# modules only some runs need (sqlite3, http.client, concurrent.futures, syslog, gzip) are imported where they are used,
+# since this runs from cron every minute on many hosts
+import tempfile, shutil, math, select, copy, heapq
+import json, configparser
 from decimal import *
-import smtplib
 import subprocess
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, STDOUT
 from optparse  import OptionParser
-import getpass
 
 #############################################################################################
 #globals
@@ -110,6 +113,10 @@ ADATE      = "Jan 5, 2024"
 PROGDATE   = "2024-01-05"
 MARK_OK    = "[ OK ]  "
 MARK_WARN  = "[WARN]  "
+MARK_SKIP  = "[SKIP]  "
+FORMATS    = ('text', 'json', 'ndjson')
+SESSION_END = "__pg_check_end__"
+ALLHOURS   = 168
 
 
 # alert notifications
@@ -120,6 +127,7 @@ WAITS="Waits"
 IDLEINTRANS="IdleInTrans"
 LONGQUERY="LongQuery"
 ACTIVECONNS="ActiveConns"
+WAITPROFILE="WaitProfile"
 LOAD1="Load1"
 LOAD5="Load5"
 LOAD15="Load15"
@@ -130,6 +138,348 @@ PGBACKREST1="PGBackrest1"
 
 REPLICATION="Replication"
 PGHOSTUP="PGHostUp"
+ANOMALY="Anomaly"
+SEQUENCES="Sequences"
+
+# notification severity by alert type, anything not listed is a warning.  A resolved alert keeps its severity so it reaches
+# the notifiers that got it firing, and test alerts are critical so they reach every notifier.
+SEVERITIES    = ('info', 'warning', 'critical')
+ALERTSEVERITY = {PGHOSTUP: 'critical', DIRSIZE: 'critical', REPLICATION: 'critical', SEQUENCES: 'critical', TESTALERT: 'critical'}
+
+# check registry: each check is implemented by maint.check_<id>() and run by do_report() in this order.
+#   cost       --> cheap, moderate or expensive
+#   interval   --> default minimum seconds between runs of the check, 0 means every run
+#   minver     --> lowest PG major version the check applies to, '' means any
+#   maxver     --> highest PG major version the check applies to, '' means any
+#   thresholds --> default values, all of which can be overridden in the config file
+# The config file (pg_check.conf in the program directory or -f) has one section per check id, plus
+# optional <check id>:<environment> sections that override it when -e matches, for example:
+#   [bloat]
+#   enabled  = off
+#   [bloat:PROD]
+#   enabled  = on
+#   interval = 86400
+#   ratio    = 10
+CHECKS = {
+    'waits':            {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {}},
+    'idleintrans':      {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {}},
+    'longquery':        {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {}},
+    'load':             {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'loadfactor': Decimal('0.9')}},
+    'activeconns':      {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'maxpct': 80.0, 'cpufactor': 2.5}},
+    'waitprofile':      {'cost': 'moderate',  'interval': 300,  'minver': '10',   'maxver': '',    'thresholds': {'seconds': 5, 'intervalms': 250, 'top': 5, 'maxaaspct': 100, 'poolpct': 90}},
+    'idleconns':        {'cost': 'cheap',     'interval': 0,    'minver': '9.2',  'maxver': '',    'thresholds': {'excludeusers': 'ggs'}},
+    'pgversion':        {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {}},
+    'cachehit':         {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'low': Decimal('70.0'), 'moderate': Decimal('90.0')}},
+    'preload':          {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {}},
+    'connections':      {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'maxpct': 80}},
+    'conflicts':        {'cost': 'cheap',     'interval': 0,    'minver': '9.1',  'maxver': '',    'thresholds': {}},
+    'checkpoints':      {'cost': 'cheap',     'interval': 0,    'minver': '9.6',  'maxver': '',    'thresholds': {'minmins': Decimal('5.0'), 'maxmins': Decimal('60.0'), 'windowmins': 60, 'reqpct': 20, 'headroom': 1.5}},
+    'settings':         {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'completiontarget': Decimal('0.6'), 'querysize': 8192}},
+    'bgwriter':         {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'maxwritten_clean': 500000}},
+    'io':               {'cost': 'cheap',     'interval': 0,    'minver': '16',   'maxver': '',    'thresholds': {'backendwritepct': 20, 'top': 5}},
+    'buffercache':      {'cost': 'expensive', 'interval': 3600, 'minver': '10',   'maxver': '',    'thresholds': {'enabled': False, 'sample': 131072, 'top': 10}},
+    'largeobjects':     {'cost': 'expensive', 'interval': 3600, 'minver': '',     'maxver': '',    'thresholds': {'cachesecs': 86400, 'samplepct': 0.0, 'samplemin': 1000000}},
+    'bloat':            {'cost': 'expensive', 'interval': 3600, 'minver': '',     'maxver': '',    'thresholds': {'ratio': 20, 'wastedbytes': 10737418240}},
+    'unusedindexes':    {'cost': 'moderate',  'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'minbytes': 8192, 'unuseddays': 7, 'top': 5}},
+    'duplicateindexes': {'cost': 'moderate',  'interval': 3600, 'minver': '',     'maxver': '',    'thresholds': {'top': 5}},
+    'shortconns':       {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'maxavgsecs': 172800, 'minavgsecs': 120}},
+    'sessions':         {'cost': 'cheap',     'interval': 0,    'minver': '14',   'maxver': '',    'thresholds': {'connspersec': 10.0, 'clientpersec': 1.0, 'abandonedpct': 5, 'top': 5}},
+    'freeze':           {'cost': 'moderate',  'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'minbytes': 1073741824, 'agepct': 50}},
+    'sequences':        {'cost': 'moderate',  'interval': 3600, 'minver': '10',   'maxver': '',    'thresholds': {'warnpct': 75, 'etadays': 90, 'top': 5}},
+    'analyze':          {'cost': 'moderate',  'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'livepct': 50, 'staledays': 60}},
+    'autovacuum':       {'cost': 'moderate',  'interval': 0,    'minver': '9.6',  'maxver': '',    'thresholds': {'trackmax': 200, 'longmins': 60, 'top': 5}},
+    'hotspots':         {'cost': 'moderate',  'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'trackmax': 10000, 'minrows': 10000, 'seqrowspermin': 1000000, 'seqpct': 50,
+                                                                                                                  'updpermin': 100, 'hotpct': 50, 'top': 5}},
+    'memory':           {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'maxsharedpct': 40, 'minsharedpct': 10, 'exposurepct': 100,
+                                                                                                                  'hugepagesmb': 8192, 'maxswappiness': 10, 'swappagespermin': 100}},
+    'dirsize':          {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'maxpct': 75}},
+    'replication':      {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'maxlagsecs': 10}},
+    'standby':          {'cost': 'cheap',     'interval': 0,    'minver': '9.6',  'maxver': '',    'thresholds': {'maxlagsecs': 60, 'streaming': True, 'conflictsperhour': 10}},
+    'pglog':            {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {}},
+    'pgbouncer':        {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'logfile': '/var/log/pgbouncer/pgbouncer.log', 'warnsecs': 120}},
+    'pgbackrest':       {'cost': 'cheap',     'interval': 0,    'minver': '',     'maxver': '',    'thresholds': {'maxagedays': 2}},
+}
+# checks that only look at the database connected to.  With --all-databases they run once per database, the rest once per instance.
+DBCHECKS = ('cachehit', 'conflicts', 'buffercache', 'largeobjects', 'bloat', 'unusedindexes', 'duplicateindexes', 'freeze',
+            'sequences', 'analyze', 'autovacuum', 'hotspots')
+# standby profile: checks that mean nothing or cannot work on a server in recovery (no vacuum, no writes, the same catalogs
+# and data as the primary) are skipped there, and the standby check only runs there.  Recovery is detected once per run.
+PRIMARYONLY = ('replication', 'bloat', 'duplicateindexes', 'freeze', 'sequences', 'analyze', 'autovacuum')
+STANDBYONLY = ('standby',)
+# the only "show all" settings the checks use, cached in the state file until the server restarts or reloads its config
+CONFIGSETTINGS = ('data_directory', 'log_directory', 'archive_mode', 'max_connections', 'shared_buffers', 'maintenance_work_mem',
+                  'work_mem', 'effective_cache_size', 'shared_preload_libraries', 'rds.extensions', 'huge_pages',
+                  'shared_memory_size_in_huge_pages', 'autovacuum_max_workers')
+
+# config file sections that are not checks, with their defaults
+#   adaptive --> pressure thresholds for -a: load as pct of cpus, active connections as pct of cpu saturation,
+#                blocked queries count, and the timeouts applied to all remaining queries once under pressure
+#   guardrails --> session settings applied to every probe: statement_timeout by check cost class (a check section can
+#                override it with its own statement_timeout), lock_timeout, application_name and an optional low work_mem,
+#                plus the global run deadline in seconds after which running commands are killed and the run stops
+#   history    --> local time-series store (pg_check.db) of every numeric check result, kept raw and rolled up
+#                into 1 minute and 1 hour buckets, each with its own retention in days
+#   anomaly    --> learned per host baselines for the listed metrics: an EWMA of the value and of its absolute deviation,
+#                kept per hour of the week plus one for all hours (used until the hour of week slot has minsamples).
+#                A value more than deviations times the typical deviation, and at least minpct away from the baseline, is an anomaly.
+#   alerts     --> alert state machine: consecutive breaches before an alert fires, consecutive clean runs before it is resolved,
+#                seconds between repeat notifications while firing (the last one repeats), and whether resolved notifications are sent
+#   notify     --> mail recipients for -m (normal and -t test mode) and the sender address
+#   startup    --> optional budget in milliseconds from process start to the first query sent to the server, warned about when
+#                exceeded.  0 (default) only records startup.first_query_ms, tests/test_startup.py guards the startup path itself.
+#   alldatabases --> --all-databases sweep: databases checked in parallel (--jobs overrides jobs), capped at connpct percent
+#                of the free connection slots, and a comma separated list of databases to leave out
+SETTINGS = {
+    'adaptive':   {'loadpct': 90, 'activepct': 80.0, 'blocked': 5, 'statement_timeout': '5s', 'lock_timeout': '1s'},
+    'history':    {'enabled': True, 'raw_days': 2, 'minute_days': 14, 'hour_days': 400},
+    'anomaly':    {'enabled': False, 'alpha': 0.05, 'deviations': 4.0, 'minsamples': 20, 'minpct': 10.0,
+                   'metrics': 'waits.blocked,idleintrans.count,longquery.count,load.load1,activeconns.count,connections.count,'
+                              'cachehit.ratio,checkpoints.minutes,autovacuum.workers,replication.lagsecs,pgbouncer.waiting'},
+    'guardrails': {'cheap_timeout': '10s', 'moderate_timeout': '60s', 'expensive_timeout': '300s', 'lock_timeout': '2s',
+                   'application_name': PROGNAME, 'work_mem': '', 'deadline': 600},
+    'alldatabases': {'jobs': 4, 'connpct': 10, 'exclude': ''},
+    'startup':    {'budgetms': 0},
+    'alerts':     {'breaches': 2, 'clears': 2, 'renotify': '900,3600,14400,86400', 'resolved': True},
+    'notify':     {'mailto': 'michaeldba@sqlexec.com', 'testmailto': 'michaeldba@sqlexec.com', 'mailfrom': 'pgdude@noreply.com'},
+}
+
+# query catalog: probe name --> list of (minver, maxver, sql) variants for PG major version ranges ('' means open ended).
+# maint.resolve_queries() picks the variant for the connected server once per run and checks run them with
+# maint.run_query(name, params).  A probe with no variant for the server version is None and the check skips it rather
+# than running a failing query.  Queries that take params use %% for a literal %.  --validate-catalog EXPLAINs every
+# resolved query against the connected server and shows which variant each supported major version gets.
+# independent read only probes of cheap checks that do_report() sends to the server as one batch (PG 9.3+ for json_agg),
+# with the maint attribute holding the probe's param, if any
+BATCH     = {'cachehit': 'database', 'connections': '', 'conflicts': 'database', 'checkpoints': '', 'settings': '',
+             'bgwriter.buffers': '', 'bgwriter': '', 'shortconns': '', 'sessions': '', 'sessions.clients': '',
+             'standby': '', 'standby.conflicts': ''}
+SUPPORTED = ('9.6', '10', '11', '12', '13', '14', '15', '16', '17')
+QUERIES = {
+    'waits.count':         [('', '9.5',  "select count(*) from pg_stat_activity where waiting is true and now() - query_start > interval '%d seconds'"),
+                            # filter out DataFileRead-IO.  backend_type qualifier (10+) to not consider walsender
+                            ('9.6', '9.6', "select count(*) from pg_stat_activity where wait_event is NOT NULL AND wait_event <> 'DataFileRead' and state = 'active' and now() - query_start > interval '%d seconds'"),
+                            ('10', '',   "select count(*) from pg_stat_activity where wait_event is NOT NULL AND wait_event <> 'DataFileRead' and state = 'active' and backend_type <> 'walsender' and now() - query_start > interval '%d seconds'")],
+    'waits.details':       [('9.6', '9.6', "select 'db=' || datname || '  user=' || usename || '  appname=' || application_name || '  waitinfo=' || wait_event || '-' || wait_event_type || " \
+                                           "'  duration=' || cast(EXTRACT(EPOCH FROM (now() - query_start)) as integer) || '\n'" \
+                                           "'sql=' || regexp_replace(replace(regexp_replace(query, E'[\\n\\r]+', ' ', 'g' ),'    ',''), '[^\x20-\x7f\x0d\x1b]', '', 'g') || '\n'" \
+                                           "from pg_stat_activity where wait_event is NOT NULL and state = 'active' and now() - query_start > interval '%d seconds'"),
+                            ('10', '',   "select 'db=' || datname || '  user=' || usename || '  appname=' || application_name || '  waitinfo=' || wait_event || '-' || wait_event_type || " \
+                                         "'  duration=' || cast(EXTRACT(EPOCH FROM (now() - query_start)) as integer) || '\n'" \
+                                         "'sql=' || regexp_replace(replace(regexp_replace(query, E'[\\n\\r]+', ' ', 'g' ),'    ',''), '[^\x20-\x7f\x0d\x1b]', '', 'g') || '\n'" \
+                                         "from pg_stat_activity where wait_event is NOT NULL and state = 'active' and backend_type <> 'walsender' and now() - query_start > interval '%d seconds'")],
+    'waits.blocking':      [('9.2', '',  "SELECT '\n\nblocked_pid =' || rpad(cast(blocked_locks.pid as varchar),7,' ') || ' blocked_user=' || blocked_activity.usename || " \
+                                         "'\nblocking_pid=' || rpad(cast(blocking_locks.pid as varchar), 7, ' ') || 'blocking_user=' || blocking_activity.usename || '\n' ||" \
+                                         "'blocked_query =' || regexp_replace(replace(regexp_replace(blocked_activity.query, E'[\\n\\r]+', ' ', 'g' ),'    ',''), '[^\x20-\x7f\x0d\x1b]', '', 'g') || '...\n' ||" \
+                                         "'blocking_query=' || regexp_replace(replace(regexp_replace(blocking_activity.query, E'[\\n\\r]+', ' ', 'g' ),'    ',''), '[^\x20-\x7f\x0d\x1b]', '', 'g') || '...\n\n' FROM pg_catalog.pg_locks blocked_locks " \
+                                         "JOIN pg_catalog.pg_stat_activity blocked_activity ON blocked_activity.pid = blocked_locks.pid JOIN pg_catalog.pg_locks blocking_locks ON blocking_locks.locktype = blocked_locks.locktype AND " \
+                                         "blocking_locks.DATABASE IS NOT DISTINCT FROM blocked_locks.DATABASE AND blocking_locks.relation IS NOT DISTINCT FROM blocked_locks.relation AND blocking_locks.page IS NOT DISTINCT " \
+                                         "FROM blocked_locks.page AND blocking_locks.tuple IS NOT DISTINCT FROM blocked_locks.tuple AND blocking_locks.virtualxid IS NOT DISTINCT FROM blocked_locks.virtualxid AND " \
+                                         "blocking_locks.transactionid IS NOT DISTINCT FROM blocked_locks.transactionid AND blocking_locks.classid IS NOT DISTINCT FROM blocked_locks.classid AND blocking_locks.objid IS NOT DISTINCT " \
+                                         "FROM blocked_locks.objid AND blocking_locks.objsubid IS NOT DISTINCT FROM blocked_locks.objsubid AND blocking_locks.pid != blocked_locks.pid " \
+                                         "JOIN pg_catalog.pg_stat_activity blocking_activity ON blocking_activity.pid = blocking_locks.pid WHERE NOT blocked_locks.GRANTED")],
+    'idleintrans.count':   [('', '9.1',  "select count(*) from pg_stat_activity where current_query ilike '<IDLE> in transaction%%' and round(EXTRACT(EPOCH FROM (now() - query_start))) / 60 > %d"),
+                            ('9.2', '',  "select count(*) from pg_stat_activity where state = 'idle in transaction' and round(EXTRACT(EPOCH FROM (now() - query_start))) / 60 > %d")],
+    'idleintrans.details': [('', '9.1',  "select 'pid=' || procpid || '  db=' || datname || '  user=' || usename || '  app=' || coalesce(application_name, 'N/A') || '  duration=' || round(round(EXTRACT(EPOCH FROM (now() - query_start))) / 60) || ' mins' from pg_stat_activity where current_query ilike '<IDLE> in transaction%%' and round(EXTRACT(EPOCH FROM (now() - query_start))) / 60 > %d"),
+                            ('9.2', '',  "select 'pid=' || pid || '  db=' || datname || '  user=' || usename || '  app=' || coalesce(application_name, 'N/A') || '  clientip=' || client_addr || '  duration=' || round(round(EXTRACT(EPOCH FROM (now() - query_start))) / 60) || ' mins' from pg_stat_activity where state = 'idle in transaction' and round(EXTRACT(EPOCH FROM (now() - query_start))) / 60 > %d")],
+    'longquery.count':     [('', '9.1',  "select count(*) from pg_stat_activity where current_query not ilike '<IDLE%%' and current_query <> ''::text and now() - query_start > interval '%d minutes'"),
+                            ('9.2', '9.6', "select count(*) from pg_stat_activity where state not ilike 'idle%%' and query <> ''::text and now() - query_start > interval '%d minutes'"),
+                            ('10', '',   "select count(*) from pg_stat_activity where backend_type not in ('walsender') and state not ilike 'idle%%' and query <> ''::text and now() - query_start > interval '%d minutes'")],
+    'longquery.details':   [('', '9.1',  "select 'pid=' || procpid || '  db=' || datname || '  user=' || usename || '  appname=' || application_name || '  sql=' || current_query from pg_stat_activity where current_query not ilike '<IDLE%%' and current_query <> ''::text and now() - query_start > interval '%d minutes'"),
+                            ('9.2', '9.6', "select 'pid=' || pid || '  db=' || datname || '  user=' || usename || '  appname=' || coalesce(application_name, 'N/A') || '  minutes=' || " \
+                                           "(case when state in ('active','idle in transaction') then cast(EXTRACT(EPOCH FROM (now() - query_start)) as integer) / 60 else -1 end) || '\n' ||" \
+                                           "'sql=' || regexp_replace(replace(regexp_replace(query, E'[\\n\\r]+', ' ', 'g' ),'    ',''), '[^\x20-\x7f\x0d\x1b]', '', 'g') || '\n\n'" \
+                                           "from pg_stat_activity where state not ilike 'idle%%' and query <> ''::text and now() - query_start > interval '%d minutes'"),
+                            ('10', '',   "select 'pid=' || pid || '  db=' || datname || '  user=' || usename || '  appname=' || coalesce(application_name, 'N/A') || '  minutes=' || " \
+                                         "(case when state in ('active','idle in transaction') then cast(EXTRACT(EPOCH FROM (now() - query_start)) as integer) / 60 else -1 end) || '\n' ||" \
+                                         "'sql=' || regexp_replace(replace(regexp_replace(query, E'[\\n\\r]+', ' ', 'g' ),'    ',''), '[^\x20-\x7f\x0d\x1b]', '', 'g') || '\n\n'" \
+                                         "from pg_stat_activity where backend_type not in ('walsender') and state not ilike 'idle%%' and query <> ''::text and now() - query_start > interval '%d minutes'")],
+    'idleconns.count':     [('9.2', '',  "select count(*) from pg_stat_activity where state = 'idle' %s and cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) / 60 > %d")],
+    'idleconns.details':   [('9.2', '9.6', "select 'pid=' || pid || '  db=' || coalesce(datname,'N/A') || '  user=' || coalesce(usename, 'N/A') || '  app=' || coalesce(application_name, 'N/A') || '  clientip=' || client_addr || '  state=idle' || " \
+                                           " '  backend_start=' || to_char(backend_start, 'YYYY-MM-DD HH24:MI:SS') || " \
+                                           " '  conn mins=' || cast(EXTRACT(EPOCH FROM (now() - backend_start)) / 60 as integer) || " \
+                                           " '  idle mins=' || cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) / 60 as idle_mins " \
+                                           " FROM pg_stat_activity WHERE state in ('idle') %s and cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) / 60 > %d order by cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) desc"),
+                            ('10', '',   "select 'pid=' || pid || '  db=' || coalesce(datname,'N/A') || '  user=' || coalesce(usename, 'N/A') || '  app=' || coalesce(application_name, 'N/A') || '  clientip=' || client_addr || '  state=idle' || " \
+                                         " '  backend_type=' || (case when backend_type = 'logical replication launcher' then 'logical rep launcher' when backend_type = 'autovacuum launcher' then 'autovac launcher' when backend_type = 'autovacuum worker' then 'autovac wrkr' else backend_type end) || " \
+                                         " '  backend_start=' || to_char(backend_start, 'YYYY-MM-DD HH24:MI:SS') || " \
+                                         " '  conn mins=' || cast(EXTRACT(EPOCH FROM (now() - backend_start)) / 60 as integer) || " \
+                                         " '  idle mins=' || cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) / 60 as idle_mins " \
+                                         " FROM pg_stat_activity WHERE state in ('idle') %s and cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) / 60 > %d order by cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) desc")],
+    'cachehit':            [('', '',     "SELECT blks_read, blks_hit, round((blks_hit::float/(blks_read+blks_hit+1)*100)::numeric, 2) as cachehitratio FROM pg_stat_database where datname = '%s' ORDER BY datname, cachehitratio")],
+    'connections':         [('', '',     "select count(*) from pg_stat_activity")],
+    'settings':            [('', '',     "with summary as (select name, setting from pg_settings where name in ('autovacuum', 'checkpoint_completion_target', 'data_checksums', 'idle_in_transaction_session_timeout', 'log_checkpoints', 'log_lock_waits',  'log_min_duration_statement', 'log_temp_files', 'shared_preload_libraries', 'track_activity_query_size') order by 1 ) select setting from summary order by name")],
+    'shortconns':          [('', '',     "select cast(extract(epoch from avg(now()-backend_start)) as integer) as age from pg_stat_activity")],
+    'sessions':            [('14', '',   "select cast(coalesce(sum(sessions), 0) as bigint) as sessions, cast(coalesce(sum(sessions_abandoned), 0) as bigint) as abandoned, " \
+                                         "cast(coalesce(sum(sessions_fatal), 0) as bigint) as fatal, cast(coalesce(sum(sessions_killed), 0) as bigint) as killed, " \
+                                         "cast(coalesce(sum(session_time), 0) as bigint) as session_time from pg_stat_database")],
+    # client backends by user and application in backend_start age buckets: <1s, <10s, <1m, <10m, <1h, 1h+
+    'sessions.clients':    [('14', '',   "select count(*) filter (where age < 1) as s1, count(*) filter (where age >= 1 and age < 10) as s10, count(*) filter (where age >= 10 and age < 60) as m1, " \
+                                         "count(*) filter (where age >= 60 and age < 600) as m10, count(*) filter (where age >= 600 and age < 3600) as h1, count(*) filter (where age >= 3600) as older, " \
+                                         "usename, application_name from (select coalesce(usename, '') as usename, coalesce(application_name, '') as application_name, " \
+                                         "extract(epoch from now() - backend_start) as age from pg_stat_activity where backend_type = 'client backend') a group by usename, application_name")],
+    # autovacuum workers are only told apart by backend_type from PG10, before that by the query they report
+    'autovacuum.workers':  [('9.6', '9.6', "select count(*), current_setting('autovacuum_max_workers') from pg_stat_activity where query like 'autovacuum:%'"),
+                            ('10', '',   "select count(*), current_setting('autovacuum_max_workers') from pg_stat_activity where backend_type = 'autovacuum worker'")],
+    'conflicts':           [('9.1', '9.1', "select datname, conflicts from pg_stat_database where datname = '%s'"),
+                            ('9.2', '',  "select datname, conflicts, deadlocks, temp_files, temp_bytes from pg_stat_database where datname = '%s'")],
+    # replay lag is 0 when everything received is replayed, since an idle primary would otherwise look like lag
+    'standby':             [('9.6', '9.6', "select case when pg_last_xlog_receive_location() = pg_last_xlog_replay_location() then 0 else coalesce(cast(extract(epoch from now() - pg_last_xact_replay_timestamp()) as bigint), -1) end as replaylagsecs, " \
+                                           "coalesce(cast(pg_xlog_location_diff(pg_last_xlog_receive_location(), pg_last_xlog_replay_location()) as bigint), 0) as replaylagbytes, pg_is_xlog_replay_paused() as paused, " \
+                                           "coalesce((select status from pg_stat_wal_receiver), 'stopped') as receiver, coalesce((select cast(extract(epoch from now() - last_msg_receipt_time) as bigint) from pg_stat_wal_receiver), -1) as receiversecs"),
+                            ('10', '',   "select case when pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() then 0 else coalesce(cast(extract(epoch from now() - pg_last_xact_replay_timestamp()) as bigint), -1) end as replaylagsecs, " \
+                                         "coalesce(cast(pg_wal_lsn_diff(pg_last_wal_receive_lsn(), pg_last_wal_replay_lsn()) as bigint), 0) as replaylagbytes, pg_is_wal_replay_paused() as paused, " \
+                                         "coalesce((select status from pg_stat_wal_receiver), 'stopped') as receiver, coalesce((select cast(extract(epoch from now() - last_msg_receipt_time) as bigint) from pg_stat_wal_receiver), -1) as receiversecs")],
+    'standby.conflicts':   [('9.1', '',  "select cast(coalesce(sum(confl_tablespace), 0) as bigint) as tablespace, cast(coalesce(sum(confl_lock), 0) as bigint) as lock, cast(coalesce(sum(confl_snapshot), 0) as bigint) as snapshot, " \
+                                         "cast(coalesce(sum(confl_bufferpin), 0) as bigint) as bufferpin, cast(coalesce(sum(confl_deadlock), 0) as bigint) as deadlock from pg_stat_database_conflicts")],
+    # PG17 moved the checkpoint counters to pg_stat_checkpointer and the backend writes/fsyncs to pg_stat_io.
+    # Cumulative counters, the WAL position as bytes and pg_stat_wal full page images (PG14+) are sampled for per interval deltas.
+    'checkpoints':         [('9.6', '9.6', "SELECT cast(extract(epoch from now()) as bigint) as now, checkpoints_timed as timed, checkpoints_req as req, checkpoint_write_time as writems, checkpoint_sync_time as syncms, buffers_checkpoint as buffers, " \
+                                           "coalesce(cast(extract(epoch from stats_reset) as bigint), 0) as reset, coalesce(cast(pg_xlog_location_diff(case when pg_is_in_recovery() then pg_last_xlog_replay_location() else pg_current_xlog_location() end, '0/0') as bigint), 0) as walbytes, " \
+                                           "-1 as fpi, -1 as records, cast(pg_size_bytes(current_setting('max_wal_size')) as bigint) as maxwalsize, (select cast(setting as bigint) from pg_settings where name = 'checkpoint_timeout') as timeout, " \
+                                           "cast(current_setting('checkpoint_completion_target') as float) as target FROM pg_stat_bgwriter"),
+                            ('10', '13', "SELECT cast(extract(epoch from now()) as bigint) as now, checkpoints_timed as timed, checkpoints_req as req, checkpoint_write_time as writems, checkpoint_sync_time as syncms, buffers_checkpoint as buffers, " \
+                                         "coalesce(cast(extract(epoch from stats_reset) as bigint), 0) as reset, coalesce(cast(pg_wal_lsn_diff(case when pg_is_in_recovery() then pg_last_wal_replay_lsn() else pg_current_wal_lsn() end, '0/0') as bigint), 0) as walbytes, " \
+                                         "-1 as fpi, -1 as records, cast(pg_size_bytes(current_setting('max_wal_size')) as bigint) as maxwalsize, (select cast(setting as bigint) from pg_settings where name = 'checkpoint_timeout') as timeout, " \
+                                         "cast(current_setting('checkpoint_completion_target') as float) as target FROM pg_stat_bgwriter"),
+                            ('14', '16', "SELECT cast(extract(epoch from now()) as bigint) as now, c.checkpoints_timed as timed, c.checkpoints_req as req, c.checkpoint_write_time as writems, c.checkpoint_sync_time as syncms, c.buffers_checkpoint as buffers, " \
+                                         "coalesce(cast(extract(epoch from c.stats_reset) as bigint), 0) as reset, coalesce(cast(pg_wal_lsn_diff(case when pg_is_in_recovery() then pg_last_wal_replay_lsn() else pg_current_wal_lsn() end, '0/0') as bigint), 0) as walbytes, " \
+                                         "w.wal_fpi as fpi, w.wal_records as records, cast(pg_size_bytes(current_setting('max_wal_size')) as bigint) as maxwalsize, (select cast(setting as bigint) from pg_settings where name = 'checkpoint_timeout') as timeout, " \
+                                         "cast(current_setting('checkpoint_completion_target') as float) as target FROM pg_stat_bgwriter c, pg_stat_wal w"),
+                            ('17', '',   "SELECT cast(extract(epoch from now()) as bigint) as now, c.num_timed as timed, c.num_requested as req, c.write_time as writems, c.sync_time as syncms, c.buffers_written as buffers, " \
+                                         "coalesce(cast(extract(epoch from c.stats_reset) as bigint), 0) as reset, coalesce(cast(pg_wal_lsn_diff(case when pg_is_in_recovery() then pg_last_wal_replay_lsn() else pg_current_wal_lsn() end, '0/0') as bigint), 0) as walbytes, " \
+                                         "w.wal_fpi as fpi, w.wal_records as records, cast(pg_size_bytes(current_setting('max_wal_size')) as bigint) as maxwalsize, (select cast(setting as bigint) from pg_settings where name = 'checkpoint_timeout') as timeout, " \
+                                         "cast(current_setting('checkpoint_completion_target') as float) as target FROM pg_stat_checkpointer c, pg_stat_wal w")],
+    'bgwriter.buffers':    [('', '16',   "select buffers_checkpoint + buffers_clean + buffers_backend as buffers from pg_stat_bgwriter"),
+                            ('17', '',   "select c.buffers_written + b.buffers_clean + (select coalesce(sum(writes), 0) from pg_stat_io where backend_type = 'client backend') as buffers from pg_stat_checkpointer c, pg_stat_bgwriter b")],
+    'bgwriter':            [('', '16',   "select checkpoints_timed, checkpoints_req, buffers_checkpoint, buffers_clean, maxwritten_clean, buffers_backend, buffers_backend_fsync, buffers_alloc, checkpoint_write_time / 1000 as checkpoint_write_time, checkpoint_sync_time / 1000 as checkpoint_sync_time, (100 * checkpoints_req) / (checkpoints_timed + checkpoints_req) AS checkpoints_req_pct,    pg_size_pretty(buffers_checkpoint * block_size / (checkpoints_timed + checkpoints_req)) AS avg_checkpoint_write,  pg_size_pretty(block_size * (buffers_checkpoint + buffers_clean + buffers_backend)) AS total_written,  100 * buffers_checkpoint / (buffers_checkpoint + buffers_clean + buffers_backend) AS checkpoint_write_pct,    100 * buffers_clean / (buffers_checkpoint + buffers_clean + buffers_backend) AS background_write_pct, 100 * buffers_backend / (buffers_checkpoint + buffers_clean + buffers_backend) AS backend_write_pct from pg_stat_bgwriter, (SELECT cast(current_setting('block_size') AS integer) AS block_size) bs"),
+                            ('17', '',   "select checkpoints_timed, checkpoints_req, buffers_checkpoint, buffers_clean, maxwritten_clean, buffers_backend, buffers_backend_fsync, buffers_alloc, checkpoint_write_time / 1000 as checkpoint_write_time, checkpoint_sync_time / 1000 as checkpoint_sync_time, (100 * checkpoints_req) / (checkpoints_timed + checkpoints_req) AS checkpoints_req_pct,    pg_size_pretty(buffers_checkpoint * block_size / (checkpoints_timed + checkpoints_req)) AS avg_checkpoint_write,  pg_size_pretty(block_size * (buffers_checkpoint + buffers_clean + buffers_backend)) AS total_written,  100 * buffers_checkpoint / (buffers_checkpoint + buffers_clean + buffers_backend) AS checkpoint_write_pct,    100 * buffers_clean / (buffers_checkpoint + buffers_clean + buffers_backend) AS background_write_pct, 100 * buffers_backend / (buffers_checkpoint + buffers_clean + buffers_backend) AS backend_write_pct from (select c.num_timed as checkpoints_timed, c.num_requested as checkpoints_req, c.buffers_written as buffers_checkpoint, b.buffers_clean, b.maxwritten_clean, io.writes as buffers_backend, io.fsyncs as buffers_backend_fsync, b.buffers_alloc, c.write_time as checkpoint_write_time, c.sync_time as checkpoint_sync_time from pg_stat_checkpointer c, pg_stat_bgwriter b, (select coalesce(sum(writes), 0) as writes, coalesce(sum(fsyncs), 0) as fsyncs from pg_stat_io where backend_type = 'client backend') io) s, (SELECT cast(current_setting('block_size') AS integer) AS block_size) bs")],
+}
+
+#############################################################################################
+########################### notifier backends ###############################################
+#############################################################################################
+# A notifier delivers one alert event (built by maint.send_alert()) somewhere.  -m and -s add the mail and slack notifiers,
+# and every [notifier.NAME] config section adds one more:
+#   type         --> one of NOTIFIERS
+#   severity     --> lowest severity sent (info, warning or critical), default info
+#   environments --> comma separated -e environments it applies to, default all
+# plus the options of the type (url, routing_key, path, to, facility, timeout).
+class notifier:
+    def __init__(self, name, options):
+        self.name         = name
+        self.options      = options
+        self.severity     = options.get('severity', 'info')
+        self.environments = [env.strip() for env in options.get('environments', '').split(',') if env.strip() != '']
+        if self.severity not in SEVERITIES:
+            raise ValueError("notifier %s: invalid severity %s" % (name, self.severity))
+
+    def routes(self, event):
+        if SEVERITIES.index(event['severity']) < SEVERITIES.index(self.severity):
+            return False
+        return len(self.environments) == 0 or event['environment'] in self.environments
+
+    def send(self, event):
+        # returns 0 when delivered, a notifier type without a way to deliver never does
+        return ERROR
+
+    def text(self, event):
+        if event['body'] == '':
+            return event['environment'] + '  ' + event['subject']
+        return event['environment'] + '  ' + event['subject'] + ':' + event['body']
+
+
+class mailnotifier(notifier):
+    def send(self, event):
+        # assumes nonprintables are already removed from the body, else it will send it as an attachment and not in the body of the email!
+        msg = 'echo "%s" | mailx -s "%s" %s' % (event['body'], event['environment'] + '  ' + event['subject'], self.options.get('to', event['to']))
+        return os.system(msg)
+
+
+class httpnotifier(notifier):
+    # one keep-alive connection per host for the life of the process, so --interval mode does not connect for every alert
+    connections = {}
+
+    def post(self, url, payload):
+        import http.client
+        from urllib.parse import urlsplit
+        parts = urlsplit(url)
+        key   = (parts.scheme, parts.netloc)
+        path  = parts.path + ('?' + parts.query if parts.query != '' else '')
+        body  = json.dumps(payload, default=str).encode('utf-8')
+        for attempt in (1, 2):
+            conn = httpnotifier.connections.get(key)
+            if conn is None:
+                timeout = float(self.options.get('timeout', 10))
+                if parts.scheme == 'https':
+                    conn = http.client.HTTPSConnection(parts.netloc, timeout=timeout)
+                else:
+                    conn = http.client.HTTPConnection(parts.netloc, timeout=timeout)
+                httpnotifier.connections[key] = conn
+            try:
+                conn.request('POST', path, body=body, headers={'Content-Type': 'application/json', 'Connection': 'keep-alive'})
+                response = conn.getresponse()
+                response.read()
+                return 0 if response.status < 300 else response.status
+            except (OSError, http.client.HTTPException):
+                # the server may have closed the idle connection, so reconnect once
+                conn.close()
+                del httpnotifier.connections[key]
+        return 1
+
+
+class slacknotifier(httpnotifier):
+    def send(self, event):
+        url = self.options.get('url', '')
+        if url == '':
+            # slack hook found in users home dir/.slackhook file, only read when slack is used
+            try:
+                with open(os.path.expanduser("~") + '/.slackhook') as f:
+                    url = f.readline().strip('\n')
+            except OSError:
+                return 1
+            self.options['url'] = url
+        return self.post(url, {'text': self.text(event)})
+
+
+class webhooknotifier(httpnotifier):
+    def send(self, event):
+        return self.post(self.options['url'], event)
+
+
+class eventnotifier(httpnotifier):
+    # event API style (PagerDuty Events v2): firing alerts trigger and resolved alerts resolve the same dedup_key, which is
+    # the instance and the check:type key of the alert state, so the same alert type raised by two checks stays two incidents
+    def send(self, event):
+        payload = {'routing_key': self.options.get('routing_key', ''), 'event_action': 'resolve' if event['status'] == 'resolved' else 'trigger',
+                   'dedup_key': "%s/%s:%s" % (event['instance'], event['check'], event['type']),
+                   'payload': {'summary': self.text(event), 'source': event['instance'], 'severity': event['severity'],
+                               'component': PROGNAME, 'group': event['environment'], 'custom_details': event}}
+        return self.post(self.options.get('url', 'https://events.pagerduty.com/v2/enqueue'), payload)
+
+
+class syslognotifier(notifier):
+    def send(self, event):
+        # journald picks up syslog messages too
+        import syslog
+        facility = getattr(syslog, 'LOG_' + self.options.get('facility', 'user').upper())
+        priority = {'info': syslog.LOG_INFO, 'warning': syslog.LOG_WARNING, 'critical': syslog.LOG_CRIT}[event['severity']]
+        syslog.openlog(PROGNAME, syslog.LOG_PID, facility)
+        syslog.syslog(priority, self.text(event))
+        return 0
+
+
+class spoolnotifier(notifier):
+    # one json event per line for another process to pick up
+    def send(self, event):
+        try:
+            with open(self.options['path'], 'a') as f:
+                f.write(json.dumps(event, default=str) + '\n')
+        except OSError:
+            return 1
+        return 0
+
+
+NOTIFIERS = {'mail': mailnotifier, 'slack': slacknotifier, 'webhook': webhooknotifier, 'event': eventnotifier, 'syslog': syslognotifier, 'spool': spoolnotifier}
 
 #############################################################################################
 ########################### class definition ################################################
@@ -137,10 +487,11 @@ PGHOSTUP="PGHostUp"
 class maint:
     def __init__(self):
 
+        self.clockoffset       = 0
         self.dateprogstr       = PROGDATE
         self.dateprog          = datetime.strptime(PROGDATE, "%Y-%m-%d")
-        self.datenowstr        = datetime.now().strftime("%Y-%m-%d")
-        self.datenow           = datetime.today()
+        self.datenowstr        = self.clock().strftime("%Y-%m-%d")
+        self.datenow           = self.clock()
         self.datediff          = self.datenow - self.dateprog
 
         self.genchechs         = ''
@@ -164,19 +515,47 @@ class maint:
         self.checkreplication  = False
         self.checkpgbouncer    = False
         self.checkpgbackrest   = False
-
-        # slack hook found in users home dir/.slackhook file
-        hookfile = os.path.expanduser("~") + '/.slackhook'
-        with open(hookfile) as f:
-            self.slackhook = f.readline().strip('\n')
-        #print ('slackhook=%s' % self.slackhook)
-
-        self.to                = 'michaeldba@sqlexec.com'
-        #self.to                = 'michaeldba@sqlexec.com xxxx@whatever.com'
-        self.from_             = 'pgdude@noreply.com'
+        self.adaptive          = False
+        self.pressure          = {}
+        self.skipped           = []
+        self.pgoptions         = ''
+        self.underpressure     = False
+        self.timestart         = self.now()
+        self.deadline          = -1
+        self.lockfile          = ''
+        self.lockowned         = False
+        self.configfile        = ''
+        self.config            = configparser.ConfigParser()
+        self.statefile         = ''
+        self.state             = {'lastrun': {}}
+        self.instance          = ''
+        self.metrics           = []
+        self.outformat         = 'text'
+        self.checkid           = ''
+        self.checkout          = []
+        self.checkvalues       = {}
+        self.records           = []
+        self.checkstart        = self.now()
+        self.warnings          = []
+        self.alldatabases      = False
+        self.jobs              = 0
+        self.sweeping          = False
+        self.outbuf            = None
+
+        self.notifiers         = []
+        self.alerttype         = ''
+        self.to                = ''
+        self.from_             = ''
 
         self.fout              = ''
         self.connstring        = ''
+        self.workfile          = ''
+        self.queries           = {}
+        self.interval          = 0
+        self.session           = None
+        self.sessionopts       = ''
+        self.prepared          = {}
+        self.batch             = {}
 
         self.schemaclause      = ' '
         self.pid               = os.getpid()
@@ -187,19 +566,30 @@ class maint:
         self.pgversionmajor    = Decimal('0.0')
         self.pgversionminor    = '0.0'
         self.programdir        = ''
-        self.alertsfile        = ''
-        self.alertslist        = []
-        # default is 15 mins
-        self.alertmaxsecs      = 900
+        self.breached          = []
 
         self.slaves            = []
         self.slavecnt          = 0
         self.in_recovery       = False
+        self.confkey           = ''
+        self.historyname       = 'pg_check.db'
+        self.cpusgiven         = False
+        self.capture           = ''
+        self.captured          = []
+        self.capturestates     = {}
+        self.replay            = ''
+        self.replayruns        = []
+        self.replayprobes      = {}
+        self.replaycount       = 0
+        self.replaystart       = 0
+        self.replaymisses      = []
+        self.replayalerts      = []
+        self.firstquery        = -1
         self.bloatedtables     = False
         self.unusedindexes     = False
         self.freezecandidates  = False
         self.analyzecandidates = False
-        self.timestartmins     = time.time() / 60
+        self.timestartmins     = self.now() / 60
 
         # db config stuff
         self.archive_mode      = ''
@@ -216,35 +606,69 @@ class maint:
 
         self.overcommit_memory = -1
         self.overcommit_ratio  = -1
+        self.huge_pages        = ''
+        self.shmem_hugepages   = -1
+        self.autovacuum_max_workers = 3
 
     ###########################################################
-    def send_alert(self, to, from_, subject, body):
-        # assumes nonprintables are already removed from the body, else it will send it as an attachment and not in the body of the email!
-        # msg = 'echo "%s" | mailx -s "%s" -r %s -- %s' % (body, subject, to, from_)
+    def send_alert(self, to, from_, subject, body, status='firing'):
+        # hand the alert to every notifier routed for its severity and environment.  self.alerttype is the alert
+        # alert() or settle_alerts() just decided on, settle_alerts() passes status='resolved'.
         rc = 0
-        msg2 = self.environment + '  ' + subject
-        msg = 'echo "%s" | mailx -s "%s" %s' % (body, msg2, to)
-        # print ("DEBUG: msg=%s" % msg)
-        if self.mailnotify:
+        if self.sweeping:
+            subject = self.database + ': ' + subject
+        event  = {'ts': self.clock().strftime("%Y-%m-%dT%H:%M:%S"), 'instance': self.instance, 'environment': self.environment,
+                  'database': self.database, 'check': self.checkid, 'type': self.alerttype, 'status': status,
+                  'severity': ALERTSEVERITY.get(self.alerttype, 'warning'),
+                  'subject': subject, 'body': body, 'to': to, 'from': from_}
+        if self.replay != '':
+            self.replayalerts.append(event)
             if self.verbose:
-                print ("[****]  sending email...")
-            rc = os.system(msg)
-        if self.slacknotify:
-          if self.verbose:
-              print ("[****]  sending to slack...")
-          if body == '':
-              msg2 = self.environment + '  ' + subject
-          else:
-              msg2 = self.environment + '  ' + subject + ':' + body
-          msg = 'curl --location "' + self.slackhook + '" --header "Content-Type: application/json" --data "{\"text\": \\"' + msg2 + '\\"}"'
-          # weird "ok" string printed as output from os.system call, so route to /dev/null
-          msg = msg + ">/dev/null 2>&1"
-          rc = os.system(msg)
+                print ("[****]  replay %s %s alert: %s" % (event['status'], event['severity'], subject))
+        for anotifier in self.notifiers:
+            if not anotifier.routes(event):
+                continue
+            if self.verbose:
+                print ("[****]  sending to %s..." % anotifier.name)
+            arc = anotifier.send(event)
+            if arc != 0:
+                self.writeout("[ERROR] %s notifier failed: %s" % (anotifier.name, arc))
+                rc = arc
         return rc
 
+    ###########################################################
+    def load_notifiers(self):
+        self.notifiers = []
+        if self.replay != '':
+            self.mailnotify  = False
+            self.slacknotify = False
+        if self.mailnotify:
+            self.notifiers.append(mailnotifier('mail', {}))
+        if self.slacknotify:
+            if not os.path.isfile(os.path.expanduser("~") + '/.slackhook'):
+                return ERROR, "Slack notifications need a webhook in %s" % (os.path.expanduser("~") + '/.slackhook')
+            self.notifiers.append(slacknotifier('slack', {}))
+        for section in self.config.sections():
+            if not section.startswith('notifier.'):
+                continue
+            options = dict(self.config.items(section))
+            ntype   = options.get('type', '')
+            if ntype not in NOTIFIERS:
+                return ERROR, "Invalid notifier type in [%s]: %s.  Use one of: %s" % (section, ntype, ', '.join(NOTIFIERS))
+            if ntype in ('webhook', 'spool') and options.get('url', options.get('path', '')) == '':
+                return ERROR, "[%s] needs %s" % (section, 'url' if ntype == 'webhook' else 'path')
+            if self.replay != '' and ntype != 'spool':
+                # a replay never pages anyone, but a spool keeps its notifications for comparing runs
+                continue
+            try:
+                self.notifiers.append(NOTIFIERS[ntype](section[9:], options))
+            except ValueError as e:
+                return ERROR, str(e)
+        return SUCCESS, ''
+
     ###########################################################
     def set_dbinfo(self, dbhost, dbport, dbuser, database, schema, genchecks, waitslocks, longquerymins, idleintransmins, idleconnmins, cpus, \
-                   environment, testmode, verbose, debug, slacknotify, mailnotify, checkreplication, checkpgbouncer, checkpgbackrest, argv):
+                   environment, testmode, verbose, debug, slacknotify, mailnotify, checkreplication, checkpgbouncer, checkpgbackrest, configfile, adaptive, outformat, interval, alldatabases, jobs, capture, replay, argv):
         self.waitslocks       = waitslocks
         self.dbhost           = dbhost
         self.dbport           =  dbport
@@ -261,6 +685,29 @@ class maint:
         self.checkreplication = checkreplication
         self.checkpgbouncer   = checkpgbouncer
         self.checkpgbackrest  = checkpgbackrest
+        self.configfile       = configfile
+        self.adaptive         = adaptive
+        self.outformat        = outformat
+        self.interval         = interval
+        self.alldatabases     = alldatabases
+        self.jobs             = jobs
+        self.capture          = capture
+        self.replay           = replay
+
+        if capture != '' and replay != '':
+            return ERROR, "--capture and --replay cannot be used together."
+
+        if replay != '' and interval > 0:
+            return ERROR, "--replay runs the recorded runs back to back, so it cannot be used with --interval."
+
+        if jobs is None or jobs < 0:
+            return ERROR, "Invalid jobs provided: %s" % jobs
+
+        if interval is None or interval < 0:
+            return ERROR, "Invalid interval provided: %s" % interval
+
+        if outformat not in FORMATS:
+            return ERROR, "Invalid format provided: %s.  Use one of: %s" % (outformat, ', '.join(FORMATS))
 
         if waitslocks == -999:
             #print("waitslocks not passed")
@@ -272,19 +719,18 @@ class maint:
 
         if cpus == -999:
             #print("cpus not passed")
-            # cat /proc/cpuinfo | grep processor | wc -l
-            cmd = 'cat /proc/cpuinfo | grep processor | wc -l'
-            rc, results = self.executecmd(cmd, True)
-            if rc != SUCCESS:
+            # same count as /proc/cpuinfo processors without spawning a shell
+            if os.cpu_count() is None:
                 # just pass
-                print ("Unable to get CPU count.")
+                self.writeout("Unable to get CPU count.")
             else:
-                self.cpus = int(results)
+                self.cpus = os.cpu_count()
                 #print("Cpus=%d" % self.cpus)
         elif cpus is None or cpus < 1:
             return ERROR, "Invalid CPUs provided: %s" % cpus
         else:
             self.cpus            = cpus
+            self.cpusgiven       = True
 
         if longquerymins == -999:
             #print("longquerymins not passed")
@@ -310,13 +756,6 @@ class maint:
         else:
             self.idleconnmins = idleconnmins
 
-        if self.testmode:
-            self.to  = 'michaeldba@sqlexec.com '
-            #print("testing mode")
-        else:
-            #self.to  = 'michaeldba@sqlexec.com xxxxx@whatever.com'
-            self.to  = 'michaeldba@sqlexec.com'
-
         # process the schema or table elements
         total   = len(argv)
         cmdargs = str(argv)
@@ -336,15 +775,7 @@ class maint:
         self.reportfile        = "%s%s%s_report.txt" % (self.tempdir, self.dir_delim, self.pid)
 
         # construct the connection string that will be used in all database requests
-        # do not provide host name and/or port if not provided
-        if self.dbhost != '':
-            self.connstring = " -h %s " % self.dbhost
-        if self.database != '':
-            self.connstring += " -d %s " % self.database
-        if self.dbport != '':
-            self.connstring += " -p %s " % self.dbport
-        if self.dbuser != '':
-            self.connstring += " -U %s " % self.dbuser
+        self.connstring = self.get_connstring(self.database)
         if self.schema != '':
             self.schemaclause = " and n.nspname = '%s' " % self.schema
 
@@ -360,55 +791,52 @@ class maint:
 
         self.programdir = sys.path[0]
 
-        # Make sure psql is in the path
-        if self.opsys == 'posix':
-            cmd = "which psql"
-        else:
-            # assume windows
-            cmd = "where psql"
-        rc, results = self.executecmd(cmd, True)
+        # load check registry overrides and the per instance state (last run times, etc.)
+        rc, results = self.load_config()
         if rc != SUCCESS:
-            errors = "Unable to determine if psql is in path. rc=%d results=%s" % (rc,results)
-            return rc, errors
-        if 'psql' not in results:
-            msg = "psql must be in the path. rc=%d, results=%s" % (rc, results)
-            return ERROR, msg
-
-        pos = results.find('psql')
-        if pos > 0:
-            self.pgbindir = results[0:pos]
+            return rc, results
+        self.load_state()
 
-       # get history of alerts to control current sesssion alerts
-        self.alertsfile = self.programdir + '/' + 'pg_check.alerts'
-        if os.path.isfile(self.alertsfile):
-            # read in last 30 alerts for subsequent checking
-            #print ("Alerts file found.")
-            with open(self.alertsfile) as file:
-                for aline in (file.readlines() [-30:]):
-                    self.alertslist += [aline.strip()]
-            #print("The list: " + str(self.alertslist))
+        if self.testmode:
+            self.to = self.get_setting('notify', 'testmailto')
         else:
-            #print("alerts file not found: %s" % self.alertsfile)
-            pass
-
-        rc, results = self.get_configinfo()
+            self.to = self.get_setting('notify', 'mailto')
+        self.from_ = self.get_setting('notify', 'mailfrom')
+        rc, results = self.load_notifiers()
         if rc != SUCCESS:
-            errors = "rc=%d results=%s" % (rc,results)
-            return rc, errors
+            return rc, results
 
-        rc, results = self.get_pgversion()
+        if self.replay != '':
+            # recorded runs need neither psql nor the lock that keeps live runs from stacking up
+            self.pgoptions = self.get_pgoptions('')
+            return self.load_replay()
+
+        # guard against runs stacking up on top of each other and bound how long this one can run
+        self.deadline = self.timestart + self.get_setting('guardrails', 'deadline')
+        rc, results = self.acquire_lock()
         if rc != SUCCESS:
             return rc, results
+        self.pgoptions = self.get_pgoptions('')
 
-        print ("%s  version: %.1f  %s     Python Version: %d     PG Version: %s  local detected=%r   PG Database: %s\n\n" \
-               % (PROGNAME, VERSION, ADATE, sys.version_info[0], self.pgversionminor, self.local, self.database))
+        # Make sure psql is in the path
+        results = shutil.which('psql')
+        if results is None:
+            msg = "psql must be in the path."
+            return ERROR, msg
+
+        pos = results.find('psql')
+        if pos > 0:
+            self.pgbindir = results[0:pos]
 
+        return self.start_run()
+
+    ###########################################################
+    def start_run(self):
         # See if we can even connect to the PG host.
-        # If not, treat as PG host down warning
-        sql = 'SELECT 1'
-        cmd = "psql %s -At -X -c \"%s\" > %s" % (self.connstring, sql, self.tempfile)
-        rc, results = self.executecmd(cmd, False)
+        # If not, treat as PG host down warning.  The same first query gets the version and recovery state.
+        rc, results = self.get_pgversion()
         if rc != SUCCESS:
+            self.start_check('pghostup')
             marker = MARK_WARN
             if 'could not connect to server' in results or 'Connection refused' in results:
                 msg = 'PG Connection Refused.'
@@ -416,21 +844,53 @@ class maint:
                 msg = 'Unexpected PG Connection Error'
             subject = msg
             if self.alert(PGHOSTUP):
-                rc = self.send_alert(self.to, self.from_, subject, '')
-            print (marker+msg)
+                # keep rc: the run stops here whether or not the notification went out
+                if self.send_alert(self.to, self.from_, subject, '') != 0:
+                    self.writeout("mail error")
+            self.emit(marker, msg)
+            self.end_check(rc, results)
+            self.save_state()
+            self.end_report()
             return rc, results
-        else:
-            marker = MARK_OK
-            msg = 'PG Host is up.'
-            print (marker+msg)
+
+        rc, results = self.get_configinfo()
+        if rc != SUCCESS:
+            errors = "rc=%d results=%s" % (rc,results)
+            return rc, errors
+
+        if self.outformat == 'text':
+            print ("%s  version: %.1f  %s     Python Version: %d     PG Version: %s  local detected=%r   standby=%r   PG Database: %s\n\n" \
+                   % (PROGNAME, VERSION, ADATE, sys.version_info[0], self.pgversionminor, self.local, self.in_recovery, self.database))
+
+        self.start_check('pghostup')
+        marker = MARK_OK
+        msg = 'PG Host is up.'
+        self.emit(marker, msg)
+        self.end_check(SUCCESS, '')
 
         return SUCCESS, ''
 
 
+    ###########################################################
+    def get_connstring(self, database):
+        # do not provide host name and/or port if not provided
+        connstring = ''
+        if self.dbhost != '':
+            connstring = " -h %s " % self.dbhost
+        if database != '':
+            connstring += " -d %s " % database
+        if self.dbport != '':
+            connstring += " -p %s " % self.dbport
+        if self.dbuser != '':
+            connstring += " -U %s " % self.dbuser
+        return connstring
+
     ###########################################################
     def log_alert(self, msg):
+        if self.replay != '':
+            return
         afile = open(self.programdir + '/' + 'pg_check.alerts', "a")
-        n = datetime.now()
+        n = self.clock()
         adate = n.strftime("%Y-%m-%d %H:%M:%S")
         afile.write(adate + '*' + msg + '\n')
         afile.close()
@@ -439,101 +899,578 @@ class maint:
 
     ###########################################################
     def alert(self, msg):
-        #print("msg=%s" % msg)
-        doit = False
-        noalerts = True
-        dt1 = datetime.now()
-
-        for alert in self.alertslist:
-            noalerts = False
-            parts = alert.split('*')
-            adatetimestr = parts[0].strip()
-            adatetimeobj = datetime.strptime(adatetimestr, "%Y-%m-%d %H:%M:%S")
-            analert   = parts[1].strip()
-            if analert != msg:
-                continue
-            diff = dt1 - adatetimeobj
-            secs = diff.seconds
+        # alert state machine per check and alert type, kept in the state file so it is per instance and database:
+        #   OK --> PENDING on the first breach --> FIRING after 'breaches' consecutive breaches (notify) --> FIRING notifies again
+        #   on escalating 'renotify' intervals --> RESOLVING after 'clears' consecutive clean runs of the check that raised it
+        #   --> RESOLVED once the resolved notification went out.  A breach while RESOLVING makes it FIRING again.
+        # Returns True when the caller should send its notification now.
+        now    = int(self.now())
+        alerts = self.state.setdefault('alerts', {})
+        key    = self.checkid + ':' + msg
+        if key in self.breached:
+            # already decided for this run of the check
+            return False
+        self.breached.append(key)
 
-            # only alert on certain types of conditions
-            if self.debug:
-                print("alert checking with analert=%s  seconds=%d and max seconds=%d..." % (analert, secs,self.alertmaxsecs))
-            if secs > self.alertmaxsecs:
+        astate = alerts.get(key)
+        if astate is None:
+            astate = {'status': 'PENDING', 'check': self.checkid, 'type': msg, 'breaches': 0, 'clears': 0, 'since': now, 'notified': 0, 'notifies': 0}
+            alerts[key] = astate
+        astate['breaches'] += 1
+        astate['clears']    = 0
+
+        if astate['status'] == 'PENDING':
+            if astate['breaches'] < self.get_setting('alerts', 'breaches'):
                 if self.debug:
-                    print("alert qualifies")
-                if msg == TESTALERT:
-                    doit = True
-                elif msg ==ACTIVECONNS:
-                    doit = True
-                elif msg ==LOAD1:
-                    doit = True
-                elif msg ==LOAD5:
-                    doit = True
-                elif msg ==LOAD15:
-                    doit = True
-                elif msg ==DIRSIZE:
-                    doit = True
-                elif msg ==WAITS:
-                    doit = True
-                elif msg ==REPLICATION:
-                    doit = True
-                elif msg ==IDLEINTRANS:
-                    doit = True
-                elif msg ==LONGQUERY:
-                    doit = True
-                elif msg ==PGBOUNCER1:
-                    doit = True
-                # skip PGBOUNCER2
-                elif msg ==PGBOUNCER3:
-                    doit = True
-                elif msg ==PGBACKREST1:
-                    doit = True
-                elif msg ==PGHOSTUP:
-                    doit = True
-            else:
-                # found but does not qualify
-                doit = False
+                    print("alert %s pending: breach %d of %d" % (msg, astate['breaches'], self.get_setting('alerts', 'breaches')))
+                return False
+            astate['status'] = 'FIRING'
+        else:
+            astate['status'] = 'FIRING'
+            renotify = [int(secs) for secs in self.get_setting('alerts', 'renotify').split(',')]
+            wait     = renotify[min(astate['notifies'] - 1, len(renotify) - 1)]
+            if now - astate['notified'] < wait:
                 if self.debug:
-                    print("alert not qualified")
+                    print("alert %s firing, bypassed: notified %d seconds ago, next in %d seconds" % (msg, now - astate['notified'], wait))
+                return False
 
-        if noalerts:
-            # no alerts in alert file so alert
-            doit = True
-            # log the alert
-            self.log_alert(msg)
-            if self.debug:
-                print("no alerts found. Do alert...")
-            return True
+        if self.debug:
+            print("do alert %s (notification %d)..." % (msg, astate['notifies'] + 1))
+        astate['notified']  = now
+        astate['notifies'] += 1
+        self.alerttype      = msg
+        self.log_alert(msg)
+        return True
 
-        if doit:
-            if self.debug:
-                print("do alert...")
-            # log the alert
-            self.log_alert(msg)
-            return True
+    ###########################################################
+    def settle_alerts(self):
+        # the check just run cleanly did not breach these alerts again: a pending one goes back to OK,
+        # a firing one is resolved after enough clean runs in a row so a flapping condition does not notify every time.
+        # It stays RESOLVING, and the resolved notification is sent again on the next clean run, until the send succeeds.
+        alerts = self.state.get('alerts', {})
+        for key, astate in list(alerts.items()):
+            if astate['check'] != self.checkid or key in self.breached:
+                continue
+            if astate['status'] == 'PENDING':
+                del alerts[key]
+                continue
+            astate['clears'] += 1
+            if astate['clears'] < self.get_setting('alerts', 'clears'):
+                continue
+            msg = astate['type']
+            first = astate['status'] != 'RESOLVING'
+            if first:
+                astate['status']   = 'RESOLVING'
+                astate['resolved'] = int(self.now())
+                self.log_alert(msg + ' Resolved')
+            subject = "Resolved: %s alert cleared after %d minutes" % (msg, (astate['resolved'] - astate['since']) / 60)
+            if first:
+                marker = MARK_OK
+                self.emit(marker, subject)
+            if self.get_setting('alerts', 'resolved'):
+                self.alerttype = msg
+                rc = self.send_alert(self.to, self.from_, subject, '', 'resolved')
+                if rc != 0:
+                    self.writeout("[ERROR] Resolved notification for %s failed, it is sent again on the next run." % msg)
+                    continue
+            del alerts[key]
+        return
+
+    ###########################################################
+    def load_config(self):
+        # config file is optional unless explicitly provided
+        if self.configfile == '':
+            configfile = self.programdir + '/' + 'pg_check.conf'
+            if not os.path.isfile(configfile):
+                return SUCCESS, ''
         else:
-            if self.debug:
-                print("alert bypassed...")
+            configfile = self.configfile
+            if not os.path.isfile(configfile):
+                return ERROR, "Config file not found: %s" % configfile
+
+        try:
+            self.config.read(configfile)
+        except configparser.Error as e:
+            return ERROR, "Invalid config file (%s): %s" % (configfile, e)
+
+        for section in self.config.sections():
+            checkid = section.split(':')[0]
+            if checkid not in CHECKS and checkid not in SETTINGS and not section.startswith('notifier.'):
+                return ERROR, "Unknown check in config file (%s): %s" % (configfile, section)
+
+        if self.verbose:
+            print ("[****]  config file loaded: %s" % configfile)
+        return SUCCESS, ''
+
+    ###########################################################
+    def get_setting(self, checkid, name, default=None):
+        # environment specific section wins over the general section, which wins over the registry default
+        meta = CHECKS.get(checkid, {'thresholds': SETTINGS.get(checkid, {})})
+        if default is not None:
+            pass
+        elif name in meta['thresholds']:
+            default = meta['thresholds'][name]
+        elif name == 'enabled':
+            default = True
+        else:
+            default = meta[name]
+
+        value = None
+        for section in (checkid + ':' + self.environment, checkid):
+            if self.config.has_option(section, name):
+                value = self.config.get(section, name)
+                break
+        if value is None:
+            return default
+
+        if isinstance(default, bool):
+            return self.config.BOOLEAN_STATES.get(value.lower(), default)
+        elif isinstance(default, Decimal):
+            return Decimal(value)
+        elif isinstance(default, int):
+            return int(value)
+        elif isinstance(default, float):
+            return float(value)
+        return value
+
+    ###########################################################
+    def check_enabled(self, checkid):
+        meta = CHECKS[checkid]
+        if not self.get_setting(checkid, 'enabled'):
+            if self.verbose:
+                print ("[****]  %s check disabled." % checkid)
+            return False
+
+        if meta['minver'] != '' and self.pgversionmajor < Decimal(meta['minver']):
+            return False
+        if (checkid in PRIMARYONLY and self.in_recovery) or (checkid in STANDBYONLY and not self.in_recovery):
+            if self.verbose:
+                print ("[****]  %s check does not apply to a %s." % (checkid, 'standby' if self.in_recovery else 'primary'))
+            return False
+        if meta['maxver'] != '' and self.pgversionmajor > Decimal(meta['maxver']):
+            return False
+
+        interval = self.get_setting(checkid, 'interval')
+        secs = int(self.now()) - self.state['lastrun'].get(checkid, 0)
+        if interval > 0 and secs < interval:
+            if self.verbose:
+                print ("[****]  %s check not due yet. Last run %d seconds ago, interval=%d" % (checkid, secs, interval))
             return False
+        return True
+
+    ###########################################################
+    def load_state(self):
+        # state is kept per PG instance and database since many instances can be checked from the same program directory
+        self.instance  = self.get_instance(self.dbhost, self.dbport, self.database)
+        self.statefile = "%s/pg_check_%s.state" % (self.programdir, self.instance)
+        if self.replay != '':
+            # a replay never touches the live state.  Its first run starts from the state recorded with it, see next_replay().
+            self.statefile = "%s/pg_check_%s.replay.state" % (self.programdir, self.instance)
+        if os.path.isfile(self.statefile):
+            try:
+                with open(self.statefile) as f:
+                    self.state = json.load(f)
+            except ValueError:
+                self.writeout("Ignoring corrupt state file: %s" % self.statefile)
+        self.state.setdefault('lastrun', {})
+        for key, astate in list(self.state.get('alerts', {}).items()):
+            # state files from before alerts were kept per check are keyed by alert type only
+            if 'type' not in astate:
+                astate['type'] = key
+                self.state['alerts'][astate['check'] + ':' + key] = self.state['alerts'].pop(key)
+        if self.capture != '':
+            # the state this run starts from, so a replay of it starts from the same place
+            self.capturestates[self.instance] = json.loads(json.dumps(self.state))
+        return
+
+    ###########################################################
+    def get_instance(self, dbhost, dbport, database):
+        if dbhost == '':
+            dbhost = 'local'
+        return "%s_%s_%s" % (dbhost, dbport, database)
+
+    ###########################################################
+    def save_state(self):
+        if self.statefile == '':
+            return
+        # write to a temp file first so a killed run never leaves a truncated state file
+        afile = self.statefile + '.tmp'
+        with open(afile, "w") as f:
+            json.dump(self.state, f)
+        os.replace(afile, self.statefile)
+        return
+
+    ###########################################################
+    def record(self, metric, value):
+        # numeric check results are buffered and written to the history store once at the end of the run
+        if value is not None:
+            self.metrics.append((metric, int(self.now()), float(value)))
+            self.checkvalues[metric] = float(value)
+        return
+
+    ###########################################################
+    def emit(self, marker, msg):
+        # text output prints each result line as is, the structured formats collect them into one record per check
+        if marker == MARK_WARN and self.checkid not in self.warnings:
+            self.warnings.append(self.checkid)
+        if self.outformat != 'text':
+            self.checkout.append((marker, msg))
+        elif self.outbuf is not None:
+            # database sweep worker: printed by the main thread once the database is done
+            self.outbuf.append(marker + self.database + ': ' + msg)
+        else:
+            print (marker+msg)
+        return
+
+    ###########################################################
+    def start_check(self, checkid):
+        self.checkid     = checkid
+        self.checkout    = []
+        self.checkvalues = {}
+        self.checkstart  = self.now()
+        self.breached    = []
+        return
+
+    ###########################################################
+    def end_check(self, rc, errors):
+        # build the structured record for the check just run: ndjson streams it right away, json collects it for end_report()
+        if rc == SUCCESS and self.checkid != '':
+            self.settle_alerts()
+        if self.outformat == 'text' or self.checkid == '':
+            return
+        if len(self.checkout) == 0 and rc == SUCCESS:
+            # nothing to report, e.g. the check does not apply to this host
+            self.checkid = ''
+            return
+        status  = 'ok'
+        message = ''
+        details = []
+        for marker, msg in self.checkout:
+            lines = [aline.strip() for aline in msg.split('\n') if aline.strip() != '']
+            if len(lines) == 0:
+                continue
+            astatus = {MARK_OK: 'ok', MARK_WARN: 'warn', MARK_SKIP: 'skip'}.get(marker, 'ok')
+            if message == '' or (astatus == 'warn' and status != 'warn'):
+                if message != '':
+                    details.insert(0, message)
+                message = lines[0]
+            else:
+                details.append(lines[0])
+            details += lines[1:]
+            if astatus == 'warn' or (astatus == 'skip' and status == 'ok'):
+                status = astatus
+        if rc != SUCCESS:
+            status  = 'error'
+            message = errors.strip() if isinstance(errors, str) else str(errors)
+
+        thresholds = {}
+        if self.checkid in CHECKS:
+            for name in CHECKS[self.checkid]['thresholds']:
+                thresholds[name] = self.get_setting(self.checkid, name)
+                if isinstance(thresholds[name], Decimal):
+                    thresholds[name] = float(thresholds[name])
+        record = {'ts': self.clock().strftime("%Y-%m-%dT%H:%M:%S"), 'instance': self.instance, 'environment': self.environment,
+                  'check': self.checkid, 'status': status, 'message': message, 'value': self.checkvalues, 'threshold': thresholds,
+                  'details': details, 'duration_ms': int((self.now() - self.checkstart) * 1000)}
+        if self.outformat == 'ndjson' and self.outbuf is not None:
+            self.outbuf.append(json.dumps(record, default=str))
+        elif self.outformat == 'ndjson':
+            print (json.dumps(record, default=str), flush=True)
+        else:
+            self.records.append(record)
+        self.checkid = ''
+        return
+
+    ###########################################################
+    def end_report(self):
+        # every run ends here, host down or not, so this is where its recorded probes are written
+        if self.capture != '':
+            self.flush_capture()
+        if self.outformat == 'json':
+            print (json.dumps({'instance': self.instance, 'environment': self.environment, 'pgversion': self.pgversionminor,
+                               'checks': self.records}, indent=2, default=str))
+        return
+
+    ###########################################################
+    def open_history(self):
+        import sqlite3
+        conn = sqlite3.connect(self.programdir + '/' + self.historyname, timeout=10)
+        conn.execute("CREATE TABLE IF NOT EXISTS metrics (instance text, metric text, rollup text, ts integer, cnt integer, vmin real, vmax real, vsum real, "
+                     "PRIMARY KEY (instance, metric, rollup, ts)) WITHOUT ROWID")
+        # slot is the hour of the week (0 = Monday midnight), ALLHOURS is the non seasonal baseline
+        conn.execute("CREATE TABLE IF NOT EXISTS baselines (instance text, metric text, slot integer, cnt integer, mean real, dev real, "
+                     "PRIMARY KEY (instance, metric, slot)) WITHOUT ROWID")
+        return conn
+
+    ###########################################################
+    def flush_history(self):
+        if len(self.metrics) == 0 or not self.get_setting('history', 'enabled'):
+            self.metrics = []
+            return
+        upsert = "INSERT INTO metrics VALUES (?, ?, ?, ?, 1, ?, ?, ?) ON CONFLICT (instance, metric, rollup, ts) DO UPDATE SET " \
+                 "cnt = cnt + 1, vmin = min(vmin, excluded.vmin), vmax = max(vmax, excluded.vmax), vsum = vsum + excluded.vsum"
+        rows = []
+        for metric, ts, value in self.metrics:
+            rows.append((self.instance, metric, 'raw', ts, value, value, value))
+            rows.append((self.instance, metric, '1m', ts - ts % 60, value, value, value))
+            rows.append((self.instance, metric, '1h', ts - ts % 3600, value, value, value))
+        now = int(self.now())
+        import sqlite3
+        try:
+            conn = self.open_history()
+            with conn:
+                conn.executemany(upsert, rows)
+                for rollup, setting in (('raw', 'raw_days'), ('1m', 'minute_days'), ('1h', 'hour_days')):
+                    conn.execute("DELETE FROM metrics WHERE instance = ? AND rollup = ? AND ts < ?", (self.instance, rollup, now - self.get_setting('history', setting) * 86400))
+            conn.close()
+        except sqlite3.Error as e:
+            self.writeout("Unable to write check history: %s" % e)
+        self.metrics = []
+        return
+
+    ###########################################################
+    def check_anomalies(self):
+        # compare this run's metrics to their learned baselines, then fold them into the baselines.
+        # Memory is bounded: at most 169 baseline rows per metric no matter how long the history is.
+        if not self.get_setting('anomaly', 'enabled'):
+            return SUCCESS, ""
+        tracked = [metric.strip() for metric in self.get_setting('anomaly', 'metrics').split(',') if metric.strip() != '']
+        values  = {}
+        for metric, ts, value in self.metrics:
+            if metric in tracked:
+                values[metric] = value
+        if len(values) == 0:
+            return SUCCESS, ""
+
+        alpha      = self.get_setting('anomaly', 'alpha')
+        deviations = self.get_setting('anomaly', 'deviations')
+        minsamples = self.get_setting('anomaly', 'minsamples')
+        minpct     = self.get_setting('anomaly', 'minpct')
+        n    = self.clock()
+        slot = n.weekday() * 24 + n.hour
+        upsert = "INSERT INTO baselines VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (instance, metric, slot) DO UPDATE SET " \
+                 "cnt = excluded.cnt, mean = excluded.mean, dev = excluded.dev"
+        anomalies = []
+        import sqlite3
+        try:
+            conn = self.open_history()
+            with conn:
+                for metric, value in sorted(values.items()):
+                    baselines = {}
+                    for aslot, cnt, mean, dev in conn.execute("SELECT slot, cnt, mean, dev FROM baselines WHERE instance = ? AND metric = ? AND slot IN (?, ?)",
+                                                              (self.instance, metric, slot, ALLHOURS)):
+                        baselines[aslot] = (cnt, mean, dev)
+
+                    # seasonal baseline once it has learned enough, otherwise the all hours one
+                    for aslot in (slot, ALLHOURS):
+                        cnt, mean, dev = baselines.get(aslot, (0, 0.0, 0.0))
+                        if cnt >= minsamples:
+                            # mean absolute deviation is about 0.8 standard deviations for normal data
+                            change = abs(value - mean)
+                            if change > deviations * dev * 1.25 and change > abs(mean) * minpct / 100:
+                                anomalies.append("%s=%s  baseline=%.2f +/- %.2f (%s)" % (metric, '{0:g}'.format(value), mean, dev * 1.25,
+                                                 'hour of week' if aslot == slot else 'all hours'))
+                            break
+
+                    for aslot in (slot, ALLHOURS):
+                        cnt, mean, dev = baselines.get(aslot, (0, value, 0.0))
+                        # plain averages while warming up so the first samples do not dominate
+                        weight = max(alpha, 1.0 / (cnt + 1))
+                        dev  = dev + weight * (abs(value - mean) - dev)
+                        mean = mean + weight * (value - mean)
+                        conn.execute(upsert, (self.instance, metric, aslot, cnt + 1, mean, dev))
+            conn.close()
+        except sqlite3.Error as e:
+            self.writeout("Unable to update metric baselines: %s" % e)
+            return SUCCESS, ""
+
+        if len(anomalies) == 0:
+            marker = MARK_OK
+            msg = "No anomalies found against learned baselines (%d metrics)." % len(values)
+        else:
+            marker = MARK_WARN
+            subject = 'Anomalies detected.'
+            msg = "%d metric(s) deviate from their learned baselines." % len(anomalies)
+            for anomaly in anomalies:
+                msg += "\n        " + anomaly
+            if self.alert(ANOMALY):
+                rc = self.send_alert(self.to, self.from_, subject, msg)
+                if rc != 0:
+                    self.writeout("mail error")
+                    return 1, "mail error"
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def query_history(self, dbhost, dbport, database, args, since, until, rollup):
+        # pg_check.py query                 --> list metrics recorded for the instance
+        # pg_check.py query <metric> ...    --> show the metric over the time range, in the given (or a fitting) rollup
+        self.programdir = sys.path[0]
+        instance = self.get_instance(dbhost, dbport, database)
+        if not os.path.isfile(self.programdir + '/' + self.historyname):
+            return ERROR, "No check history found: %s" % (self.programdir + '/' + self.historyname)
+
+        conn = self.open_history()
+        if len(args) == 0:
+            for metric, cnt, last in conn.execute("SELECT metric, count(*), max(ts) FROM metrics WHERE instance = ? AND rollup = 'raw' GROUP BY metric ORDER BY metric", (instance,)):
+                print ("%-40s samples=%-8d last=%s" % (metric, cnt, datetime.fromtimestamp(last).strftime("%Y-%m-%d %H:%M:%S")))
+            conn.close()
+            return SUCCESS, ''
 
+        try:
+            tsfrom = self.parse_time(since)
+            tsto   = self.parse_time(until)
+        except ValueError:
+            return ERROR, "Invalid time range: since=%s until=%s.  Use YYYY-MM-DD[ HH:MM[:SS]] or a relative time like 30m, 6h, 7d." % (since, until)
+
+        if rollup == '':
+            # pick the finest rollup that still has data for the whole range
+            age = self.now() - tsfrom
+            if age <= self.get_setting('history', 'raw_days') * 86400 and tsto - tsfrom <= 6 * 3600:
+                rollup = 'raw'
+            elif age <= self.get_setting('history', 'minute_days') * 86400 and tsto - tsfrom <= 2 * 86400:
+                rollup = '1m'
+            else:
+                rollup = '1h'
+        elif rollup not in ('raw', '1m', '1h'):
+            conn.close()
+            return ERROR, "Invalid rollup: %s.  Use raw, 1m or 1h." % rollup
+
+        for metric in args:
+            print ("%s  (%s)" % (metric, rollup))
+            print ("%-19s  %14s  %14s  %14s  %6s" % ('time', 'avg', 'min', 'max', 'count'))
+            for ts, cnt, vmin, vmax, vsum in conn.execute("SELECT ts, cnt, vmin, vmax, vsum FROM metrics WHERE instance = ? AND metric = ? AND rollup = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+                                                          (instance, metric, rollup, tsfrom, tsto)):
+                print ("%-19s  %14.2f  %14.2f  %14.2f  %6d" % (datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"), vsum / cnt, vmin, vmax, cnt))
+        conn.close()
+        return SUCCESS, ''
+
+    ###########################################################
+    def parse_time(self, atime):
+        # relative times like 90s, 30m, 6h, 7d are relative to now
+        atime = atime.strip()
+        if atime == '' or atime == 'now':
+            return int(self.now())
+        units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+        if atime[-1] in units and atime[:-1].isdigit():
+            return int(self.now()) - int(atime[:-1]) * units[atime[-1]]
+        for aformat in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+            try:
+                return int(datetime.strptime(atime, aformat).timestamp())
+            except ValueError:
+                pass
+        raise ValueError(atime)
+
+    ###########################################################
+    def acquire_lock(self):
+        # one run at a time per PG instance and database.  A previous run that is still alive past its deadline is hung, so kill it.
+        self.lockfile = "%s%spg_check_%s.pid" % (self.tempdir, self.dir_delim, self.instance)
+        for attempt in range(2):
+            try:
+                fd = os.open(self.lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, ("%d*%d\n" % (self.pid, int(self.timestart))).encode('utf-8'))
+                os.close(fd)
+                self.lockowned = True
+                return SUCCESS, ''
+            except FileExistsError:
+                pass
+
+            try:
+                with open(self.lockfile) as f:
+                    parts = f.readline().strip().split('*')
+                otherpid   = int(parts[0])
+                otherstart = int(parts[1])
+            except (OSError, ValueError, IndexError):
+                otherpid = -1
+                otherstart = 0
+
+            if otherpid > 0 and self.pid_alive(otherpid):
+                age = int(self.now()) - otherstart
+                if age <= self.get_setting('guardrails', 'deadline'):
+                    return ERROR, "Another %s run (pid=%d) started %d seconds ago is still active.  Lock file: %s" % (PROGNAME, otherpid, age, self.lockfile)
+                self.writeout("%sPrevious %s run (pid=%d) is hung for %d seconds.  Killing it." % (MARK_WARN, PROGNAME, otherpid, age))
+                # its commands run in their own sessions (process groups), so they have to be killed too or psql is left orphaned
+                for apid in self.child_pids(otherpid):
+                    try:
+                        os.killpg(apid, 9)
+                    except OSError:
+                        pass
+                try:
+                    os.kill(otherpid, 9)
+                except OSError:
+                    pass
+
+            # stale or hung lock, so remove it and try again
+            try:
+                os.remove(self.lockfile)
+            except OSError:
+                pass
+
+        return ERROR, "Unable to acquire lock file: %s" % self.lockfile
 
+    ###########################################################
+    def child_pids(self, apid):
+        # direct children of a process from /proc, empty where there is no /proc
+        pids = []
+        for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+            if not entry.isdigit():
+                continue
+            try:
+                with open('/proc/%s/stat' % entry) as f:
+                    # pid (comm) state ppid ...  comm may contain spaces, so split after the closing paren
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except (OSError, IndexError):
+                continue
+            if int(fields[1]) == apid:
+                pids.append(int(entry))
+        return pids
 
+    ###########################################################
+    def pid_alive(self, apid):
+        try:
+            os.kill(apid, 0)
+        except OSError:
+            return False
+        # guard against pid reuse by some other program
+        cmdfile = "/proc/%d/cmdline" % apid
+        if os.path.isfile(cmdfile):
+            with open(cmdfile, 'rb') as f:
+                return PROGNAME in f.read().decode('utf-8', 'replace')
+        return True
 
     ###########################################################
     def cleanup(self):
         if self.connected:
             # do something here later if we enable a db driver
             self.connected = false
+        self.close_session()
         # print ("deleting temp file: %s" % self.tempfile)
-        try:
-            os.remove(self.tempfile)
-        except OSError:
-            pass
+        for afile in (self.tempfile, self.workfile):
+            try:
+                os.remove(afile)
+            except OSError:
+                pass
+        if self.lockowned:
+            try:
+                os.remove(self.lockfile)
+            except OSError:
+                pass
+            self.lockowned = False
         return
 
+    ###########################################################
+    def now(self):
+        # the one wall clock of a run, in epoch seconds: --replay sets clockoffset so it follows the recorded run times
+        return time.time() + self.clockoffset
+
+    ###########################################################
+    def clock(self):
+        # now() as a datetime
+        return datetime.fromtimestamp(self.now())
+
     ###########################################################
     def getnow(self):
-        now = datetime.now()
+        now = self.clock()
         adate = str(now)
         parts = adate.split('.')
         return parts[0]
@@ -567,11 +1504,27 @@ class maint:
         return Decimal(valuefloat)
 
 
+    ###########################################################
+    def convert_bytes_to_humanfriendly(self, bytes):
+        # same units as pg_size_pretty()
+        value = float(bytes)
+        for unit in ('bytes', 'kB', 'MB', 'GB'):
+            if abs(value) < 10240:
+                if unit == 'bytes':
+                    return "%d %s" % (value, unit)
+                return "%.0f %s" % (value, unit)
+            value = value / 1024
+        return "%.0f TB" % value
+
+
     ###########################################################
     def writeout(self,aline):
         if self.fout != '':
             aline = aline + "\r\n"
             self.fout.write(aline)
+        elif self.outformat != 'text':
+            # keep standard output parseable, errors end up in the check record too
+            print (aline, file=sys.stderr)
         else:
             # default to standard output
             print (aline)
@@ -580,35 +1533,46 @@ class maint:
     ###########################################################
     def get_configinfo(self):
 
-        #print("conn=%s" % self.connstring)
-        sql = "show all"
-
-        cmd = "psql %s -At -X -c \"%s\" > %s" % (self.connstring, sql, self.tempfile)
-        rc, results = self.executecmd(cmd, False)
-        if rc != SUCCESS:
-            # let calling function report the error
-            errors = "Unable to get config info: %d %s\nsql=%s\n" % (rc, results, sql)
-            #aline = "%s" % (errors)
-            #self.writeout(aline)
-            return rc, errors
-
-        f = open(self.tempfile, "r")
-        lineno = 0
-        count  = 0
-        for line in f:
-            lineno = lineno + 1
-            aline = line.strip()
-            if len(aline) < 1:
-                continue
+        # the settings only change on a restart or reload, so reuse the ones cached with the last run until then
+        cached = self.state.get('config', {})
+        if cached.get('key') == self.confkey and self.confkey != '' and cached.get('names') == list(CONFIGSETTINGS):
+            settings = cached['settings']
+            results  = ''
+            if self.verbose:
+                print ("Using cached config info from %s" % self.confkey)
+        else:
+            #print("conn=%s" % self.connstring)
+            sql = "show all"
 
-            # v2.2 fix: things like "Timing is On" can appear as a line so bypass
-            if aline == 'Timing is on.' or aline == 'Timing is off.' or aline == 'Pager usage is off.' or aline == 'Pager is used for long output.' or ':activity' in aline or 'Time: ' in aline:
-                continue
+            cmd = "psql %s -At -X -c \"%s\" > %s" % (self.connstring, sql, self.tempfile)
+            rc, results = self.executecmd(cmd, False)
+            if rc != SUCCESS:
+                # let calling function report the error
+                errors = "Unable to get config info: %d %s\nsql=%s\n" % (rc, results, sql)
+                #aline = "%s" % (errors)
+                #self.writeout(aline)
+                return rc, errors
 
-            # print ("DEBUG:  aline=%s" % (aline))
-            fields = aline.split('|')
-            name = fields[0].strip()
-            setting = fields[1].strip()
+            settings = []
+            f = open(self.tempfile, "r")
+            for line in f:
+                aline = line.strip()
+                if len(aline) < 1:
+                    continue
+
+                # v2.2 fix: things like "Timing is On" can appear as a line so bypass
+                if aline == 'Timing is on.' or aline == 'Timing is off.' or aline == 'Pager usage is off.' or aline == 'Pager is used for long output.' or ':activity' in aline or 'Time: ' in aline:
+                    continue
+
+                # print ("DEBUG:  aline=%s" % (aline))
+                fields = aline.split('|')
+                name = fields[0].strip()
+                if name in CONFIGSETTINGS:
+                    settings.append([name, fields[1].strip()])
+            f.close()
+            self.state['config'] = {'key': self.confkey, 'names': list(CONFIGSETTINGS), 'settings': settings}
+
+        for name, setting in settings:
             #print ("name=%s  setting=%s" % (name, setting))
 
             if name == 'data_directory':
@@ -657,8 +1621,13 @@ class maint:
                     self.pg_type = 'rds'
             elif name == 'rds.extensions':
                 self.pg_type = 'rds'
-
-        f.close()
+            elif name == 'huge_pages':
+                self.huge_pages = setting
+            elif name == 'shared_memory_size_in_huge_pages':
+                # PG15+: huge pages the main shared memory segment needs, -1 when huge pages are not supported
+                self.shmem_hugepages = int(setting)
+            elif name == 'autovacuum_max_workers':
+                self.autovacuum_max_workers = int(setting)
 
         if self.verbose:
             print ("shared_buffers = %d  maint_work_mem = %d  work_mem = %d  shared_preload_libraries = %s" % (self.shared_buffers, self.maint_work_mem, self.work_mem, self.shared_preload_libraries))
@@ -666,61 +1635,95 @@ class maint:
         return SUCCESS, results
 
     ###########################################################
-    def executecmd(self, cmd, expect):
+    def executecmd(self, cmd, expect, pgoptions=True):
         if self.debug:
             print ("[****]  executecmd --> %s" % cmd)
 
-        # NOTE: try and catch does not work for Popen
-        try:
-            # Popen(args, bufsize=0, executable=None, stdin=None, stdout=None, stderr=None, preexec_fn=None, close_fds=False, shell=False, cwd=None, env=None, universal_newlines=False, startupinfo=None, creationflags=0)
-            if self.opsys == 'posix':
-                p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE, executable="/bin/bash")
-            else:
-                p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE)
-            values2, err2 = p.communicate()
-
-        except exceptions.OSError as e:
-            print ("exceptions.OSError Error",e)
-            return ERROR, "Error(1)"
-        except BaseException as e:
-            print ("BaseException Error",e)
-            return ERROR, "Error(2)"
-        except OSError as e:
-            print ("OSError Error", e)
-            return ERROR, "Error(3)"
-        except RuntimeError as e:
-            print ("RuntimeError", e)
-            return ERROR, "Error(4)"
-        except ValueError as e:
-            print ("Value Error", e)
-            return ERROR, "Error(5)"
-        except Exception as e:
-            print ("General Exception Error", e)
-            return ERROR, "Error(6)"
-        except:
-            print ("Unexpected error:", sys.exc_info()[0])
-            return ERROR, "Error(7)"
-
-        if err2 is None or len(err2) == 0:
-            err = ""
-        else:
-            # python 3 returns values and err in byte format so convert accordingly
-            err = bytes(err2).decode('utf-8')
+        # time to first query is the startup cost every scheduled run pays
+        if self.firstquery < 0 and 'psql' in cmd:
+            self.firstquery = int((time.time() - PROCSTART) * 1000)
 
-        if values2 is None or len(values2) == 0:
-            values = ""
+        if self.replay != '':
+            # recorded results go through the same return code handling as live ones
+            rc, values, err = self.replay_probe(cmd)
         else:
-            # python 3 returns values and err in byte format so convert accordingly
-            values = bytes(values2).decode('utf-8')
+            # PGOPTIONS and PGAPPNAME is how session settings like timeouts get to every psql call.  pgoptions=False
+            # for psql calls to something other than PostgreSQL, like the pgbouncer admin console that rejects options.
+            env = dict(os.environ, PGAPPNAME=self.get_setting('guardrails', 'application_name'))
+            if self.pgoptions != '' and pgoptions:
+                env['PGOPTIONS'] = self.pgoptions
+
+            # never wait on a command past the run deadline
+            timeout = None
+            if self.deadline > 0:
+                timeout = max(self.deadline - self.now(), 1)
+
+            # NOTE: try and catch does not work for Popen
+            try:
+                # Popen(args, bufsize=0, executable=None, stdin=None, stdout=None, stderr=None, preexec_fn=None, close_fds=False, shell=False, cwd=None, env=None, universal_newlines=False, startupinfo=None, creationflags=0)
+                if self.opsys == 'posix':
+                    # own process group so the shell and whatever it started can be killed together
+                    p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE, executable="/bin/bash", env=env, start_new_session=True)
+                else:
+                    p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE, env=env)
+                values2, err2 = p.communicate(timeout=timeout)
+
+            except subprocess.TimeoutExpired:
+                if self.opsys == 'posix':
+                    os.killpg(p.pid, 9)
+                else:
+                    p.kill()
+                p.communicate()
+                self.writeout("[ERROR] Run deadline exceeded.  Killed command: %s" % cmd)
+                return ERROR, "Run deadline exceeded."
+            except exceptions.OSError as e:
+                self.writeout("exceptions.OSError Error %s" % e)
+                return ERROR, "Error(1)"
+            except BaseException as e:
+                self.writeout("BaseException Error %s" % e)
+                return ERROR, "Error(2)"
+            except OSError as e:
+                self.writeout("OSError Error %s" % e)
+                return ERROR, "Error(3)"
+            except RuntimeError as e:
+                self.writeout("RuntimeError %s" % e)
+                return ERROR, "Error(4)"
+            except ValueError as e:
+                self.writeout("Value Error %s" % e)
+                return ERROR, "Error(5)"
+            except Exception as e:
+                self.writeout("General Exception Error %s" % e)
+                return ERROR, "Error(6)"
+            except:
+                self.writeout("Unexpected error: %s" % sys.exc_info()[0])
+                return ERROR, "Error(7)"
+
+            if err2 is None or len(err2) == 0:
+                err = ""
+            else:
+                # python 3 returns values and err in byte format so convert accordingly
+                err = bytes(err2).decode('utf-8')
+
+            if values2 is None or len(values2) == 0:
+                values = ""
+            else:
+                # python 3 returns values and err in byte format so convert accordingly
+                values = bytes(values2).decode('utf-8')
+
+            values = values.strip()
 
-        values = values.strip()
+            rc = p.returncode
 
-        rc = p.returncode
         if self.debug:
             print ("[****]  rc=%d  values=***%s***  errors=***%s***" % (rc, values, err))
+        if self.capture != '':
+            self.capture_probe(cmd, rc, values, err)
 
         if rc == 1 or rc == 2:
             return ERROR2, err
+        elif rc == 3:
+            # psql -v ON_ERROR_STOP=1 -f: a statement in the script failed
+            return ERROR2, err
         elif rc == 127:
             return ERROR2, err
         elif err != "":
@@ -737,20 +1740,153 @@ class maint:
         else:
             return SUCCESS, values
 
+    ###########################################################
+    def probe_key(self, cmd):
+        # what identifies a probe across runs: the command without the connection options and per process file names,
+        # plus the script it runs with -f
+        key = cmd
+        if self.connstring.strip() != '':
+            key = key.replace(self.connstring, ' -d %s ' % self.database)
+        key = key.replace(self.tempfile, '<tempfile>')
+        if ' -f ' + self.workfile in cmd and os.path.isfile(self.workfile):
+            with open(self.workfile) as f:
+                key += '\n' + f.read()
+        return ' '.join(key.replace(self.workfile, '<workfile>').split())
 
     ###########################################################
-    def get_pgversion(self):
+    def capture_probe(self, cmd, rc, values, err):
+        arec = {'key': self.probe_key(cmd), 'rc': rc, 'out': values, 'err': err}
+        if rc == SUCCESS and '> ' + self.tempfile in cmd and os.path.isfile(self.tempfile):
+            with open(self.tempfile) as f:
+                arec['file'] = f.read()
+        # database sweep workers share this list with the main instance
+        self.captured.append(arec)
+        return
 
-        # v 2.1 fix: expected output --> 10.15-10.
-        #sql = "select substring(foo.version from 12 for 3) from (select version() as major) foo, substring(version(), 12, position(' ' in substring(version(),12))) as minor"
-        #sql = "select substring(version(), 12, position(' ' in substring(version(),12)))"
-        sql = "select  trim(substring(version(), 12, position(' ' in substring(version(),12)))) || '-' || substring(foo.major from 12 for 3)as major  from (select version() as major) foo"
+    ###########################################################
+    def flush_capture(self):
+        # one gzipped json line per run with what it started from, then one per probe.  Runs are appended, and a file
+        # of many runs (gzip members) is replayed in order.
+        import gzip
+        try:
+            with gzip.open(self.capture, 'at') as f:
+                f.write(json.dumps({'run': self.timestart, 'cpus': self.cpus, 'states': self.capturestates}) + '\n')
+                for arec in self.captured:
+                    f.write(json.dumps(arec) + '\n')
+        except OSError as e:
+            self.writeout("[ERROR] Unable to write capture file %s: %s" % (self.capture, e))
+        del self.captured[:]
+        return
 
-        # do not provide host name and/or port if not provided
-        cmd = "psql %s -At -X -c \"%s\" " % (self.connstring, sql)
-        rc, results = self.executecmd(cmd, True)
-        if rc != SUCCESS:
-            errors = "%s\n" % (results)
+    ###########################################################
+    def load_replay(self):
+        # --replay takes one or more capture files (comma separated).  The first run of each file restores the state
+        # it was recorded with, the runs after it carry on from the replayed state.
+        import gzip
+        self.replayruns = []
+        for afile in [x.strip() for x in self.replay.split(',') if x.strip() != '']:
+            first = True
+            try:
+                with gzip.open(afile, 'rt') as f:
+                    for line in f:
+                        arec = json.loads(line)
+                        if 'run' in arec:
+                            arec['first'] = first
+                            arec['probes'] = {}
+                            self.replayruns.append(arec)
+                            first = False
+                        elif len(self.replayruns) > 0:
+                            self.replayruns[-1]['probes'].setdefault(arec['key'], []).append(arec)
+            except (OSError, ValueError, KeyError) as e:
+                return ERROR, "Unable to read replay file %s: %s" % (afile, e)
+        if len(self.replayruns) == 0:
+            return ERROR, "No recorded runs found in: %s" % self.replay
+        # replays get their own check history so they never mix with the live one
+        self.historyname = 'pg_check_replay.db'
+        try:
+            os.remove(self.programdir + '/' + self.historyname)
+        except OSError:
+            pass
+        self.replaystart = time.time()
+        return SUCCESS, ''
+
+    ###########################################################
+    def next_replay(self):
+        # moves on to the next recorded run: its probes, its cpu count and its time.  Returns False after the last one.
+        if self.replay == '':
+            return False
+        if len(self.replayruns) == 0:
+            self.replay_summary()
+            return False
+        arun = self.replayruns.pop(0)
+        self.replaycount += 1
+        self.replayprobes = arun['probes']
+        if not self.cpusgiven and arun.get('cpus', -1) > 0:
+            self.cpus = arun['cpus']
+        if arun['first']:
+            for instance, astate in arun.get('states', {}).items():
+                if instance == self.instance:
+                    self.state = astate
+                else:
+                    # database sweep workers load theirs from the replay state file
+                    with open("%s/pg_check_%s.replay.state" % (self.programdir, instance), 'w') as f:
+                        json.dump(astate, f)
+            self.state.setdefault('lastrun', {})
+
+        # now() follows the recorded run times, so check intervals, rates over time and alert timers see
+        # the recorded spacing however fast the runs are replayed
+        self.clockoffset = arun['run'] - time.time()
+        self.timestart = self.now()
+        self.deadline  = self.timestart + self.get_setting('guardrails', 'deadline')
+        self.records   = []
+        return True
+
+    ###########################################################
+    def replay_probe(self, cmd):
+        # the recorded result of a probe: each recording of the same probe in a run is handed out once, in order
+        key = self.probe_key(cmd)
+        recorded = self.replayprobes.get(key, [])
+        if len(recorded) == 0:
+            self.replaymisses.append(key)
+            return 2, '', "[REPLAY] no recorded result for: %s" % key[:100]
+        arec = recorded.pop(0)
+        if 'file' in arec:
+            with open(self.tempfile, 'w') as f:
+                f.write(arec['file'])
+        return arec['rc'], arec['out'], arec['err']
+
+    ###########################################################
+    def replay_summary(self):
+        secs = time.time() - self.replaystart
+        firing   = len([event for event in self.replayalerts if event['status'] == 'firing'])
+        resolved = len(self.replayalerts) - firing
+        msg = "Replayed %d runs in %.2f seconds (%.1f runs/sec): %d notifications (%d firing, %d resolved), %d probes not recorded." \
+              % (self.replaycount, secs, self.replaycount / max(secs, 0.001), len(self.replayalerts), firing, resolved, len(self.replaymisses))
+        if self.outformat == 'text':
+            print (msg)
+        else:
+            sys.stderr.write(msg + '\n')
+        if self.verbose:
+            for key in sorted(set(self.replaymisses)):
+                print ("        not recorded: %s" % key[:200])
+        return
+
+
+    ###########################################################
+    def get_pgversion(self):
+
+        # v 2.1 fix: expected output --> 10.15-10.
+        #sql = "select substring(foo.version from 12 for 3) from (select version() as major) foo, substring(version(), 12, position(' ' in substring(version(),12))) as minor"
+        #sql = "select substring(version(), 12, position(' ' in substring(version(),12)))"
+        # also the recovery state for the standby profile, and the server start and config reload times that key the cached settings
+        sql = "select  trim(substring(version(), 12, position(' ' in substring(version(),12)))) || '-' || substring(foo.major from 12 for 3)as major, pg_is_in_recovery(), " \
+              "cast(extract(epoch from pg_postmaster_start_time()) as bigint) || '/' || cast(extract(epoch from pg_conf_load_time()) as bigint) from (select version() as major) foo"
+
+        # do not provide host name and/or port if not provided
+        cmd = "psql %s -At -X -c \"%s\" " % (self.connstring, sql)
+        rc, results = self.executecmd(cmd, True)
+        if rc != SUCCESS:
+            errors = "%s\n" % (results)
             aline = "%s" % (errors)
 
             self.writeout(aline)
@@ -759,7 +1895,10 @@ class maint:
         # with version 10, major version format changes from x.x to x, where x is a 2 byte integer, ie, 10, 11, etc.
         # values = bytes(values2).decode('utf-8')
         results = str(results)
-        parsed = results.split('-')
+        cols = results.split('|')
+        self.in_recovery = cols[1] == 't'
+        self.confkey     = cols[2]
+        parsed = cols[0].split('-')
 
         amajor = parsed[1]
         self.pgversionminor = parsed[0]
@@ -772,8 +1911,302 @@ class maint:
             self.pgversionmajor = Decimal(amajor)
 
         #print ("majorversion = %.1f  minorversion = %s" % (self.pgversionmajor, self.pgversionminor))
+        self.queries = self.resolve_queries(self.pgversionmajor)
         return SUCCESS, str(results)
 
+    ###########################################################
+    def resolve_queries(self, version):
+        # pick the catalog variant whose version range covers the server, None when there is none
+        queries = {}
+        for name, variants in QUERIES.items():
+            queries[name] = None
+            for minver, maxver, sql in variants:
+                if minver != '' and version < Decimal(minver):
+                    continue
+                if maxver != '' and version > Decimal(maxver):
+                    continue
+                queries[name] = sql
+                break
+        return queries
+
+    ###########################################################
+    def get_query(self, name, params=None):
+        sql = self.queries[name]
+        if sql is None or params is None:
+            return sql
+        return sql % params
+
+    ###########################################################
+    def run_query(self, name, params=None):
+        # catalog probes run through the persistent psql session in --interval mode, otherwise through their own psql
+        if name in self.batch:
+            return SUCCESS, self.batch.pop(name)
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, self.get_query(name, params))
+        if self.interval > 0 and self.opsys == 'posix':
+            rc, results = self.session_query(name, params)
+            if self.capture != '':
+                # recorded as the psql call it stands for, so a replay does not need the session
+                self.capture_probe(cmd, 0 if rc == SUCCESS else 1, results if rc == SUCCESS else '', '' if rc == SUCCESS else results)
+            return rc, results
+        return self.executecmd(cmd, False)
+
+    ###########################################################
+    def prefetch(self, checkids):
+        # run the batchable probes of the enabled checks in a single round trip: each probe becomes a json_agg()
+        # subquery of one select, and the rows are turned back into the psql -At text the checks already parse
+        self.batch = {}
+        if self.pgversionmajor < Decimal('9.4'):
+            # json_build_object() is 9.4+
+            return
+        names  = []
+        sql    = ''
+        params = ()
+        for name in BATCH:
+            checkid = name.split('.')[0]
+            if self.queries.get(name) is None or checkid not in checkids or not self.check_enabled(checkid):
+                continue
+            probe = self.queries[name]
+            if BATCH[name] != '':
+                params += (getattr(self, BATCH[name]),)
+            elif '%' in probe:
+                # queries without params use a single %, but the batch as a whole is formatted
+                probe = probe.replace('%', '%%')
+            sql += "%s'%s', (select json_agg(q) from (%s) q)" % (', ' if len(names) > 0 else '', name, probe)
+            names.append(name)
+        if len(names) < 2:
+            return
+
+        self.queries['batch'] = "select json_build_object(" + sql + ")"
+        self.pgoptions = self.get_pgoptions(sorted(set(name.split('.')[0] for name in names)))
+        rc, results = self.run_query('batch', params)
+        if rc != SUCCESS:
+            # every probe simply runs on its own
+            if self.verbose:
+                print ("[****]  batched probes failed, running them one at a time: %s" % results)
+            return
+        try:
+            probes = json.loads(results, parse_float=Decimal)
+        except ValueError:
+            return
+        for name in names:
+            rows = []
+            for arow in probes.get(name) or []:
+                values = []
+                for value in arow.values():
+                    if value is None:
+                        values.append('')
+                    elif isinstance(value, bool):
+                        values.append('t' if value else 'f')
+                    else:
+                        values.append(str(value))
+                rows.append('|'.join(values))
+            self.batch[name] = '\n'.join(rows)
+        return
+
+    ###########################################################
+    def bind_query(self, sql, params):
+        # turn the catalog %d / '%s' placeholders into $n parameters so the statement text stays the same from one cycle
+        # to the next.  A bare %s is a sql fragment (e.g. a user filter from the config) and stays part of the text.
+        if params is None:
+            params = ()
+        elif not isinstance(params, tuple):
+            params = (params,)
+        text  = ''
+        args  = []
+        pos   = 0
+        index = 0
+        for match in re.finditer(r"%%|interval '%d (second|minute)s'|'%s'|%d|%s", sql):
+            text += sql[pos:match.start()]
+            pos = match.end()
+            token = match.group(0)
+            if token == '%%':
+                text += '%'
+                continue
+            value = params[index]
+            index += 1
+            if token == '%s':
+                text += value
+                continue
+            args.append(value)
+            if token.startswith('interval'):
+                text += "($%d * interval '1 %s')" % (len(args), match.group(1))
+            else:
+                text += "$%d" % len(args)
+        text += sql[pos:]
+        return text, args
+
+    ###########################################################
+    def session_query(self, name, params):
+        # prepare each distinct statement once per session and execute it with bound parameters
+        text, args = self.bind_query(self.queries[name], params)
+        values = []
+        for value in args:
+            if isinstance(value, str):
+                values.append("'" + value.replace("'", "''") + "'")
+            else:
+                values.append(str(value))
+        execute = "EXECUTE %s" + ("(%s);" % ', '.join(values) if len(values) > 0 else ";")
+
+        for attempt in range(2):
+            script = ''
+            if self.session is None or self.session.poll() is not None:
+                rc, errors = self.open_session()
+                if rc != SUCCESS:
+                    return rc, errors
+            if text not in self.prepared:
+                self.prepared[text] = "pg_check_%d" % (len(self.prepared) + 1)
+                script = "PREPARE %s AS %s;\n" % (self.prepared[text], text)
+            rc, results = self.session_execute(script + execute % self.prepared[text])
+            if rc == SUCCESS or 'does not exist' not in results or script != '':
+                return rc, results
+            # the server side statement went away (e.g. DISCARD ALL from a pooler), so prepare it again
+            del self.prepared[text]
+        return rc, results
+
+    ###########################################################
+    def open_session(self):
+        self.close_session()
+        env = dict(os.environ, PGAPPNAME=self.get_setting('guardrails', 'application_name'))
+        env.pop('PGOPTIONS', None)
+        cmd = "exec psql %s -At -X -q" % self.connstring
+        if self.debug:
+            print ("[****]  open session --> %s" % cmd)
+        try:
+            self.session = Popen(cmd, shell=True, stdin=PIPE, stdout=PIPE, stderr=STDOUT, executable="/bin/bash", env=env, start_new_session=True)
+        except OSError as e:
+            self.session = None
+            return ERROR, "Unable to start psql session: %s" % e
+        # a new session means a new backend: nothing is prepared and no session settings are applied yet
+        self.prepared    = {}
+        self.sessionopts = ''
+        return SUCCESS, ''
+
+    ###########################################################
+    def close_session(self):
+        if self.session is None:
+            return
+        try:
+            if self.session.poll() is None:
+                os.killpg(self.session.pid, 9)
+            self.session.wait()
+        except OSError:
+            pass
+        self.session  = None
+        self.prepared = {}
+        return
+
+    ###########################################################
+    def session_execute(self, script):
+        # the guardrail settings PGOPTIONS gives each psql call are applied with SET when they change
+        if self.pgoptions != self.sessionopts:
+            sets = "RESET ALL;\n"
+            for name, value in re.findall(r'-c\s*([a-z_]+)=(\S+)', self.pgoptions):
+                sets += "SET %s = '%s';\n" % (name, value)
+            script = sets + script
+            self.sessionopts = self.pgoptions
+        if self.debug:
+            print ("[****]  session --> %s" % script)
+        try:
+            self.session.stdin.write(("%s\n\\echo %s :ERROR\n" % (script, SESSION_END)).encode('utf-8'))
+            self.session.stdin.flush()
+        except OSError:
+            self.close_session()
+            return ERROR, "psql session lost."
+
+        output = b''
+        marker = SESSION_END.encode('utf-8')
+        fd = self.session.stdout.fileno()
+        while True:
+            pos = output.find(marker)
+            if pos > -1 and output.find(b'\n', pos) > -1:
+                break
+            timeout = None
+            if self.deadline > 0:
+                timeout = max(self.deadline - self.now(), 0)
+            ready, dummy1, dummy2 = select.select([fd], [], [], timeout)
+            if len(ready) == 0:
+                self.close_session()
+                self.writeout("[ERROR] Run deadline exceeded.  Killed psql session.")
+                return ERROR, "Run deadline exceeded."
+            chunk = os.read(fd, 65536)
+            if chunk == b'':
+                self.close_session()
+                return ERROR, "psql session lost."
+            output += chunk
+
+        results = output[:pos].decode('utf-8', 'replace').strip()
+        failed  = output[pos + len(marker):].decode('utf-8', 'replace').strip()
+        if self.debug:
+            print ("[****]  session results=***%s***  error=%s" % (results, failed))
+        if 'connection to server was lost' in results:
+            # psql reconnected to a new backend, so prepared statements and settings are gone
+            self.prepared    = {}
+            self.sessionopts = ''
+        if failed == 'true' or (failed != 'false' and 'ERROR:' in results):
+            return ERROR2, results
+        return SUCCESS, results
+
+    ###########################################################
+    def next_cycle(self):
+        # --interval mode: a fresh deadline per cycle, and the lock file start time is refreshed so other runs
+        # do not take this long running process for a hung one
+        self.timestart = self.now()
+        self.deadline  = self.timestart + self.get_setting('guardrails', 'deadline')
+        self.records   = []
+        if self.capture != '':
+            self.capturestates = {self.instance: json.loads(json.dumps(self.state))}
+        if self.lockowned:
+            try:
+                with open(self.lockfile, 'w') as f:
+                    f.write("%d*%d\n" % (self.pid, int(self.timestart)))
+            except OSError:
+                pass
+        return
+
+    ###########################################################
+    def validate_catalog(self):
+        # which variant every supported major version resolves to, flagging probes missing for versions their check runs on
+        print ("Query catalog variants by PG major version (- means no variant, the probe is skipped):")
+        print ("%-22s" % 'probe' + ''.join("%6s" % aversion for aversion in SUPPORTED))
+        missing = []
+        for name, variants in QUERIES.items():
+            row = "%-22s" % name
+            checkid = name.split('.')[0]
+            for aversion in SUPPORTED:
+                version = Decimal(aversion)
+                sql = self.resolve_queries(version)[name]
+                if sql is not None:
+                    row += "%6d" % ([avariant[2] for avariant in variants].index(sql) + 1)
+                    continue
+                row += "%6s" % '-'
+                meta = CHECKS.get(checkid, {'minver': '', 'maxver': ''})
+                if (meta['minver'] == '' or version >= Decimal(meta['minver'])) and (meta['maxver'] == '' or version <= Decimal(meta['maxver'])):
+                    missing.append("%s on %s" % (name, aversion))
+            print (row)
+        print ("")
+
+        # EXPLAIN every query resolved for the connected server, with placeholder params
+        failed = 0
+        for name, sql in self.queries.items():
+            if sql is None:
+                continue
+            params = tuple(1 if conversion == 'd' else '' for conversion in re.findall(r'%([ds])', sql.replace('%%', '')))
+            if len(params) > 0:
+                sql = sql % params
+            cmd = "psql %s -At -X -c \"EXPLAIN %s\"" % (self.connstring, sql)
+            rc, results = self.executecmd(cmd, False)
+            if rc != SUCCESS:
+                failed += 1
+                print (MARK_WARN + "%s failed on PG %s: %s" % (name, self.pgversionminor, results.strip()))
+            else:
+                print (MARK_OK + "%s" % name)
+
+        for amissing in missing:
+            print (MARK_WARN + "No query variant for %s" % amissing)
+        if failed > 0 or len(missing) > 0:
+            return ERROR, "%d catalog queries failed, %d missing variants." % (failed, len(missing))
+        return SUCCESS, ""
+
     ###########################################################
     def get_readycnt(self):
 
@@ -852,362 +2285,689 @@ class maint:
     def do_report(self):
 
         if self.testmode:
+            self.start_check('testmode')
             marker = MARK_WARN
             subject = 'Test Mode'
             msg = "Testing notifications."
+            self.alerttype = TESTALERT
             rc = self.send_alert(self.to, self.from_, subject, msg)
             if rc != 0:
-                print("mail error")
+                self.writeout("mail error")
                 return ERROR, ''
             self.log_alert(TESTALERT)
-            print (marker+msg)
+            self.emit(marker, msg)
+            self.end_check(SUCCESS, '')
+
+        # run each enabled check in registry order
+        self.pressure = {}
+        self.skipped  = []
+        self.warnings = []
+        self.underpressure = False
+        checkids = [checkid for checkid in CHECKS if not (self.alldatabases and checkid in DBCHECKS)]
+        self.prefetch(checkids)
+        rc, errors = self.run_checks(checkids)
+        if rc != SUCCESS:
+            self.save_state()
+            self.flush_history()
+            self.end_report()
+            return rc, errors
 
+        if self.alldatabases:
+            self.start_check('alldatabases')
+            rc, errors = self.sweep_databases()
+            self.end_check(rc, errors)
 
+        if len(self.skipped) > 0:
+            self.start_check('deferred')
+            marker = MARK_SKIP
+            msg = "Database under pressure (%s).  Deferred checks: %s" % (self.under_pressure(), ', '.join(self.skipped))
+            self.emit(marker, msg)
+            self.end_check(SUCCESS, '')
 
-        if self.waitslocks > 0:
-            ##########################################################
-            # Get lock waiting transactions where wait is > input seconds
-            ##########################################################
-            if self.pgversionmajor < Decimal('9.2'):
-              # select procpid, datname, usename, client_addr, now(), query_start, substring(current_query,1,100), now() - query_start as duration from pg_stat_activity where waiting is true and now() - query_start > interval '30 seconds';
-                sql = "select count(*) from pg_stat_activity where waiting is true and now() - query_start > interval '%d seconds'" % self.waitslocks
-                sql2 = "TODO"
-            elif self.pgversionmajor < Decimal('9.6'):
-              # select pid, datname, usename, client_addr, now(), query_start, substring(query,1,100), now() - query_start as duration from pg_stat_activity where waiting is true and now() - query_start > interval '30 seconds';
-                sql1 = "select count(*) from pg_stat_activity where waiting is true and now() - query_start > interval '%d seconds'" % self.waitslocks
-                sql2 = "TODO"
-            else:
-                # new wait_event column replaces waiting in 9.6/10
-                # v2.2 fix: add backend_type qualifier to not consider walsender
-
-                # filter out DataFileRead-IO
-                #sql1 = "select count(*) from pg_stat_activity where wait_event is NOT NULL and state = 'active' and backend_type <> 'walsender' and now() - query_start > interval '%d seconds'" % self.waitslocks
-                sql1 = "select count(*) from pg_stat_activity where wait_event is NOT NULL AND wait_event <> 'DataFileRead' and state = 'active' and backend_type <> 'walsender' and now() - query_start > interval '%d seconds'" % self.waitslocks
-                sql2 = "select 'db=' || datname || '  user=' || usename || '  appname=' || application_name || '  waitinfo=' || wait_event || '-' || wait_event_type || " \
-                       "'  duration=' || cast(EXTRACT(EPOCH FROM (now() - query_start)) as integer) || '\n'" \
-                       "'sql=' || regexp_replace(replace(regexp_replace(query, E'[\\n\\r]+', ' ', 'g' ),'    ',''), '[^\x20-\x7f\x0d\x1b]', '', 'g') || '\n'" \
-                       "from pg_stat_activity where wait_event is NOT NULL and state = 'active' and backend_type <> 'walsender' and now() - query_start > interval '%d seconds'" % self.waitslocks
-                sql3 = "SELECT '\n\nblocked_pid =' || rpad(cast(blocked_locks.pid as varchar),7,' ') || ' blocked_user=' || blocked_activity.usename || " \
-                    "'\nblocking_pid=' || rpad(cast(blocking_locks.pid as varchar), 7, ' ') || 'blocking_user=' || blocking_activity.usename || '\n' ||" \
-                    "'blocked_query =' || regexp_replace(replace(regexp_replace(blocked_activity.query, E'[\\n\\r]+', ' ', 'g' ),'    ',''), '[^\x20-\x7f\x0d\x1b]', '', 'g') || '...\n' ||" \
-                    "'blocking_query=' || regexp_replace(replace(regexp_replace(blocking_activity.query, E'[\\n\\r]+', ' ', 'g' ),'    ',''), '[^\x20-\x7f\x0d\x1b]', '', 'g') || '...\n\n' FROM pg_catalog.pg_locks blocked_locks " \
-                    "JOIN pg_catalog.pg_stat_activity blocked_activity ON blocked_activity.pid = blocked_locks.pid JOIN pg_catalog.pg_locks blocking_locks ON blocking_locks.locktype = blocked_locks.locktype AND " \
-                    "blocking_locks.DATABASE IS NOT DISTINCT FROM blocked_locks.DATABASE AND blocking_locks.relation IS NOT DISTINCT FROM blocked_locks.relation AND blocking_locks.page IS NOT DISTINCT " \
-                    "FROM blocked_locks.page AND blocking_locks.tuple IS NOT DISTINCT FROM blocked_locks.tuple AND blocking_locks.virtualxid IS NOT DISTINCT FROM blocked_locks.virtualxid AND " \
-                    "blocking_locks.transactionid IS NOT DISTINCT FROM blocked_locks.transactionid AND blocking_locks.classid IS NOT DISTINCT FROM blocked_locks.classid AND blocking_locks.objid IS NOT DISTINCT " \
-                    "FROM blocked_locks.objid AND blocking_locks.objsubid IS NOT DISTINCT FROM blocked_locks.objsubid AND blocking_locks.pid != blocked_locks.pid " \
-                    "JOIN pg_catalog.pg_stat_activity blocking_activity ON blocking_activity.pid = blocking_locks.pid WHERE NOT blocked_locks.GRANTED"
-
-            cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql1)
-            rc, results = self.executecmd(cmd, False)
+        self.start_check('startup')
+        rc, errors = self.check_startup()
+        self.end_check(rc, errors)
+
+        self.start_check('anomaly')
+        rc, errors = self.check_anomalies()
+        self.end_check(rc, errors)
+
+        self.save_state()
+        self.flush_history()
+        self.end_report()
+        return rc, errors
+
+    ###########################################################
+    def check_startup(self):
+        # time to first query goes to the history, and is only warned about with a budget set: a loaded host is slow to start anyway
+        if self.firstquery < 0:
+            return SUCCESS, ''
+        self.record('startup.first_query_ms', self.firstquery)
+        budget = self.get_setting('startup', 'budgetms')
+        if self.verbose:
+            print ("time to first query: %d ms  budget: %d ms" % (self.firstquery, budget))
+        if budget > 0 and self.firstquery > budget:
+            marker = MARK_WARN
+            msg = "Time to first query of %d ms is over the startup budget of %d ms." % (self.firstquery, budget)
+            self.emit(marker, msg)
+        return SUCCESS, ''
+
+    ###########################################################
+    def run_checks(self, checkids):
+        for checkid in checkids:
+            if not self.check_enabled(checkid):
+                continue
+            if self.adaptive and CHECKS[checkid]['cost'] != 'cheap' and self.under_pressure() != '':
+                # deferred: lastrun is not updated so it runs again on the next calm run
+                if checkid not in self.skipped:
+                    self.skipped.append(checkid)
+                continue
+            if self.now() > self.deadline:
+                self.start_check('deadline')
+                marker = MARK_WARN
+                msg = "Run deadline of %d seconds exceeded.  Remaining checks were not run." % self.get_setting('guardrails', 'deadline')
+                self.emit(marker, msg)
+                self.end_check(SUCCESS, '')
+                return ERROR, msg
+            self.pgoptions = self.get_pgoptions(checkid)
+            self.start_check(checkid)
+            rc, errors = getattr(self, 'check_' + checkid)()
+            self.end_check(rc, errors)
+            self.state['lastrun'][checkid] = int(self.now())
             if rc != SUCCESS:
-                errors = "[ERROR] Unable to get count of blocked queries."
                 return rc, errors
-            blocked_queries_cnt = int(results)
-            if blocked_queries_cnt == 0:
-                marker = MARK_OK
-                msg = "No \"Waiting/Blocked queries\" longer than %d seconds were detected." % self.waitslocks
-            else:
-                marker = MARK_WARN
-                msg = "%d \"Waiting/Blocked queries\" longer than %d seconds were detected." % (blocked_queries_cnt, self.waitslocks)
-                cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql2)
-                rc, results2 = self.executecmd(cmd, False)
-                if rc != SUCCESS:
-                    print ("Unable to get waiting or blocked queries(A): %d %s\nsql=%s\n" % (rc, results2, sql2))
-                cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql3)
-                rc, results3 = self.executecmd(cmd, False)
+        return SUCCESS, ""
+
+    ###########################################################
+    def sweep_databases(self):
+        # per database checks for every database of the instance.  Each database gets its own copy of this instance
+        # (connection string, state file, history key, output buffer) and the copies run on a small thread pool, each
+        # worker holding one psql connection at a time, so the sweep never uses more than the worker count in connections.
+        sql = "select d.datname, (select count(*) from pg_stat_activity) from pg_database d where d.datallowconn and not d.datistemplate order by 1"
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
+        self.pgoptions = self.get_pgoptions('')
+        rc, results = self.executecmd(cmd, False)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get database list."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+
+        exclude   = [adb.strip() for adb in self.get_setting('alldatabases', 'exclude').split(',') if adb.strip() != '']
+        databases = []
+        conns     = 0
+        for aline in results.split('\n'):
+            if aline.strip() == '':
+                continue
+            cols  = aline.split('|')
+            conns = int(cols[1])
+            if cols[0] not in exclude:
+                databases.append(cols[0])
+
+        jobs = self.jobs if self.jobs > 0 else self.get_setting('alldatabases', 'jobs')
+        budget = jobs
+        if self.max_connections > 0:
+            budget = int((self.max_connections - conns) * self.get_setting('alldatabases', 'connpct') / 100)
+        workers = max(min(jobs, budget, len(databases)), 1)
+        if self.verbose:
+            print ("[****]  checking %d databases with %d workers (jobs=%d, connection budget=%d)" % (len(databases), workers, jobs, budget))
+
+        problems = []
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # map() hands results back in database order, each one as soon as it and the ones before it are done
+            for worker, rc, errors in pool.map(self.sweep_database, databases, range(len(databases))):
+                for aline in worker.outbuf:
+                    print (aline, flush=True)
+                self.records += worker.records
+                self.skipped += [checkid for checkid in worker.skipped if checkid not in self.skipped]
                 if rc != SUCCESS:
-                    print ("Unable to get waiting or blocked queries(B): %d %s\nsql=%s\n" % (rc, results2, sql3))
+                    problems.append("%s (error: %s)" % (worker.database, str(errors).strip().split('\n')[0]))
+                elif len(worker.warnings) > 0:
+                    problems.append("%s (%s)" % (worker.database, ', '.join(worker.warnings)))
 
-                subject = '%d Waiting/BLocked SQL(s) Detected' % (blocked_queries_cnt)
-                if results2 is None or results2.strip() == '':
-                    results2 = ''
-                if results3 is None or results3.strip() == '':
-                    results3 = ''
-                if self.debug:
-                    print("[****]  results2=%s" % results2)
-                    print("[****]  results3=%s" % results3)
-                    print("[****]  ")
-                    print("[****]  total results=%s" % results2 + '\r\n' + results3)
-                # /r makes body disappear!
-                if results2.strip() == '' and results3.strip() == '':
-                    # then must have gone away so don't report anything
-                    msg = "%d \"Waiting/Blocked queries\" longer than %d seconds were detected but details not available anymore." % (blocked_queries_cnt, self.waitslocks)
-                    if self.verbose:
-                        print("%d waits/locks detected, but details are no longer available." % blocked_queries_cnt)
+        self.record('alldatabases.count', len(databases))
+        self.record('alldatabases.problems', len(problems))
+        if len(problems) == 0:
+            marker = MARK_OK
+            msg = "No problems found in %d databases (%d workers)." % (len(databases), workers)
+        else:
+            marker = MARK_WARN
+            msg = "%d of %d databases have problems (%d workers)." % (len(problems), len(databases), workers)
+            for problem in problems:
+                msg += "\n        " + problem
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def sweep_database(self, database, index):
+        # runs on a worker thread: nothing here may touch the main instance's mutable state
+        worker = copy.copy(self)
+        worker.database    = database
+        worker.connstring  = self.get_connstring(database)
+        worker.sweeping    = True
+        worker.outbuf      = []
+        worker.records     = []
+        worker.metrics     = []
+        worker.warnings    = []
+        worker.skipped     = []
+        worker.checkid     = ''
+        worker.queries     = dict(self.queries)
+        worker.batch       = {}
+        worker.interval    = 0
+        worker.session     = None
+        worker.prepared    = {}
+        worker.lockowned   = False
+        worker.workfile    = "%s%s%s_%d_stats.sql" % (self.tempdir, self.dir_delim, self.pid, index)
+        worker.tempfile    = "%s%s%s_%d_temp.sql" % (self.tempdir, self.dir_delim, self.pid, index)
+        if database == self.database:
+            # the -d database has the main run's state file: share its state, which the main run saves after the sweep,
+            # rather than save it here and have the main run overwrite it with the copy it loaded at startup
+            worker.state = self.state
+        else:
+            worker.state = {'lastrun': {}}
+            worker.load_state()
+
+        worker.prefetch(DBCHECKS)
+        rc, errors = worker.run_checks(DBCHECKS)
+        if database != self.database:
+            worker.save_state()
+        worker.flush_history()
+        worker.cleanup()
+        return worker, rc, errors
+
+    ###########################################################
+    def under_pressure(self):
+        # returns the reason the database is considered under pressure, or empty string if it is not.
+        # Only the cheap signals already gathered in this run are used.
+        if not self.adaptive:
+            return ''
+        reasons = []
+        if self.pressure.get('load', -1) > self.get_setting('adaptive', 'loadpct'):
+            reasons.append("load=%d%% of cpus" % self.pressure['load'])
+        if self.pressure.get('active', -1) > self.get_setting('adaptive', 'activepct'):
+            reasons.append("active connections=%d%%" % self.pressure['active'])
+        if self.pressure.get('blocked', -1) >= self.get_setting('adaptive', 'blocked'):
+            reasons.append("blocked queries=%d" % self.pressure['blocked'])
+        if len(reasons) == 0:
+            return ''
+
+        if not self.underpressure:
+            # protect the server from the rest of our own monitoring queries, see get_pgoptions()
+            self.underpressure = True
+            if self.verbose:
+                print ("[****]  Database under pressure (%s). Using adaptive statement_timeout and lock_timeout." % ', '.join(reasons))
+        return ', '.join(reasons)
+
+    ###########################################################
+    def get_pgoptions(self, checkid):
+        # session settings for every probe of a check, passed to psql via PGOPTIONS.  For probes of several checks run as
+        # one query checkid is the list of them, and the tightest of their statement timeouts applies.
+        if self.underpressure:
+            statement_timeout = self.get_setting('adaptive', 'statement_timeout')
+            lock_timeout      = self.get_setting('adaptive', 'lock_timeout')
+        else:
+            timeouts = []
+            for acheckid in (checkid if isinstance(checkid, list) else [checkid]):
+                if acheckid == '':
+                    cost = 'cheap'
                 else:
-                    #rc = self.send_alert(self.to, self.from_, subject, results2+ '\r\n' + results3)
-                    if self.alert(WAITS):
-                        rc = self.send_alert(self.to, self.from_, subject, results2 + '\n' + results3)
-                        if rc != 0:
-                            print("mail error")
-                            return 1
-            print (marker+msg)
+                    cost = CHECKS[acheckid]['cost']
+                timeout = self.get_setting('guardrails', cost + '_timeout')
+                if acheckid != '':
+                    timeout = self.get_setting(acheckid, 'statement_timeout', timeout)
+                timeouts.append(timeout)
+            statement_timeout = min(timeouts, key=self.timeout_ms)
+            lock_timeout = self.get_setting('guardrails', 'lock_timeout')
+
+        pgoptions = "-c statement_timeout=%s -c lock_timeout=%s" % (statement_timeout, lock_timeout)
+        work_mem = self.get_setting('guardrails', 'work_mem')
+        if work_mem != '':
+            pgoptions += " -c work_mem=%s" % work_mem
+        return pgoptions
 
-        if self.idleintransmins   > 0:
-            #######################################################################
-            # get existing "idle in transaction" connections longer than 10 minutes
-            #######################################################################
-            # NOTE: 9.1 uses procpid, current_query, and no state column, but 9.2+ uses pid, query and state columns respectively.  Also idle is <IDLE> in current_query for 9.1 and less
-                #       <IDLE> in transaction for 9.1 but idle in transaction for state column in 9.2+
-            if self.pgversionmajor < Decimal('9.2'):
-                # select substring(current_query,1,50), round(EXTRACT(EPOCH FROM (now() - query_start))), now(), query_start  from pg_stat_activity;
-                sql1 = "select count(*) from pg_stat_activity where current_query ilike \'<IDLE> in transaction%%\' and round(EXTRACT(EPOCH FROM (now() - query_start))) > %d" % self.idleintransmins
-                sql2 = "select datname, usename, application_name from pg_stat_activity where current_query ilike \'idle in transaction\' and round(EXTRACT(EPOCH FROM (now() - query_start))) > %d" % self.idleintransmins
-            else:
-                # select substring(query,1,50), round(EXTRACT(EPOCH FROM (now() - query_start))), now(), query_start, state  from pg_stat_activity;
-                sql1 = "select count(*) from pg_stat_activity where state = \'idle in transaction\' and round(EXTRACT(EPOCH FROM (now() - query_start))) / 60 > %d" % self.idleintransmins
-                sql2 = "select 'pid=' || pid || '  db=' || datname || '  user=' || usename || '  app=' || coalesce(application_name, 'N/A') || '  clientip=' || client_addr || '  duration=' || round(round(EXTRACT(EPOCH FROM (now() - query_start))) / 60) || ' mins' from pg_stat_activity where state = \'idle in transaction\' and round(EXTRACT(EPOCH FROM (now() - query_start))) / 60 > %d" % self.idleintransmins
-                cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql1)
-            rc, results = self.executecmd(cmd, False)
-            if rc != SUCCESS:
-                errors = "Unable to get count of idle in transaction connections: %d %s\nsql=%s\n" % (rc, results, sql1)
-                return rc, errors
-            idle_in_transaction_cnt = int(results)
+    ###########################################################
+    def timeout_ms(self, value):
+        # a PostgreSQL time setting (500ms, 10s, 1min, plain milliseconds) in milliseconds, 0 (no timeout) the longest
+        match = re.match(r'\s*([0-9.]+)\s*(ms|s|min|h|d)?\s*$', str(value))
+        if match is None or float(match.group(1)) == 0:
+            return float('inf')
+        return float(match.group(1)) * {None: 1, 'ms': 1, 's': 1000, 'min': 60000, 'h': 3600000, 'd': 86400000}[match.group(2)]
 
-            if idle_in_transaction_cnt == 0:
-                marker = MARK_OK
-                msg = "No \"idle in transaction\" longer than %d minutes were detected." % self.idleintransmins
-            else:
-                marker = MARK_WARN
-                msg = "%d \"idle in transaction\" longer than %d minutes were detected." % (idle_in_transaction_cnt, self.idleintransmins)
+    ###########################################################
+    def check_waits(self):
+        if self.waitslocks < 1:
+            return SUCCESS, ""
 
-                cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql2)
-                rc, results2 = self.executecmd(cmd, False)
-                if rc != SUCCESS:
-                    print ("Unable to get idle in transaction queries: %d %s\nsql=%s\n" % (rc, results2, sql2))
-                subject = '%d Idle In Trans SQL(s) detected longer than %d minutes' % (idle_in_transaction_cnt, self.idleintransmins)
-                if self.alert(IDLEINTRANS):
-                    rc = self.send_alert(self.to, self.from_, subject, results2)
-                    if rc != 0:
-                        print("mail error")
-                        return 1
-            print (marker+msg)
+        ##########################################################
+        # Get lock waiting transactions where wait is > input seconds
+        ##########################################################
+        sql2 = self.get_query('waits.details', self.waitslocks)
+        sql3 = self.get_query('waits.blocking')
 
-        if self.longquerymins > 0:
-            ######################################
-            # Get long running queries > 5 minutes (default
-            ######################################
-            # NOTE: 9.1 uses procpid, current_query, and no state column, but 9.2+ uses pid, query and state columns respectively.  Also idle is <IDLE> in current_query for 9.1 and less
-            #       <IDLE> in transaction for 9.1 but idle in transaction for state column in 9.2+
-            if self.pgversionmajor < Decimal('9.2'):
-                # select procpid,datname,usename, client_addr, now(), query_start, substring(current_query,1,100), now() - query_start as duration from pg_stat_activity where current_query not ilike '<IDLE%' and current_query <> ''::text and now() - query_start > interval '5 minutes';
-                sql1 = "select count(*) from pg_stat_activity where current_query not ilike '<IDLE%' and current_query <> ''::text and now() - query_start > interval '%d minutes'" % self.longquerymins
-                sql2 = "select 'db=' || datname || '  user=' || usename || '  appname=' || application_name || '  sql=' || query from pg_stat_activity where current_query not ilike '<IDLE%%' and current_query <> ''::text and now() - query_start > interval '%d minutes'" % self.longquerymins
-            else:
-                # select pid,datname,usename, client_addr, now(), state, query_start, substring(query,1,100), now() - query_start as duration from pg_stat_activity where state not ilike 'idle%' and query <> ''::text and now() - query_start > interval '%d minutes'" % self.longquerymins
-                sql1 = "select count(*) from pg_stat_activity where backend_type not in ('walsender') and state not ilike 'idle%%' and query <> ''::text and now() - query_start > interval '%s minutes'" % self.longquerymins
-                sql2 = "select 'pid=' || pid || '  db=' || datname || '  user=' || usename || '  appname=' || coalesce(application_name, 'N/A') || '  minutes=' || " \
-                       "(case when state in ('active','idle in transaction') then cast(EXTRACT(EPOCH FROM (now() - query_start)) as integer) / 60 else -1 end) || '\n' ||" \
-                       "'sql=' || regexp_replace(replace(regexp_replace(query, E'[\\n\\r]+', ' ', 'g' ),'    ',''), '[^\x20-\x7f\x0d\x1b]', '', 'g') || '\n\n'" \
-                       "from pg_stat_activity where backend_type not in ('walsender') and state not ilike 'idle%%' and query <> ''::text and now() - query_start > interval '%d minutes'" % self.longquerymins
-
-            cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql1)
-            rc, results = self.executecmd(cmd, False)
-            if rc != SUCCESS:
-                errors = "[ERROR] Unable to get count of long running queries."
-                return rc, errors
-            long_queries_cnt = int(results)
-            if long_queries_cnt == 0:
-                marker = MARK_OK
-                msg = "No \"long running queries\" longer than %d minutes were detected." % self.longquerymins
-                print (marker+msg)
-            else:
-                # get the actual sqls:
-                cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql2)
-                rc, results2 = self.executecmd(cmd, False)
+        rc, results = self.run_query('waits.count', self.waitslocks)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get count of blocked queries."
+            return rc, errors
+        blocked_queries_cnt = int(results)
+        self.pressure['blocked'] = blocked_queries_cnt
+        self.record('waits.blocked', blocked_queries_cnt)
+        if blocked_queries_cnt == 0:
+            marker = MARK_OK
+            msg = "No \"Waiting/Blocked queries\" longer than %d seconds were detected." % self.waitslocks
+        else:
+            marker = MARK_WARN
+            msg = "%d \"Waiting/Blocked queries\" longer than %d seconds were detected." % (blocked_queries_cnt, self.waitslocks)
+            results2 = ''
+            results3 = ''
+            if sql2 is not None:
+                rc, results2 = self.run_query('waits.details', self.waitslocks)
                 if rc != SUCCESS:
-                    errors = "[ERROR] Unable to get long running queries."
-                    print (errors)
-                    return rc, errors
+                    self.writeout("Unable to get waiting or blocked queries(A): %d %s\nsql=%s\n" % (rc, results2, sql2))
+            if sql3 is not None:
+                rc, results3 = self.run_query('waits.blocking')
+                if rc != SUCCESS:
+                    self.writeout("Unable to get waiting or blocked queries(B): %d %s\nsql=%s\n" % (rc, results3, sql3))
 
-                marker = MARK_WARN
-                msg = "%d \"long running queries\" longer than %d minutes were detected." % (long_queries_cnt, self.longquerymins)
-                print (marker+msg)
-                subject = '%d Long Running SQL(s) Detected longer than %d minutes' % (long_queries_cnt, self.longquerymins)
-                if self.alert("LONGQUERY"):
-                    rc = self.send_alert(self.to, self.from_, subject, results2)
+            subject = '%d Waiting/BLocked SQL(s) Detected' % (blocked_queries_cnt)
+            if results2 is None or results2.strip() == '':
+                results2 = ''
+            if results3 is None or results3.strip() == '':
+                results3 = ''
+            if self.debug:
+                print("[****]  results2=%s" % results2)
+                print("[****]  results3=%s" % results3)
+                print("[****]  ")
+                print("[****]  total results=%s" % results2 + '\r\n' + results3)
+            # /r makes body disappear!
+            if results2.strip() == '' and results3.strip() == '':
+                # then must have gone away so don't report anything
+                msg = "%d \"Waiting/Blocked queries\" longer than %d seconds were detected but details not available anymore." % (blocked_queries_cnt, self.waitslocks)
+                if self.verbose:
+                    print("%d waits/locks detected, but details are no longer available." % blocked_queries_cnt)
+            else:
+                #rc = self.send_alert(self.to, self.from_, subject, results2+ '\r\n' + results3)
+                if self.alert(WAITS):
+                    rc = self.send_alert(self.to, self.from_, subject, results2 + '\n' + results3)
                     if rc != 0:
-                        print("mail error")
-                        return 1
+                        self.writeout("mail error")
+                        return 1, "mail error"
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
-        if self.cpus > 0 or self.local:
-            #################################################
-            # Get cpu load info based on top and active conns
-            #################################################
+    ###########################################################
+    def check_idleintrans(self):
+        if self.idleintransmins < 1:
+            return SUCCESS, ""
 
-            # get load averages for 1, 5 and 15 minute intervals
-            cmd = "uptime"
-            rc, results = self.executecmd(cmd, True)
-            if rc != 0:
-                errors = "[ERROR] Unable to get linux load info"
-                return rc, errors
+        #######################################################################
+        # get existing "idle in transaction" connections longer than 10 minutes
+        #######################################################################
+        # NOTE: 9.1 uses procpid, current_query, and no state column, but 9.2+ uses pid, query and state columns respectively.  Also idle is <IDLE> in current_query for 9.1 and less
+            #       <IDLE> in transaction for 9.1 but idle in transaction for state column in 9.2+
+        sql1 = self.get_query('idleintrans.count', self.idleintransmins)
+        sql2 = self.get_query('idleintrans.details', self.idleintransmins)
+        rc, results = self.run_query('idleintrans.count', self.idleintransmins)
+        if rc != SUCCESS:
+            errors = "Unable to get count of idle in transaction connections: %d %s\nsql=%s\n" % (rc, results, sql1)
+            return rc, errors
+        idle_in_transaction_cnt = int(results)
+        self.record('idleintrans.count', idle_in_transaction_cnt)
 
-            # output will look like this -->  12:34:25 up 53 days, 16:18,  6 users,  load average: 1.45, 1.61, 1.67
-            #                                 20:21:12 up 55 days, 10 min,  9 users,  load average: 1.27, 1.50, 1.52
-            threshold = 0.9 * self.cpus
-            parts  = results.split()
-            atime  = parts[0].strip()
-            index = 0
-            for apart in parts:
-                if 'average' in apart:
-                    load1  = parts[index + 1].strip()
-                    load1  = load1.replace(',','')
-                    load1rnd = round(Decimal(load1),2)
-                    load5  = parts[index + 2].strip()
-                    load5  = load5.replace(',','')
-                    load5rnd = round(Decimal(load5),2)
-                    load15 = parts[index + 3].strip()
-                    load15rnd = round(Decimal(load15),2)
-                    break
-                index = index + 1
-
-            if load1rnd > threshold:
-                marker = MARK_WARN
-                subject = "High Load Detected."
-                msg = "1 minute load > 90%% value=%.2f" % load1rnd
-                if self.alert(LOAD1):
-                    rc = self.send_alert(self.to, self.from_, subject, msg)
-            elif load5rnd > threshold:
-                marker = MARK_WARN
-                subject = "High Load Detected."
-                msg = "5 minute load > 90%% value=%.2f" % load5rnd
-                if self.alert(LOAD5):
-                    rc = self.send_alert(self.to, self.from_, subject, msg)
-            elif load15rnd > threshold:
-                marker = MARK_WARN
-                subject = "High Load Detected."
-                msg = "15 minute load > 90%% value=%.2f" % load15rnd
-                if self.alert(LOAD15):
-                    rc = self.send_alert(self.to, self.from_, subject, msg)
-            else:
-                marker = MARK_OK
-                msg = "1 minute load < 90%% value=%.2f" % load1rnd
-            print (marker+msg)
+        if idle_in_transaction_cnt == 0:
+            marker = MARK_OK
+            msg = "No \"idle in transaction\" longer than %d minutes were detected." % self.idleintransmins
+        else:
+            marker = MARK_WARN
+            msg = "%d \"idle in transaction\" longer than %d minutes were detected." % (idle_in_transaction_cnt, self.idleintransmins)
 
-            sql = "select count(*) as active from pg_stat_activity where state in ('active', 'idle in transaction')"
-            cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
-            rc, results = self.executecmd(cmd, False)
+            rc, results2 = self.run_query('idleintrans.details', self.idleintransmins)
             if rc != SUCCESS:
-                errors = "[ERROR] Unable to get count of active connections."
-                return rc, errors
-            active_cnt = int(results)
-            # formula is (#cpus * 2) + (#cpus / 2)
-            cpusaturation = round(self.cpus * 2.5)
-            loadpct = round(active_cnt / cpusaturation, 2) * 100
-            loadint = int(loadpct)
-            #print("activecnt=%d  cpus=%d  cpusaturation=%4.1f   loadpct=%4.2f  loadint=%d" % (active_cnt, self.cpus,cpusaturation, loadpct, loadint))
-            if loadpct <= 80.0:
-                marker = MARK_OK
-                msg = "No \"high number of active connections\" detected:%d" % active_cnt
-            else:
-                marker = MARK_WARN
-                subject = 'High CPU load detected.'
-                msg = "\"High number of active connections\" detected:%d  Implied load: %d%%" % (active_cnt, loadint)
-                if self.alert(ACTIVECONNS):
-                    rc = self.send_alert(self.to, self.from_, subject, msg)
-                    if rc != 0:
-                        print("mail error")
-                        return 1
-            print (marker+msg)
+                self.writeout("Unable to get idle in transaction queries: %d %s\nsql=%s\n" % (rc, results2, sql2))
+            subject = '%d Idle In Trans SQL(s) detected longer than %d minutes' % (idle_in_transaction_cnt, self.idleintransmins)
+            if self.alert(IDLEINTRANS):
+                rc = self.send_alert(self.to, self.from_, subject, results2)
+                if rc != 0:
+                    self.writeout("mail error")
+                    return 1, "mail error"
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
-        if self.idleconnmins   > 0:
-            #############################################################
-            # get existing idle connections longer than specified minutes
-            #############################################################
-            # NOTE: 9.1 uses procpid, current_query, and no state column, but 9.2+ uses pid, query and state columns respectively.  Also idle is <IDLE> in current_query for 9.1 and less
-                #       <IDLE> in transaction for 9.1 but idle in transaction for state column in 9.2+
-            if self.pgversionmajor < Decimal('9.2'):
-                print ("Action not implemented for PG Versions < 9.1 and older.")
-                return 1
-            else:
-                # NOTE: filter condition based on IMO customization for "ggs"
-                sql1 = \
-                    "select count(*) from pg_stat_activity where state = 'idle' and usename <> 'ggs' and cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) / 60 > %d" % self.idleconnmins
-
-                '''
-                select 'pid=' || pid || '  db=' || coalesce(datname,'N/A') || '  user=' || coalesce(usename, 'N/A') || '  app=' || coalesce(application_name, 'N/A') || '  clientip=' || client_addr || '  state=idle' ||
-                '  backend_type=' || (case when backend_type = 'logical replication launcher' then 'logical rep launcher' when backend_type = 'autovacuum launcher' then 'autovac launcher' when backend_type = 'autovacuum worker' then 'autovac wrkr' else backend_type end) ||
-                '  backend_start=' || to_char(backend_start, 'YYYY-MM-DD HH24:MI:SS') ||
-                '  conn mins=' || cast(EXTRACT(EPOCH FROM (now() - backend_start)) / 60 as integer) ||
-                '  idle mins=' || cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) / 60 as idle_mins
-                FROM pg_stat_activity WHERE state in ('idle') and usename <> 'ggs' and cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) / 60 > 200 order by cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) desc;
-                '''
-
-                sql2 = \
-                    "select 'pid=' || pid || '  db=' || coalesce(datname,'N/A') || '  user=' || coalesce(usename, 'N/A') || '  app=' || coalesce(application_name, 'N/A') || '  clientip=' || client_addr || '  state=idle' || " \
-                    " '  backend_type=' || (case when backend_type = 'logical replication launcher' then 'logical rep launcher' when backend_type = 'autovacuum launcher' then 'autovac launcher' when backend_type = 'autovacuum worker' then 'autovac wrkr' else backend_type end) || " \
-                    " '  backend_start=' || to_char(backend_start, 'YYYY-MM-DD HH24:MI:SS') || " \
-                    " '  conn mins=' || cast(EXTRACT(EPOCH FROM (now() - backend_start)) / 60 as integer) || " \
-                    " '  idle mins=' || cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) / 60 as idle_mins " \
-                    " FROM pg_stat_activity WHERE state in ('idle') and usename <> 'ggs' and cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) / 60 > %d order by cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) desc" % self.idleconnmins
-
-                cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql1)
-            rc, results = self.executecmd(cmd, False)
-            if rc != SUCCESS:
-                errors = "[ERROR] Unable to get count of idle connections."
-                return rc, errors
-            idle_conns = int(results)
+    ###########################################################
+    def check_longquery(self):
+        if self.longquerymins < 1:
+            return SUCCESS, ""
 
-            if idle_conns == 0:
-                marker = MARK_OK
-                msg = "No \"idle connections\" longer than %d minutes were detected." % self.idleconnmins
-            else:
-                marker = MARK_WARN
-                msg = "%d \"idle connections\" longer than %d minutes were detected." % (idle_conns, self.idleconnmins)
+        ######################################
+        # Get long running queries > 5 minutes (default
+        ######################################
+        # NOTE: 9.1 uses procpid, current_query, and no state column, but 9.2+ uses pid, query and state columns respectively.  Also idle is <IDLE> in current_query for 9.1 and less
+        #       <IDLE> in transaction for 9.1 but idle in transaction for state column in 9.2+
+        sql2 = self.get_query('longquery.details', self.longquerymins)
 
-                cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql2)
-                rc, results2 = self.executecmd(cmd, False)
+        rc, results = self.run_query('longquery.count', self.longquerymins)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get count of long running queries."
+            return rc, errors
+        long_queries_cnt = int(results)
+        self.record('longquery.count', long_queries_cnt)
+        if long_queries_cnt == 0:
+            marker = MARK_OK
+            msg = "No \"long running queries\" longer than %d minutes were detected." % self.longquerymins
+            self.emit(marker, msg)
+        else:
+            # get the actual sqls:
+            results2 = ''
+            if sql2 is not None:
+                rc, results2 = self.run_query('longquery.details', self.longquerymins)
                 if rc != SUCCESS:
-                    print ("[ERROR] Unable to get idle connection.")
-                subject = '%d Idle connection(s) detected longer than %d minutes' % (idle_conns, self.idleconnmins)
-                if self.alert(IDLECONNS):
-                    rc = self.send_alert(self.to, self.from_, subject, results2)
-                    if rc != 0:
-                        print("mail error")
-                        return 1
-            print (marker+msg)
+                    errors = "[ERROR] Unable to get long running queries."
+                    self.writeout(errors)
+                    return rc, errors
 
-        # Dec. 19, 2023 don't know why I stopped here, so disregard this input parameter for now
-        #if not self.genchecks
-        #    return SUCCESS, ""
+            marker = MARK_WARN
+            msg = "%d \"long running queries\" longer than %d minutes were detected." % (long_queries_cnt, self.longquerymins)
+            self.emit(marker, msg)
+            subject = '%d Long Running SQL(s) Detected longer than %d minutes' % (long_queries_cnt, self.longquerymins)
+            if self.alert(LONGQUERY):
+                rc = self.send_alert(self.to, self.from_, subject, results2)
+                if rc != 0:
+                    self.writeout("mail error")
+                    return 1, "mail error"
+        return SUCCESS, ""
 
-        #####################################
-        # analyze pg major and minor versions
-        #####################################
-        if self.pgversionmajor < Decimal('11.0'):
+    ###########################################################
+    def check_load(self):
+        if self.cpus < 1 and not self.local:
+            return SUCCESS, ""
+
+        #################################################
+        # Get cpu load info based on top and active conns
+        #################################################
+
+        # get load averages for 1, 5 and 15 minute intervals
+        cmd = "uptime"
+        rc, results = self.executecmd(cmd, True)
+        if rc != 0:
+            errors = "[ERROR] Unable to get linux load info"
+            return rc, errors
+
+        # output will look like this -->  12:34:25 up 53 days, 16:18,  6 users,  load average: 1.45, 1.61, 1.67
+        #                                 20:21:12 up 55 days, 10 min,  9 users,  load average: 1.27, 1.50, 1.52
+        loadfactor = self.get_setting('load', 'loadfactor')
+        loadpct    = int(loadfactor * 100)
+        threshold  = loadfactor * self.cpus
+        parts  = results.split()
+        atime  = parts[0].strip()
+        index = 0
+        for apart in parts:
+            if 'average' in apart:
+                load1  = parts[index + 1].strip()
+                load1  = load1.replace(',','')
+                load1rnd = round(Decimal(load1),2)
+                load5  = parts[index + 2].strip()
+                load5  = load5.replace(',','')
+                load5rnd = round(Decimal(load5),2)
+                load15 = parts[index + 3].strip()
+                load15rnd = round(Decimal(load15),2)
+                break
+            index = index + 1
+        if self.cpus > 0:
+            self.pressure['load'] = int(load1rnd * 100 / self.cpus)
+        self.record('load.load1', load1rnd)
+        self.record('load.load5', load5rnd)
+        self.record('load.load15', load15rnd)
+
+        if load1rnd > threshold:
             marker = MARK_WARN
-            msg = "Unsupported major version detected: %.1f.  Please upgrade ASAP." % self.pgversionmajor
-            html = "<tr><td width=\"5%\"><font color=\"red\">&#10060;</font></td><td width=\"20%\"><font color=\"red\">PG Major Version Summary</font></td><td width=\"75%\"><font color=\"red\">" + msg + "</font></td></tr>"
-        elif self.pgversionmajor < Decimal('16.0'):
+            subject = "High Load Detected."
+            msg = "1 minute load > %d%% value=%.2f" % (loadpct, load1rnd)
+            if self.alert(LOAD1):
+                rc = self.send_alert(self.to, self.from_, subject, msg)
+        elif load5rnd > threshold:
             marker = MARK_WARN
-            msg = "Current PG major version (%s) is not the latest.  Consider upgrading to 16." % self.pgversionmajor
-            html = "<tr><td width=\"5%\"><font color=\"red\">&#10060;</font></td><td width=\"20%\"><font color=\"red\">PG Major Version Summary</font></td><td width=\"75%\"><font color=\"red\">" + msg + "</font></td></tr>"
+            subject = "High Load Detected."
+            msg = "5 minute load > %d%% value=%.2f" % (loadpct, load5rnd)
+            if self.alert(LOAD5):
+                rc = self.send_alert(self.to, self.from_, subject, msg)
+        elif load15rnd > threshold:
+            marker = MARK_WARN
+            subject = "High Load Detected."
+            msg = "15 minute load > %d%% value=%.2f" % (loadpct, load15rnd)
+            if self.alert(LOAD15):
+                rc = self.send_alert(self.to, self.from_, subject, msg)
         else:
             marker = MARK_OK
-            msg = "Current PG major version (%s) is the latest.  No major upgrade necessary." % self.pgversionmajor
-            html = "<tr><td width=\"5%\"><font color=\"blue\">&#10004;</font></td><td width=\"20%\"><font color=\"blue\">PG Major Version Summary</font></td><td width=\"75%\"><font color=\"blue\">" + msg + "</font></td></tr>"
+            msg = "1 minute load < %d%% value=%.2f" % (loadpct, load1rnd)
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
-        print (marker+msg)
+    ###########################################################
+    def check_activeconns(self):
+        if self.cpus < 1 and not self.local:
+            return SUCCESS, ""
 
-        # latest versions: 16.1, 15.5, 14.10, 13.13, 12.17, 11.22, 10.23, 9.6.24
-        #print("latest version: %s" % self.pgversionmajor)
-        if self.pgversionmajor > Decimal('9.5'):
-            if self.datediff.days > 120:
-                # probably a newer minor version is already out since these minor versions were last updated in the program
-                marker = MARK_WARN
-                msg = "Current version: %s.  Please upgrade to latest minor version." % self.pgversionminor
-            elif self.pgversionmajor == Decimal('9.6') and self.pgversionminor < '9.6.24':
-                marker = MARK_WARN
-                msg = "Current version: %s.  Please upgrade to last minor version, 9.6.24." % self.pgversionminor
-            elif self.pgversionmajor == Decimal('10.0') and self.pgversionminor < '10.23':
-                marker = MARK_WARN
-                msg = "Current version: %s.  Please upgrade to last minor version, 10.23." % self.pgversionminor
-            elif self.pgversionmajor == Decimal('11.0') and self.pgversionminor < '11.22':
-                marker = MARK_WARN
-                msg = "Current version: %s.  Please upgrade to latest minor version, 11.22." % self.pgversionminor
-            elif self.pgversionmajor == Decimal('12.0') and self.pgversionminor < '12.17':
-                marker = MARK_WARN
+        sql = "select count(*) as active from pg_stat_activity where state in ('active', 'idle in transaction')"
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
+        rc, results = self.executecmd(cmd, False)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get count of active connections."
+            return rc, errors
+        active_cnt = int(results)
+        # formula is (#cpus * 2) + (#cpus / 2)
+        cpusaturation = round(self.cpus * self.get_setting('activeconns', 'cpufactor'))
+        loadpct = round(active_cnt / cpusaturation, 2) * 100
+        loadint = int(loadpct)
+        self.pressure['active'] = loadint
+        self.record('activeconns.count', active_cnt)
+        self.record('activeconns.pct', loadpct)
+        #print("activecnt=%d  cpus=%d  cpusaturation=%4.1f   loadpct=%4.2f  loadint=%d" % (active_cnt, self.cpus,cpusaturation, loadpct, loadint))
+        if loadpct <= self.get_setting('activeconns', 'maxpct'):
+            marker = MARK_OK
+            msg = "No \"high number of active connections\" detected:%d" % active_cnt
+        else:
+            marker = MARK_WARN
+            subject = 'High CPU load detected.'
+            msg = "\"High number of active connections\" detected:%d  Implied load: %d%%" % (active_cnt, loadint)
+            if self.alert(ACTIVECONNS):
+                rc = self.send_alert(self.to, self.from_, subject, msg)
+                if rc != 0:
+                    self.writeout("mail error")
+                    return 1, "mail error"
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def check_waitprofile(self):
+        # ASH style sampler: one psql session prepares the sample query once and executes it every intervalms for the
+        # sampling window, so the overhead is one connection and one parse no matter how many samples are taken.
+        seconds    = self.get_setting('waitprofile', 'seconds')
+        intervalms = max(self.get_setting('waitprofile', 'intervalms'), 10)
+        samples    = max(int(seconds * 1000 / intervalms), 1)
+
+        # CPU means active and not waiting on anything.  The '*' row carries the number of client sessions for pool saturation.
+        script = "PREPARE pg_check_ash(int) AS " \
+                 "select $1, coalesce(wait_event_type, 'CPU'), coalesce(wait_event, 'CPU'), count(*) from pg_stat_activity " \
+                 "where state = 'active' and backend_type = 'client backend' and pid <> pg_backend_pid() group by 2, 3 " \
+                 "union all select $1, '*', '*', count(*) from pg_stat_activity where backend_type = 'client backend';\n"
+        for sample in range(samples):
+            script += "EXECUTE pg_check_ash(%d);\n" % sample
+            if sample < samples - 1:
+                script += "SELECT pg_sleep(%.3f);\n" % (intervalms / 1000)
+        try:
+            with open(self.workfile, 'w') as f:
+                f.write(script)
+        except OSError as e:
+            errors = "[ERROR] Unable to write wait event sampler script: %s" % e
+            self.writeout(errors)
+            return ERROR, errors
+
+        # ON_ERROR_STOP so a failed statement ends the script with an error instead of a profile of the samples that worked
+        cmd = "psql %s -At -q -X -v ON_ERROR_STOP=1 -f %s" % (self.connstring, self.workfile)
+        rc, results = self.executecmd(cmd, False)
+        if rc == SUCCESS:
+            # every sample has a '*' row, so a sample without one failed
+            taken = set(aline.split('|')[0] for aline in results.split('\n') if aline.split('|')[1:2] == ['*'])
+            if len(taken) < samples:
+                rc = ERROR
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to sample wait events."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+
+        events   = {}
+        classes  = {}
+        sessions = 0
+        active   = 0
+        for aline in results.split('\n'):
+            cols = aline.split('|')
+            if len(cols) < 4:
+                continue
+            cnt = int(cols[3])
+            if cols[1] == '*':
+                sessions = max(sessions, cnt)
+                continue
+            events[cols[1] + ':' + cols[2]] = events.get(cols[1] + ':' + cols[2], 0) + cnt
+            classes[cols[1]] = classes.get(cols[1], 0) + cnt
+            active += cnt
+
+        # average active sessions over the window, compared to cpus and to the connection pool
+        aas = active / samples
+        self.record('waitprofile.aas', aas)
+        self.record('waitprofile.sessions', sessions)
+        for aclass in classes:
+            self.record('waitprofile.aas.' + aclass.lower(), classes[aclass] / samples)
+
+        problems = []
+        if self.cpus > 0:
+            aaspct = int(aas * 100 / self.cpus)
+            cpuinfo = " on %d cpus (%d%%)" % (self.cpus, aaspct)
+            if aaspct > self.get_setting('waitprofile', 'maxaaspct'):
+                problems.append("active sessions exceed %d%% of cpus" % self.get_setting('waitprofile', 'maxaaspct'))
+        else:
+            cpuinfo = ''
+        poolinfo = ''
+        if self.max_connections > 0:
+            poolpct = int(sessions * 100 / self.max_connections)
+            poolinfo = "  sessions=%d of %d (%d%%)" % (sessions, self.max_connections, poolpct)
+            if poolpct > self.get_setting('waitprofile', 'poolpct'):
+                problems.append("connection pool is over %d%% of max_connections" % self.get_setting('waitprofile', 'poolpct'))
+
+        summary = "Wait profile over %ds (%d samples): AAS=%.2f%s%s" % (seconds, samples, aas, cpuinfo, poolinfo)
+        if active > 0:
+            summary += "\n        classes: " + ', '.join("%s %d%%" % (aclass, round(cnt * 100 / active)) for aclass, cnt in sorted(classes.items(), key=lambda x: -x[1]))
+            for event, cnt in sorted(events.items(), key=lambda x: -x[1])[:self.get_setting('waitprofile', 'top')]:
+                summary += "\n        %-40s %5.1f%% of active time  AAS=%.2f" % (event, cnt * 100 / active, cnt / samples)
+
+        if len(problems) == 0:
+            marker = MARK_OK
+            msg = summary
+        else:
+            marker = MARK_WARN
+            subject = 'Active session saturation detected.'
+            msg = summary + "\n        " + "\n        ".join(problems)
+            if self.alert(WAITPROFILE):
+                rc = self.send_alert(self.to, self.from_, subject, msg)
+                if rc != 0:
+                    self.writeout("mail error")
+                    return 1, "mail error"
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def check_idleconns(self):
+        if self.idleconnmins < 1:
+            return SUCCESS, ""
+
+        #############################################################
+        # get existing idle connections longer than specified minutes
+        #############################################################
+        # NOTE: filter condition based on IMO customization for "ggs", now driven by the idleconns excludeusers setting
+        users = [auser.strip() for auser in self.get_setting('idleconns', 'excludeusers').split(',') if auser.strip() != '']
+        if len(users) == 0:
+            userclause = ''
+        else:
+            userclause = "and usename not in (%s)" % ','.join("'%s'" % auser for auser in users)
+
+        '''
+        select 'pid=' || pid || '  db=' || coalesce(datname,'N/A') || '  user=' || coalesce(usename, 'N/A') || '  app=' || coalesce(application_name, 'N/A') || '  clientip=' || client_addr || '  state=idle' ||
+        '  backend_type=' || (case when backend_type = 'logical replication launcher' then 'logical rep launcher' when backend_type = 'autovacuum launcher' then 'autovac launcher' when backend_type = 'autovacuum worker' then 'autovac wrkr' else backend_type end) ||
+        '  backend_start=' || to_char(backend_start, 'YYYY-MM-DD HH24:MI:SS') ||
+        '  conn mins=' || cast(EXTRACT(EPOCH FROM (now() - backend_start)) / 60 as integer) ||
+        '  idle mins=' || cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) / 60 as idle_mins
+        FROM pg_stat_activity WHERE state in ('idle') and usename <> 'ggs' and cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) / 60 > 200 order by cast(EXTRACT(EPOCH FROM (now() - state_change)) as integer) desc;
+        '''
+
+        rc, results = self.run_query('idleconns.count', (userclause, self.idleconnmins))
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get count of idle connections."
+            return rc, errors
+        idle_conns = int(results)
+        self.record('idleconns.count', idle_conns)
+
+        if idle_conns == 0:
+            marker = MARK_OK
+            msg = "No \"idle connections\" longer than %d minutes were detected." % self.idleconnmins
+        else:
+            marker = MARK_WARN
+            msg = "%d \"idle connections\" longer than %d minutes were detected." % (idle_conns, self.idleconnmins)
+
+            rc, results2 = self.run_query('idleconns.details', (userclause, self.idleconnmins))
+            if rc != SUCCESS:
+                self.writeout("[ERROR] Unable to get idle connection.")
+            subject = '%d Idle connection(s) detected longer than %d minutes' % (idle_conns, self.idleconnmins)
+            if self.alert(IDLECONNS):
+                rc = self.send_alert(self.to, self.from_, subject, results2)
+                if rc != 0:
+                    self.writeout("mail error")
+                    return 1, "mail error"
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def check_pgversion(self):
+
+        # Dec. 19, 2023 don't know why I stopped here, so disregard this input parameter for now
+        #if not self.genchecks
+        #    return SUCCESS, ""
+
+        #####################################
+        # analyze pg major and minor versions
+        #####################################
+        if self.pgversionmajor < Decimal('11.0'):
+            marker = MARK_WARN
+            msg = "Unsupported major version detected: %.1f.  Please upgrade ASAP." % self.pgversionmajor
+            html = "<tr><td width=\"5%\"><font color=\"red\">&#10060;</font></td><td width=\"20%\"><font color=\"red\">PG Major Version Summary</font></td><td width=\"75%\"><font color=\"red\">" + msg + "</font></td></tr>"
+        elif self.pgversionmajor < Decimal('16.0'):
+            marker = MARK_WARN
+            msg = "Current PG major version (%s) is not the latest.  Consider upgrading to 16." % self.pgversionmajor
+            html = "<tr><td width=\"5%\"><font color=\"red\">&#10060;</font></td><td width=\"20%\"><font color=\"red\">PG Major Version Summary</font></td><td width=\"75%\"><font color=\"red\">" + msg + "</font></td></tr>"
+        else:
+            marker = MARK_OK
+            msg = "Current PG major version (%s) is the latest.  No major upgrade necessary." % self.pgversionmajor
+            html = "<tr><td width=\"5%\"><font color=\"blue\">&#10004;</font></td><td width=\"20%\"><font color=\"blue\">PG Major Version Summary</font></td><td width=\"75%\"><font color=\"blue\">" + msg + "</font></td></tr>"
+
+        self.emit(marker, msg)
+
+        # latest versions: 16.1, 15.5, 14.10, 13.13, 12.17, 11.22, 10.23, 9.6.24
+        #print("latest version: %s" % self.pgversionmajor)
+        if self.pgversionmajor > Decimal('9.5'):
+            if (self.clock() - self.dateprog).days > 120:
+                # probably a newer minor version is already out since these minor versions were last updated in the program
+                marker = MARK_WARN
+                msg = "Current version: %s.  Please upgrade to latest minor version." % self.pgversionminor
+            elif self.pgversionmajor == Decimal('9.6') and self.pgversionminor < '9.6.24':
+                marker = MARK_WARN
+                msg = "Current version: %s.  Please upgrade to last minor version, 9.6.24." % self.pgversionminor
+            elif self.pgversionmajor == Decimal('10.0') and self.pgversionminor < '10.23':
+                marker = MARK_WARN
+                msg = "Current version: %s.  Please upgrade to last minor version, 10.23." % self.pgversionminor
+            elif self.pgversionmajor == Decimal('11.0') and self.pgversionminor < '11.22':
+                marker = MARK_WARN
+                msg = "Current version: %s.  Please upgrade to latest minor version, 11.22." % self.pgversionminor
+            elif self.pgversionmajor == Decimal('12.0') and self.pgversionminor < '12.17':
+                marker = MARK_WARN
                 msg = "Current version: %s.  Please upgrade to latest minor version, 12.17." % self.pgversionminor
             elif self.pgversionmajor == Decimal('13.0') and self.pgversionminor < '13.13':
                 marker = MARK_WARN
@@ -1225,15 +2985,16 @@ class maint:
                 marker = MARK_OK
                 msg = "Current PG minor version is the latest (%s). No minor upgrade necessary." % self.pgversionminor
 
-            print (marker+msg)
+            self.emit(marker, msg)
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_cachehit(self):
         #####################
         # get cache hit ratio
         #####################
         # SELECT datname, blks_read, blks_hit, round((blks_hit::float/(blks_read+blks_hit+1)*100)::numeric, 2) as cachehitratio FROM pg_stat_database ORDER BY datname, cachehitratio
-        sql = "SELECT blks_read, blks_hit, round((blks_hit::float/(blks_read+blks_hit+1)*100)::numeric, 2) as cachehitratio FROM pg_stat_database where datname = '%s' ORDER BY datname, cachehitratio" % self.database
-        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
-        rc, results = self.executecmd(cmd, False)
+        rc, results = self.run_query('cachehit', self.database)
         if rc != SUCCESS:
             errors = "[ERROR] Unable to get database cache hit ratio."
             aline = "%s" % (errors)
@@ -1243,17 +3004,23 @@ class maint:
         blks_read   = int(cols[0].strip())
         blks_hit    = int(cols[1].strip())
         cache_ratio = Decimal(cols[2].strip())
-        if cache_ratio < Decimal('70.0'):
+        self.record('cachehit.ratio', cache_ratio)
+        self.record('cachehit.blks_read', blks_read)
+        self.record('cachehit.blks_hit', blks_hit)
+        if cache_ratio < self.get_setting('cachehit', 'low'):
             marker = MARK_WARN
             msg = "low cache hit ratio: %.2f (blocks hit vs blocks read)" % cache_ratio
-        elif cache_ratio < Decimal('90.0'):
+        elif cache_ratio < self.get_setting('cachehit', 'moderate'):
             marker = MARK_WARN
             msg = "Moderate cache hit ratio: %.2f (blocks hit vs blocks read)" % cache_ratio
         else:
             marker = MARK_OK
             msg = "High cache hit ratio: %.2f (blocks hit vs blocks read)" % cache_ratio
-        print (marker+msg)
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_preload(self):
         ##########################
         # shared_preload_libraries
         ##########################
@@ -1263,16 +3030,15 @@ class maint:
         else:
             marker = MARK_OK
             msg = "pg_stat_statements loaded"
-        print (marker+msg)
-
-
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_connections(self):
         ######################################################
         # get connection counts and compare to max connections
         ######################################################
-        sql = "select count(*) from pg_stat_activity"
-        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
-        rc, results = self.executecmd(cmd, False)
+        rc, results = self.run_query('connections')
         if rc != SUCCESS:
             errors = "[ERROR] Unable to get count of current connections."
             aline = "%s" % (errors)
@@ -1281,36 +3047,29 @@ class maint:
         conns = int(results)
         result = float(conns) / self.max_connections
         percentconns = int(math.floor(result * 100))
+        self.record('connections.count', conns)
+        self.record('connections.pct', percentconns)
         if self.verbose:
             print ("[****]  Max connections = %d   Current connections = %d   PctConnections = %d" % (self.max_connections, conns, percentconns))
 
-        if percentconns > 80:
-            # 80 percent is the hard coded threshold
+        maxpct = self.get_setting('connections', 'maxpct')
+        if percentconns > maxpct:
             marker = MARK_WARN
-            msg = "Current connections (%d) are greater than 80%% of max connections (%d) " % (conns, self.max_connections)
+            msg = "Current connections (%d) are greater than %d%% of max connections (%d) " % (conns, maxpct, self.max_connections)
             html = "<tr><td width=\"5%\"><font color=\"red\">&#10060;</font></td><td width=\"20%\"><font color=\"red\">Connections</font></td><td width=\"75%\"><font color=\"red\">" + msg + "</font></td></tr>"
         else:
             marker = MARK_OK
             msg = "Current connections (%d) are not too close to max connections (%d) " % (conns, self.max_connections)
             html = "<tr><td width=\"5%\"><font color=\"blue\">&#10004;</font></td><td width=\"20%\"><font color=\"blue\">Connections</font></td><td width=\"75%\"><font color=\"blue\">" + msg + "</font></td></tr>"
-        print (marker+msg)
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_conflicts(self):
         ###########################################################################################################################################
         # database conflicts: only applies to PG versions greater or equal to 9.1.  9.2 has additional fields of interest: deadlocks and temp_files
         ###########################################################################################################################################
-        if self.pgversionmajor < Decimal('9.1'):
-            msg = "No database conflicts found."
-            html = "<tr><td width=\"5%\"><font color=\"blue\">&#10004;</font></td><td width=\"20%\"><font color=\"blue\">Database Conflicts</font></td><td width=\"75%\"><font color=\"blue\">N/A</font></td></tr>"
-            return SUCCESS, ""
-            print (msg)
-            return SUCCESS, ""
-
-        if self.pgversionmajor < Decimal('9.2'):
-            sql="select datname, conflicts from pg_stat_database where datname = '%s'" % self.database
-        else:
-            sql="select datname, conflicts, deadlocks, temp_files, temp_bytes from pg_stat_database where datname = '%s'" % self.database
-        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
-        rc, results = self.executecmd(cmd, False)
+        rc, results = self.run_query('conflicts', self.database)
         if rc != SUCCESS:
             errors = "[ERROR] Unable to get database conflicts."
             aline = "%s" % (errors)
@@ -1327,6 +3086,11 @@ class maint:
             deadlocks  = int(cols[2].strip())
             temp_files = int(cols[3].strip())
             temp_bytes = int(cols[4].strip())
+        self.record('conflicts.conflicts', conflicts)
+        if deadlocks > -1:
+            self.record('conflicts.deadlocks', deadlocks)
+            self.record('conflicts.temp_files', temp_files)
+            self.record('conflicts.temp_bytes', temp_bytes)
 
         if conflicts > 0 or deadlocks > 0 or temp_files > 0:
             marker = MARK_WARN
@@ -1336,51 +3100,120 @@ class maint:
             marker = MARK_OK
             msg = "No database conflicts found."
             html = "<tr><td width=\"5%\"><font color=\"blue\">&#10004;</font></td><td width=\"20%\"><font color=\"blue\">Database Conflicts (deadlocks, Query disk spillover, Standby cancelled queries</font></td><td width=\"75%\"><font color=\"blue\">No database conflicts found.</font></td></tr>"
-        print (marker+msg)
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_checkpoints(self):
         ###############################################################################################################
         # Check for checkpoint frequency unless we are in rds mode
         # NOTE: Checkpoints should happen every few minutes, not less than 5 minutes and not more than 15-30 minutes
         #       unless recovery time is not a priority and High I/O SQL workload is in which case 1 hour is reasonable.
         ###############################################################################################################
-        if self.pg_type != 'rds':
-            # use stats_reset instead of postmaster start time for determining checkpoint interval
-            sql = "SELECT total_checkpoints, seconds_since_start / total_checkpoints / 60 AS minutes_between_checkpoints, checkpoints_timed, checkpoints_req, checkpoint_write_time, checkpoint_sync_time FROM (SELECT EXTRACT(EPOCH FROM (now() - stats_reset)) AS seconds_since_start, (checkpoints_timed+checkpoints_req) AS total_checkpoints, checkpoints_timed, checkpoints_req, checkpoint_write_time / 1000 as checkpoint_write_time, checkpoint_sync_time / 1000 as checkpoint_sync_time FROM pg_stat_bgwriter) AS sub"
-            cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
-            rc, results = self.executecmd(cmd, False)
-            if rc != SUCCESS:
-                errors = "[ERROR] Unable to get checkpoint frequency."
-                aline = "%s" % (errors)
-                self.writeout(aline)
-                return rc, errors
+        # Samples of the cumulative counters are kept in the state file for windowmins, and the current sample is compared
+        # to the oldest one so a load spike shows up instead of being averaged over the whole stats lifetime.
+        if self.pg_type == 'rds':
+            return SUCCESS, ""
 
-            cols = results.split('|')
-            total_checkpoints     = int(cols[0].strip())
-            minutes               = Decimal(cols[1].strip())
-            checkpoints_timed     = int(cols[2].strip())
-            checkpoints_req       = int(cols[3].strip())
-            checkpoint_write_time = int(float(cols[4].strip()))
-            checkpoint_sync_time  = int(float(cols[5].strip()))        \
-            # calculate average checkpoint time
-            avg_checkpoint_seconds = ((checkpoint_write_time + checkpoint_sync_time) / (checkpoints_timed + checkpoints_req))
-
-            if minutes < Decimal('5.0'):
+        rc, results = self.run_query('checkpoints')
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get checkpoint frequency."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+
+        cols = results.split('|')
+        # sample is [server time, timed, requested, write ms, sync ms, buffers, stats reset, wal bytes, fpi, wal records]
+        sample     = [int(Decimal(acol)) for acol in cols[0:10]]
+        maxwalsize = int(cols[10])
+        timeout    = int(cols[11])
+        target     = float(cols[12])
+        now        = sample[0]
+
+        samples = [asample for asample in self.state.get('checkpoints', {}).get('samples', [])
+                   if asample[6] == sample[6] and asample[7] <= sample[7] and now - asample[0] <= self.get_setting('checkpoints', 'windowmins') * 60 and asample[0] < now]
+        samples.append(sample)
+        self.state['checkpoints'] = {'samples': samples}
+        first = samples[0]
+        secs  = now - first[0]
+
+        if secs <= 0:
+            # no earlier sample in the window (first run or stats reset): fall back to the averages since stats_reset
+            total   = sample[1] + sample[2]
+            minutes = Decimal((now - sample[6]) / 60.0 / total) if total > 0 and sample[6] > 0 else Decimal(0)
+            avgsecs = (sample[3] + sample[4]) / 1000.0 / total if total > 0 else 0
+            self.record('checkpoints.minutes', minutes)
+            self.record('checkpoints.avgsecs', avgsecs)
+            self.record('checkpoints.timed', sample[1])
+            self.record('checkpoints.req', sample[2])
+            if minutes < self.get_setting('checkpoints', 'minmins'):
                 marker = MARK_WARN
-                msg = "Checkpoints are occurring too fast, every %.2f minutes, and taking about %d minutes on average." % (minutes, (avg_checkpoint_seconds / 60))
-            elif minutes > Decimal('60.0'):
+                msg = "Checkpoints are occurring too fast, every %.2f minutes, and taking about %d minutes on average." % (minutes, (avgsecs / 60))
+            elif minutes > self.get_setting('checkpoints', 'maxmins'):
                 marker = MARK_WARN
-                msg = "Checkpoints are occurring too infrequently, every %.2f minutes, and taking about %d minutes on average." % (minutes, (avg_checkpoint_seconds / 60))
+                msg = "Checkpoints are occurring too infrequently, every %.2f minutes, and taking about %d minutes on average." % (minutes, (avgsecs / 60))
             else:
                 marker = MARK_OK
-                msg = "Checkpoints are occurring every %.2f minutes, and taking about %d minutes on average." % (minutes, (avg_checkpoint_seconds / 60))
-            print (marker+msg)
+                msg = "Checkpoints are occurring every %.2f minutes, and taking about %d minutes on average." % (minutes, (avgsecs / 60))
+            msg += "  (since stats reset, per interval statistics from the next run)"
+            self.emit(marker, msg)
+            return SUCCESS, ""
+
+        delta     = [sample[i] - first[i] for i in range(10)]
+        count     = delta[1] + delta[2]
+        mins      = secs / 60.0
+        walpermin = delta[7] / mins
+        self.record('checkpoints.timed', delta[1])
+        self.record('checkpoints.req', delta[2])
+        self.record('checkpoints.wal_mb_per_min', walpermin / 1048576)
+
+        problems = []
+        detail   = "%.1f minutes: checkpoints=%d (timed=%d requested=%d)  WAL=%s/min" % (mins, count, delta[1], delta[2], self.convert_bytes_to_humanfriendly(walpermin))
+        if sample[8] > -1 and delta[9] > 0:
+            fpipct = delta[8] * 100.0 / delta[9]
+            self.record('checkpoints.fpi_pct', fpipct)
+            detail += "  full page images=%.1f%% of WAL records" % fpipct
+        if count > 0:
+            minutes = Decimal(mins / count)
+            reqpct  = delta[2] * 100.0 / count
+            self.record('checkpoints.minutes', minutes)
+            self.record('checkpoints.req_pct', reqpct)
+            self.record('checkpoints.avgsecs', (delta[3] + delta[4]) / 1000.0 / count)
+            detail += "  every %.2f minutes, write=%.1fs sync=%.1fs per checkpoint" % (minutes, delta[3] / 1000.0 / count, delta[4] / 1000.0 / count)
+            if minutes < self.get_setting('checkpoints', 'minmins'):
+                problems.append("Checkpoints are occurring too fast, every %.2f minutes." % minutes)
+            if reqpct > self.get_setting('checkpoints', 'reqpct'):
+                problems.append("%.0f%% of checkpoints were requested (WAL volume or explicit CHECKPOINT) rather than timed." % reqpct)
+        elif mins > self.get_setting('checkpoints', 'maxmins'):
+            problems.append("No checkpoint in the last %.1f minutes." % mins)
+
+        # a checkpoint is requested once the WAL since the last one reaches max_wal_size / (1 + checkpoint_completion_target),
+        # so timed checkpoints at the measured WAL rate need at least that much, plus headroom for spikes
+        if walpermin > 0 and timeout > 0:
+            recommended = walpermin * timeout / 60 * (1 + target) * self.get_setting('checkpoints', 'headroom')
+            recommended = int(math.ceil(recommended / 1073741824.0)) * 1073741824 if recommended > 1073741824 else int(math.ceil(recommended / 67108864.0)) * 67108864
+            self.record('checkpoints.recommended_max_wal_size', recommended)
+            if recommended > maxwalsize:
+                problems.append("max_wal_size (%s) is too small for the WAL rate of %s/min.  Consider max_wal_size = %s so checkpoints happen every checkpoint_timeout (%d seconds)." \
+                                % (self.convert_bytes_to_humanfriendly(maxwalsize), self.convert_bytes_to_humanfriendly(walpermin), self.convert_bytes_to_humanfriendly(recommended), timeout))
+
+        if len(problems) == 0:
+            marker = MARK_OK
+            msg = "No checkpoint or WAL pressure over the last " + detail
+        else:
+            marker = MARK_WARN
+            msg = "Checkpoint/WAL pressure over the last " + detail
+            for problem in problems:
+                msg += "\n        " + problem
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_settings(self):
         ####################################
         # Check some postgresql config parms
         ####################################
-        sql = "with summary as (select name, setting from pg_settings where name in ('autovacuum', 'checkpoint_completion_target', 'data_checksums', 'idle_in_transaction_session_timeout', 'log_checkpoints', 'log_lock_waits',  'log_min_duration_statement', 'log_temp_files', 'shared_preload_libraries', 'track_activity_query_size') order by 1 ) select setting from summary order by name"
-        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
-        rc, results = self.executecmd(cmd, False)
+        rc, results = self.run_query('settings')
         if rc != SUCCESS:
             errors = "[ERROR] Unable to get configuration parameters."
             aline = "%s" % (errors)
@@ -1408,7 +3241,7 @@ class maint:
         if autovacuum != 'on':
             marker = MARK_WARN
             msg = "autovacuum is off.  "
-        if checkpoint_completion_target <= 0.6:
+        if checkpoint_completion_target <= self.get_setting('settings', 'completiontarget'):
             marker = MARK_WARN
             msg+= "checkpoint_completion_target is less than optimal.  "
         if data_checksums != 'on':
@@ -1432,7 +3265,7 @@ class maint:
         if 'pg_stat_statements' not in shared_preload_libraries:
             marker = MARK_WARN
             msg+= "pg_stat_statements extension is not loaded.  "
-        if track_activity_query_size < 8192:
+        if track_activity_query_size < self.get_setting('settings', 'querysize'):
             marker = MARK_WARN
             msg+= "track_activity_query_size may need to be increased or log queries may be truncated.  "
 
@@ -1442,16 +3275,16 @@ class maint:
             marker = MARK_OK
             msg = "No configuration problems detected."
 
-        print (marker+msg)
-
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_bgwriter(self):
         ############################################################
         # Check checkpoints, background writers, and backend writers
         ############################################################
         # v2.1 fix: divident could be zero and cause division by zero error, so check first.
-        sql = "select buffers_checkpoint + buffers_checkpoint + buffers_clean + buffers_backend as buffers from pg_stat_bgwriter"
-        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
-        rc, results = self.executecmd(cmd, False)
+        rc, results = self.run_query('bgwriter.buffers')
         if rc != SUCCESS:
             errors = "[ERROR] Unable to get background/backend buffers count."
             aline = "%s" % (errors)
@@ -1462,231 +3295,1024 @@ class maint:
             marker = MARK_WARN
             msg = "No buffers to check for checkpoint, background, or backend writers."
             html = "<tr><td width=\"5%\"><font color=\"red\">&#10004;</font></td><td width=\"20%\"><font color=\"red\">Checkpoint/Background/Backend Writers</font></td><td width=\"75%\"><font color=\"red\">" + msg + "</font></td></tr>"
-            print (marker+msg)
-        else:
-            sql = "select checkpoints_timed, checkpoints_req, buffers_checkpoint, buffers_clean, maxwritten_clean, buffers_backend, buffers_backend_fsync, buffers_alloc, checkpoint_write_time / 1000 as checkpoint_write_time, checkpoint_sync_time / 1000 as checkpoint_sync_time, (100 * checkpoints_req) / (checkpoints_timed + checkpoints_req) AS checkpoints_req_pct,    pg_size_pretty(buffers_checkpoint * block_size / (checkpoints_timed + checkpoints_req)) AS avg_checkpoint_write,  pg_size_pretty(block_size * (buffers_checkpoint + buffers_clean + buffers_backend)) AS total_written,  100 * buffers_checkpoint / (buffers_checkpoint + buffers_clean + buffers_backend) AS checkpoint_write_pct,    100 * buffers_clean / (buffers_checkpoint + buffers_clean + buffers_backend) AS background_write_pct, 100 * buffers_backend / (buffers_checkpoint + buffers_clean + buffers_backend) AS backend_write_pct from pg_stat_bgwriter, (SELECT cast(current_setting('block_size') AS integer) AS block_size) bs"
+            self.emit(marker, msg)
+            return SUCCESS, ""
 
-            cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
-            rc, results = self.executecmd(cmd, False)
-            if rc != SUCCESS:
-                errors = "[ERROR] Unable to get background/backend writers."
-                aline = "%s" % (errors)
-                self.writeout(aline)
-                return rc, errors
-            cols = results.split('|')
-            checkpoints_timed     = int(cols[0].strip())
-            checkpoints_req       = int(cols[1].strip())
-            buffers_checkpoint    = int(cols[2].strip())
-            buffers_clean         = int(cols[3].strip())
-            maxwritten_clean      = int(cols[4].strip())
-            buffers_backend       = int(cols[5].strip())
-            buffers_backend_fsync = int(cols[6].strip())
-            buffers_alloc         = int(cols[7].strip())
-            checkpoint_write_time = int(float(cols[8].strip()))
-            checkpoint_sync_time  = int(float(cols[9].strip()))
-            checkpoints_req_pct   = int(cols[10].strip())
-            avg_checkpoint_write  = cols[11].strip()
-            total_written         = cols[12].strip()
-            checkpoint_write_pct  = int(cols[13].strip())
-            background_write_pct  = int(cols[14].strip())
-            backend_write_pct     = int(cols[15].strip())
-
-            # calculate average checkpoint time
-            avg_checkpoint_seconds = ((checkpoint_write_time + checkpoint_sync_time) / (checkpoints_timed + checkpoints_req))
 
-            if self.debug:
-                msg = "[****]  chkpt_time=%d chkpt_req=%d  buff_chkpt=%d  buff_clean=%d  maxwritten_clean=%d  buff_backend=%d  buff_backend_fsync=%d  buff_alloc=%d, chkpt_req_pct=%d avg_chkpnt_write=%s total_written=%s chkpnt_write_pct=%d background_write_pct=%d  backend_write_pct=%d avg_checkpoint_time=%d seconds" \
-                % (checkpoints_timed, checkpoints_req, buffers_checkpoint, buffers_clean, maxwritten_clean, buffers_backend, buffers_backend_fsync, buffers_alloc, checkpoints_req_pct, avg_checkpoint_write, total_written, checkpoint_write_pct, background_write_pct, backend_write_pct, avg_checkpoint_seconds)
-                print (msg)
+        rc, results = self.run_query('bgwriter')
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get background/backend writers."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+        cols = results.split('|')
+        checkpoints_timed     = int(cols[0].strip())
+        checkpoints_req       = int(cols[1].strip())
+        buffers_checkpoint    = int(cols[2].strip())
+        buffers_clean         = int(cols[3].strip())
+        maxwritten_clean      = int(cols[4].strip())
+        buffers_backend       = int(cols[5].strip())
+        buffers_backend_fsync = int(cols[6].strip())
+        buffers_alloc         = int(cols[7].strip())
+        checkpoint_write_time = int(float(cols[8].strip()))
+        checkpoint_sync_time  = int(float(cols[9].strip()))
+        checkpoints_req_pct   = int(cols[10].strip())
+        avg_checkpoint_write  = cols[11].strip()
+        total_written         = cols[12].strip()
+        checkpoint_write_pct  = int(cols[13].strip())
+        background_write_pct  = int(cols[14].strip())
+        backend_write_pct     = int(cols[15].strip())
+        self.record('bgwriter.maxwritten_clean', maxwritten_clean)
+        self.record('bgwriter.buffers_backend_fsync', buffers_backend_fsync)
+        self.record('bgwriter.checkpoint_write_pct', checkpoint_write_pct)
+        self.record('bgwriter.background_write_pct', background_write_pct)
+        self.record('bgwriter.backend_write_pct', backend_write_pct)
+
+        # calculate average checkpoint time
+        avg_checkpoint_seconds = ((checkpoint_write_time + checkpoint_sync_time) / (checkpoints_timed + checkpoints_req))
+
+        if self.debug:
+            msg = "[****]  chkpt_time=%d chkpt_req=%d  buff_chkpt=%d  buff_clean=%d  maxwritten_clean=%d  buff_backend=%d  buff_backend_fsync=%d  buff_alloc=%d, chkpt_req_pct=%d avg_chkpnt_write=%s total_written=%s chkpnt_write_pct=%d background_write_pct=%d  backend_write_pct=%d avg_checkpoint_time=%d seconds" \
+            % (checkpoints_timed, checkpoints_req, buffers_checkpoint, buffers_clean, maxwritten_clean, buffers_backend, buffers_backend_fsync, buffers_alloc, checkpoints_req_pct, avg_checkpoint_write, total_written, checkpoint_write_pct, background_write_pct, backend_write_pct, avg_checkpoint_seconds)
+            print (msg)
+
+        msg = ''
+        marker = MARK_OK
+        if buffers_backend_fsync > 0:
+            marker = MARK_WARN
+            msg = "bgwriter fsync request queue is full. Backend using fsync.  "
+        if backend_write_pct > (checkpoint_write_pct + background_write_pct):
+            marker = MARK_WARN
+            msg += "backend writer doing most of the work.  Consider decreasing \"bgwriter_delay\" by 50% or more to make background writer do more of the work.  "
+        if maxwritten_clean > self.get_setting('bgwriter', 'maxwritten_clean'):
+            # for now just use a configurable value defaulting to 500K til we understand the math about this better
+            marker = MARK_WARN
+            msg += "background writer stopped cleaning scan %d times because it had written too many buffers.  Consider increasing \"bgwriter_lru_maxpages\".  " % maxwritten_clean
+        if checkpoints_req > checkpoints_timed:
+            marker = MARK_WARN
+            msg += "\"checkpoints requested\" contributing to a lot more checkpoints (%d) than \"checkpoint timeout\" (%d).  Consider increasing \"checkpoint_segments or max_wal_size\".  " % (checkpoints_req, checkpoints_timed)
+        if buffers_backend_fsync > 0:
+            marker = MARK_WARN
+            msg += "storage problem since fsync queue is completely filled. buffers_backend_fsync = %d." % (buffers_backend_fsync)
+        if buffers_clean > buffers_backend:
+            marker = MARK_WARN
+            msg += "backends doing most of the cleaning. Consider increasing bgwriter_lru_multiplier and decreasing bgwriter_delay.  It could also be a problem with shared_buffers not being big enough."
+
+        if marker == MARK_OK:
+            msg = "No problems detected with checkpoint, background, or backend writers."
+
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def check_io(self):
+        # pg_stat_io counters are cumulative, so report the deltas since the last run by backend type and context
+        sql = "select backend_type, context, sum(coalesce(reads, 0)), sum(coalesce(writes, 0)), sum(coalesce(extends, 0)), sum(coalesce(fsyncs, 0)), " \
+              "sum(coalesce(evictions, 0)), sum(coalesce(hits, 0)), round(sum(coalesce(read_time, 0) + coalesce(write_time, 0) + coalesce(extend_time, 0) + coalesce(fsync_time, 0))), " \
+              "coalesce(max(cast(extract(epoch from stats_reset) as bigint)), 0) from pg_stat_io group by 1, 2"
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
+        rc, results = self.executecmd(cmd, False)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get I/O statistics."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+
+        # sample is [reads, writes, extends, fsyncs, evictions, hits, io time ms, stats reset]
+        now     = int(self.now())
+        prev    = self.state.get('io', {})
+        samples = {}
+        for aline in results.split('\n'):
+            if aline.strip() == '':
+                continue
+            cols = aline.split('|')
+            samples[cols[0] + '/' + cols[1]] = [int(Decimal(col)) for col in cols[2:10]]
+        self.state['io'] = {'ts': now, 'rows': samples}
 
-            msg = ''
+        if 'ts' not in prev or now <= prev['ts']:
             marker = MARK_OK
-            if buffers_backend_fsync > 0:
-                marker = MARK_WARN
-                msg = "bgwriter fsync request queue is full. Backend using fsync.  "
-            if backend_write_pct > (checkpoint_write_pct + background_write_pct):
-                marker = MARK_WARN
-                msg += "backend writer doing most of the work.  Consider decreasing \"bgwriter_delay\" by 50% or more to make background writer do more of the work.  "
-            if maxwritten_clean > 500000:
-                # for now just use a hard coded value of 500K til we understand the math about this better
-                marker = MARK_WARN
-                msg += "background writer stopped cleaning scan %d times because it had written too many buffers.  Consider increasing \"bgwriter_lru_maxpages\".  " % maxwritten_clean
-            if checkpoints_req > checkpoints_timed:
-                marker = MARK_WARN
-                msg += "\"checkpoints requested\" contributing to a lot more checkpoints (%d) than \"checkpoint timeout\" (%d).  Consider increasing \"checkpoint_segments or max_wal_size\".  " % (checkpoints_req, checkpoints_timed)
-            if buffers_backend_fsync > 0:
-                marker = MARK_WARN
-                msg += "storage problem since fsync queue is completely filled. buffers_backend_fsync = %d." % (buffers_backend_fsync)
-            if buffers_clean > buffers_backend:
-                marker = MARK_WARN
-                msg += "backends doing most of the cleaning. Consider increasing bgwriter_lru_multiplier and decreasing bgwriter_delay.  It could also be a problem with shared_buffers not being big enough."
+            msg = "I/O statistics baseline collected for %d backend types/contexts.  Deltas are reported from the next run." % len(samples)
+            self.emit(marker, msg)
+            return SUCCESS, ""
 
-            if marker == MARK_OK:
-                msg = "No problems detected with checkpoint, background, or backend writers."
+        minutes = (now - prev['ts']) / 60
+        deltas  = {}
+        for key, sample in samples.items():
+            last = prev['rows'].get(key)
+            if last is None or last[7] != sample[7] or sample[0] < last[0]:
+                # counters were reset since the last run
+                last = [0] * 8
+            delta = [sample[i] - last[i] for i in range(7)]
+            if sum(delta) > 0:
+                deltas[key] = delta
+
+        totwrites  = sum(delta[1] for delta in deltas.values())
+        backwrites = sum(delta[1] for key, delta in deltas.items() if key.startswith('client backend/'))
+        backfsyncs = sum(delta[3] for key, delta in deltas.items() if key.startswith('client backend/'))
+        totreads   = sum(delta[0] for delta in deltas.values())
+        tothits    = sum(delta[5] for delta in deltas.values())
+        backwritepct = int(backwrites * 100 / totwrites) if totwrites > 0 else 0
+        self.record('io.reads_per_min', totreads / minutes)
+        self.record('io.writes_per_min', totwrites / minutes)
+        self.record('io.backend_write_pct', backwritepct)
+        self.record('io.backend_fsyncs', backfsyncs)
+        self.record('io.evictions_per_min', sum(delta[4] for delta in deltas.values()) / minutes)
+        if totreads + tothits > 0:
+            self.record('io.hit_pct', tothits * 100 / (totreads + tothits))
+
+        problems = []
+        if backwritepct > self.get_setting('io', 'backendwritepct'):
+            problems.append("client backends did %d%% of buffer writes.  Consider tuning the background writer (bgwriter_lru_maxpages, bgwriter_lru_multiplier) or shared_buffers." % backwritepct)
+        if backfsyncs > 0:
+            problems.append("client backends did %d fsyncs themselves, the checkpointer fsync request queue is likely full." % backfsyncs)
+
+        detail = ''
+        for key, delta in sorted(deltas.items(), key=lambda x: -(x[1][0] + x[1][1] + x[1][2] + x[1][4]))[:self.get_setting('io', 'top')]:
+            detail += "\n        %-40s reads=%d writes=%d extends=%d fsyncs=%d evictions=%d hits=%d time=%dms" % (key, delta[0], delta[1], delta[2], delta[3], delta[4], delta[5], delta[6])
+
+        if len(problems) == 0:
+            marker = MARK_OK
+            msg = "I/O over the last %.1f minutes: reads=%d writes=%d, client backends did %d%% of writes." % (minutes, totreads, totwrites, backwritepct) + detail
+        else:
+            marker = MARK_WARN
+            msg = "I/O problems over the last %.1f minutes: " % minutes + "\n        ".join(problems) + detail
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
-            print (marker+msg)
+    ###########################################################
+    def check_buffercache(self):
+        # optional, needs the pg_buffercache extension.  Every Nth buffer is looked at so no more than sample buffers
+        # are joined to pg_class no matter how big shared_buffers is, and counts are scaled back up.
+        sql = "select count(*) from pg_extension where extname = 'pg_buffercache'"
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
+        rc, results = self.executecmd(cmd, False)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to check for pg_buffercache extension."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+        if int(results) == 0:
+            marker = MARK_SKIP
+            msg = "pg_buffercache extension is not installed in this database.  Shared buffers usage by relation not checked."
+            self.emit(marker, msg)
+            return SUCCESS, ""
+
+        nbuffers = max(int(self.shared_buffers * 128), 1)
+        step     = max(int(nbuffers / self.get_setting('buffercache', 'sample')), 1)
+        sql = "select n.nspname || '.' || c.relname, c.relkind, count(*) * %d, sum(case when b.isdirty then 1 else 0 end) * %d, round(avg(b.usagecount), 1) " \
+              "from pg_buffercache b join pg_class c on b.relfilenode = pg_relation_filenode(c.oid) " \
+              "and b.reldatabase in (0, (select oid from pg_database where datname = current_database())) join pg_namespace n on n.oid = c.relnamespace " \
+              "where b.bufferid %% %d = 0 group by 1, 2 order by 3 desc limit %d" % (step, step, step, self.get_setting('buffercache', 'top'))
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
+        rc, results = self.executecmd(cmd, False)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to sample pg_buffercache."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
 
+        marker = MARK_OK
+        msg = "Top relations in shared_buffers (%s, every %d buffer(s) sampled):" % (self.convert_bytes_to_humanfriendly(nbuffers * 8192), step)
+        for aline in results.split('\n'):
+            if aline.strip() == '':
+                continue
+            cols = aline.split('|')
+            buffers = int(cols[2])
+            msg += "\n        %-50s %s %5.1f%% of shared_buffers  dirty=%d  avg usagecount=%s" % (cols[0] + ' (' + cols[1] + ')', self.convert_bytes_to_humanfriendly(buffers * 8192).rjust(8),
+                                                                                                    buffers * 100 / nbuffers, int(cols[3]), cols[4])
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_largeobjects(self):
         ########################
         # orphaned large objects
         ########################
-
-        if self.in_recovery:
-            #NOTE: cannot run this against slaves since vacuumlo will attempt to create temp table
-            numobjects = "-1"
-        else:
-            # v1.2 fix: always use provided port number
-            if self.dbuser == '':
-                user_clause = "-p %s" % (self.dbport)
-            elif self.dbhost == '':
-                user_clause = " %s -U %s -p %s" % (self.dbuser, self.dbport)
+        # Same idea as vacuumlo -n, but read only so it also runs on standbys: count large objects not referenced by any
+        # oid or lo typed column with one anti-join (hash anti-joins spill to disk past work_mem, so memory stays bounded).
+        # The column list is cached in the state file for cachesecs, and rebuilt once when the query fails with it.  With samplepct set, a pg_largeobject_metadata of
+        # more than samplemin rows is sampled and the orphan count is an estimate.
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, "select exists (select 1 from pg_largeobject_metadata), (select reltuples::bigint from pg_class where oid = 'pg_largeobject_metadata'::regclass)")
+        rc, results = self.executecmd(cmd, False)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get large object count."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+        cols = results.split('|')
+        if cols[0] != 't':
+            self.record('largeobjects.orphans', 0)
+            marker = MARK_OK
+            msg = "No orphaned large objects were found."
+            self.emit(marker, msg)
+            return SUCCESS, ""
+        lorows = max(int(cols[1]), 0)
+
+        now    = int(self.now())
+        cached = self.state.get('largeobjects', {})
+        fresh  = 'columns' not in cached or now - cached.get('ts', 0) >= self.get_setting('largeobjects', 'cachesecs')
+        samplepct = self.get_setting('largeobjects', 'samplepct')
+        sample = ''
+        if samplepct > 0 and samplepct < 100 and lorows > self.get_setting('largeobjects', 'samplemin') and self.pgversionmajor >= Decimal('9.5'):
+            sample = " TABLESAMPLE SYSTEM (%s)" % samplepct
+        while True:
+            if fresh:
+                sql = "select quote_ident(n.nspname) || '.' || quote_ident(c.relname), quote_ident(a.attname) from pg_class c join pg_namespace n on n.oid = c.relnamespace " \
+                      "join pg_attribute a on a.attrelid = c.oid join pg_type t on t.oid = a.atttypid " \
+                      "where c.relkind in ('r', 'm') and a.attnum > 0 and not a.attisdropped and n.nspname not in ('pg_catalog', 'information_schema') and n.nspname !~ '^pg_toast' " \
+                      "and (t.typname in ('oid', 'lo') or t.typbasetype = 'oid'::regtype) order by 1, 2"
+                cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
+                rc, results = self.executecmd(cmd, False)
+                if rc != SUCCESS:
+                    errors = "[ERROR] Unable to get large object reference columns."
+                    aline = "%s" % (errors)
+                    self.writeout(aline)
+                    return rc, errors
+                columns = [aline.split('|') for aline in results.split('\n') if aline.strip() != '']
+                self.state['largeobjects'] = {'ts': now, 'columns': columns}
             else:
-                user_clause = " -h %s -U %s -p %s" % (self.dbhost, self.dbuser, self.dbport)
-
-            cmd = "%s/vacuumlo -n %s %s" % (self.pgbindir, user_clause, self.database)
+                columns = cached['columns']
+
+            sql = "select count(*) from pg_largeobject_metadata m%s" % sample
+            for tablename, colname in columns:
+                sql += "\n%s not exists (select 1 from %s r where r.%s = m.oid)" % ('and' if 'where' in sql else 'where', tablename, colname)
+            # identifiers may be double quoted, so the query goes through a file rather than the shell
+            try:
+                with open(self.workfile, 'w') as f:
+                    f.write(sql + ";\n")
+            except OSError as e:
+                errors = "[ERROR] Unable to write large object query: %s" % e
+                self.writeout(errors)
+                return ERROR, errors
+            # without ON_ERROR_STOP psql -f exits 0 when the query fails, and anything on stderr comes back in place of the count
+            cmd = "psql %s -At -q -X -v ON_ERROR_STOP=1 -f %s" % (self.connstring, self.workfile)
             rc, results = self.executecmd(cmd, False)
-            if rc != SUCCESS:
-                errors = "Unable to get orphaned large objects: %d %s\ncmd=%s\n" % (rc, results, cmd)
-                aline = "%s" % (errors)
-                self.writeout(aline)
-                return rc, errors
-
-            # expecting substring like this --> "Would remove 35 large objects from database "agmednet.core.image"."
-            numobjects = (results.split("Would remove"))[1].split("large objects")[0]
+            if rc == SUCCESS and not results.isdigit():
+                rc = ERROR
+            if rc == SUCCESS or fresh:
+                break
+            # a cached reference column may have been dropped or renamed since: rebuild the list once and try again
+            if self.verbose:
+                print ("[****]  large object query failed with cached reference columns, rebuilding them: %s" % results.strip())
+            del self.state['largeobjects']
+            fresh = True
+        if rc != SUCCESS:
+            errors = "Unable to get orphaned large objects: %d %s\nsql=%s\n" % (rc, results, sql)
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
 
-        if int(numobjects) == -1:
-            marker = MARK_OK
-            msg = "N/A: Unable to detect orphaned large objects on slaves."
-        elif int(numobjects) == 0:
+        numobjects = int(results)
+        estimate = ''
+        if sample != '':
+            numobjects = int(numobjects * 100 / samplepct)
+            estimate = "About "
+        self.record('largeobjects.orphans', numobjects)
+        if numobjects == 0:
             marker = MARK_OK
             msg = "No orphaned large objects were found."
         else:
             marker = MARK_WARN
-            msg = "%d orphaned large objects were found.  Consider running vacuumlo to remove them." % int(numobjects)
+            msg = "%s%d orphaned large objects were found (%d reference columns checked).  Consider running vacuumlo to remove them." % (estimate, numobjects, len(columns))
 
-        print (marker+msg)
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_bloat(self):
         ##################################
         # Check for bloated tables/indexes
         ##################################
-        sql = "SELECT count(*) FROM (SELECT  schemaname, tablename, cc.reltuples, cc.relpages, bs,  CEIL((cc.reltuples*((datahdr+ma- (CASE WHEN datahdr%ma=0 THEN ma ELSE datahdr%ma END))+nullhdr2+4))/(bs-20::FLOAT)) AS otta,  COALESCE(c2.relname,'?') AS iname, COALESCE(c2.reltuples,0) AS ituples, COALESCE(c2.relpages,0) AS ipages, COALESCE(CEIL((c2.reltuples*(datahdr-12))/(bs-20::FLOAT)),0) AS iotta FROM ( SELECT   ma,bs,schemaname,tablename,   (datawidth+(hdr+ma-(CASE WHEN hdr%ma=0 THEN ma ELSE hdr%ma END)))::NUMERIC AS datahdr,   (maxfracsum*(nullhdr+ma-(CASE WHEN nullhdr%ma=0 THEN ma ELSE nullhdr%ma END))) AS nullhdr2 FROM ( SELECT schemaname, tablename, hdr, ma, bs, SUM((1-null_frac)*avg_width) AS datawidth, MAX(null_frac) AS maxfracsum,  hdr+( SELECT 1+COUNT(*)/8 FROM pg_stats s2 WHERE null_frac<>0 AND s2.schemaname = s.schemaname AND s2.tablename = s.tablename ) AS nullhdr FROM pg_stats s, ( SELECT (SELECT current_setting('block_size')::NUMERIC) AS bs, CASE WHEN SUBSTRING(v,12,3) IN ('8.0','8.1','8.2') THEN 27 ELSE 23 END AS hdr, CASE WHEN v ~ 'mingw32' THEN 8 ELSE 4 END AS ma FROM (SELECT version() AS v) AS foo ) AS constants  GROUP BY 1,2,3,4,5 ) AS foo) AS rs  JOIN pg_class cc ON cc.relname = rs.tablename  JOIN pg_namespace nn ON cc.relnamespace = nn.oid AND nn.nspname = rs.schemaname AND nn.nspname <> 'information_schema' LEFT JOIN pg_index i ON indrelid = cc.oid LEFT JOIN pg_class c2 ON c2.oid = i.indexrelid ) AS sml where ROUND((CASE WHEN otta=0 THEN 0.0 ELSE sml.relpages::FLOAT/otta END)::NUMERIC,1) > 20 OR ROUND((CASE WHEN iotta=0 OR ipages=0 THEN 0.0 ELSE ipages::FLOAT/iotta END)::NUMERIC,1) > 20 or CASE WHEN relpages < otta THEN 0 ELSE bs*(sml.relpages-otta)::BIGINT END > 10737418240 OR CASE WHEN ipages < iotta THEN 0 ELSE bs*(ipages-iotta) END > 10737418240"
+        ratio       = self.get_setting('bloat', 'ratio')
+        wastedbytes = self.get_setting('bloat', 'wastedbytes')
+        sql = "SELECT count(*) FROM (SELECT  schemaname, tablename, cc.reltuples, cc.relpages, bs,  CEIL((cc.reltuples*((datahdr+ma- (CASE WHEN datahdr%ma=0 THEN ma ELSE datahdr%ma END))+nullhdr2+4))/(bs-20::FLOAT)) AS otta,  COALESCE(c2.relname,'?') AS iname, COALESCE(c2.reltuples,0) AS ituples, COALESCE(c2.relpages,0) AS ipages, COALESCE(CEIL((c2.reltuples*(datahdr-12))/(bs-20::FLOAT)),0) AS iotta FROM ( SELECT   ma,bs,schemaname,tablename,   (datawidth+(hdr+ma-(CASE WHEN hdr%ma=0 THEN ma ELSE hdr%ma END)))::NUMERIC AS datahdr,   (maxfracsum*(nullhdr+ma-(CASE WHEN nullhdr%ma=0 THEN ma ELSE nullhdr%ma END))) AS nullhdr2 FROM ( SELECT schemaname, tablename, hdr, ma, bs, SUM((1-null_frac)*avg_width) AS datawidth, MAX(null_frac) AS maxfracsum,  hdr+( SELECT 1+COUNT(*)/8 FROM pg_stats s2 WHERE null_frac<>0 AND s2.schemaname = s.schemaname AND s2.tablename = s.tablename ) AS nullhdr FROM pg_stats s, ( SELECT (SELECT current_setting('block_size')::NUMERIC) AS bs, CASE WHEN SUBSTRING(v,12,3) IN ('8.0','8.1','8.2') THEN 27 ELSE 23 END AS hdr, CASE WHEN v ~ 'mingw32' THEN 8 ELSE 4 END AS ma FROM (SELECT version() AS v) AS foo ) AS constants  GROUP BY 1,2,3,4,5 ) AS foo) AS rs  JOIN pg_class cc ON cc.relname = rs.tablename  JOIN pg_namespace nn ON cc.relnamespace = nn.oid AND nn.nspname = rs.schemaname AND nn.nspname <> 'information_schema' LEFT JOIN pg_index i ON indrelid = cc.oid LEFT JOIN pg_class c2 ON c2.oid = i.indexrelid ) AS sml " + \
+              ("where ROUND((CASE WHEN otta=0 THEN 0.0 ELSE sml.relpages::FLOAT/otta END)::NUMERIC,1) > %d OR ROUND((CASE WHEN iotta=0 OR ipages=0 THEN 0.0 ELSE ipages::FLOAT/iotta END)::NUMERIC,1) > %d or CASE WHEN relpages < otta THEN 0 ELSE bs*(sml.relpages-otta)::BIGINT END > %d OR CASE WHEN ipages < iotta THEN 0 ELSE bs*(ipages-iotta) END > %d" % (ratio, ratio, wastedbytes, wastedbytes))
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
+        rc, results = self.executecmd(cmd, False)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get table/index bloat count."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+        self.record('bloat.count', int(results))
+
+        if int(results) == 0:
+            marker = MARK_OK
+            self.bloatedtables = False
+            msg = "No bloated tables/indexes were found."
+        else:
+            marker = MARK_WARN
+            self.bloatedtables = True
+            msg = "%d bloated tables/indexes were found." % int(results)
+
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def check_unusedindexes(self):
+        ##########################
+        # Check for unused indexes
+        ##########################
+        # An index only counts as unused once its idx_scan has not moved for "unuseddays", tracked across runs in the state file.
+        # The stats reset time is part of the sample so a reset of the counters restarts the clock instead of making everything look unused,
+        # and so is the time the index was first seen, since an index created after the last reset has not been unused since then.
+        minbytes   = self.get_setting('unusedindexes', 'minbytes')
+        unuseddays = self.get_setting('unusedindexes', 'unuseddays')
+        top        = self.get_setting('unusedindexes', 'top')
+        sql="SELECT s.indexrelid, s.schemaname || '.' || s.indexrelname, s.schemaname || '.' || s.relname, s.idx_scan, pg_relation_size(s.indexrelid), coalesce(t.n_tup_ins + t.n_tup_upd + t.n_tup_del, 0), " \
+            "coalesce(cast(extract(epoch from d.stats_reset) as bigint), 0) FROM pg_stat_user_indexes s JOIN pg_index i USING(indexrelid) JOIN pg_stat_user_tables t ON t.relid = s.relid " \
+            "JOIN pg_stat_database d ON d.datname = current_database() " \
+            "WHERE NOT indisprimary AND NOT indisunique AND NOT indisexclusion AND indisvalid AND indisready AND pg_relation_size(s.indexrelid) > %d" % minbytes
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
+        rc, results = self.executecmd(cmd, False)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get unused indexes."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+
+        now     = int(self.now())
+        prev    = self.state.get('indexes', {})
+        samples = {}
+        unused  = []
+        for aline in results.split('\n'):
+            if aline.strip() == '':
+                continue
+            cols = aline.split('|')
+            oid        = cols[0]
+            indexname  = cols[1]
+            tablename  = cols[2]
+            idx_scan   = int(cols[3])
+            size       = int(cols[4])
+            writes     = int(cols[5])
+            statsreset = int(cols[6])
+
+            # sample is [idx_scan, time idx_scan last changed, table writes, time of writes sample, stats reset, time first seen]
+            last = prev.get(oid)
+            if last is not None and len(last) < 6:
+                # sampled before first seen times were kept, so start over rather than trust a stats reset older than the index
+                last = None
+            firstseen = now if last is None else last[5]
+            if last is None or last[4] != statsreset or idx_scan < last[0]:
+                # new index or counters were reset: a zero count is only trusted back to the later of the stats reset and first seen
+                if idx_scan == 0:
+                    since = max(statsreset, firstseen)
+                else:
+                    since = now
+                samples[oid] = [idx_scan, since, writes, now, statsreset, firstseen]
+                writerate = -1
+            else:
+                since = last[1] if idx_scan == last[0] else now
+                samples[oid] = [idx_scan, since, writes, now, statsreset, firstseen]
+                writerate = (writes - last[2]) * 60 / max(now - last[3], 1)
+
+            if now - since >= unuseddays * 86400:
+                unused.append((size, indexname, tablename, writerate, int((now - since) / 86400)))
+
+        self.state['indexes'] = samples
+        self.record('unusedindexes.count', len(unused))
+        self.record('unusedindexes.bytes', sum(anindex[0] for anindex in unused))
+
+        if len(unused) == 0:
+            marker = MARK_OK
+            self.unusedindexes = False
+            msg = "No unused indexes were found (no scans in %d days)." % unuseddays
+        else:
+            # biggest first since those cost the most disk and write amplification
+            unused.sort(reverse=True)
+            totalsize = sum(anindex[0] for anindex in unused)
+            marker = MARK_WARN
+            self.unusedindexes = True
+            msg = "%d unused indexes (no scans in %d days) were found using %s." % (len(unused), unuseddays, self.convert_bytes_to_humanfriendly(totalsize))
+            for size, indexname, tablename, writerate, days in unused[:top]:
+                if writerate < 0:
+                    rate = 'N/A'
+                else:
+                    rate = "%d" % writerate
+                msg += "\n        %s on %s  size=%s  unused days=%d  table writes/min=%s" % (indexname, tablename, self.convert_bytes_to_humanfriendly(size), days, rate)
+
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def check_duplicateindexes(self):
+        #############################################
+        # Check for duplicate/prefix redundant indexes
+        #############################################
+        # index a is redundant if b has the same access method and a's key columns and operator classes are a leading prefix of b's.
+        # Expression and partial indexes are left alone, and a unique index is only redundant against an identical unique index.
+        top = self.get_setting('duplicateindexes', 'top')
+        sql = "SELECT a.indexrelid::regclass, b.indexrelid::regclass, a.indrelid::regclass, pg_relation_size(a.indexrelid), " \
+              "case when a.indkey::text = b.indkey::text then 'duplicate' else 'prefix' end FROM pg_index a JOIN pg_index b ON b.indrelid = a.indrelid AND b.indexrelid <> a.indexrelid " \
+              "JOIN pg_class ca ON ca.oid = a.indexrelid JOIN pg_class cb ON cb.oid = b.indexrelid JOIN pg_namespace n ON n.oid = ca.relnamespace " \
+              "WHERE n.nspname not in ('pg_catalog','information_schema') AND n.nspname not like 'pg_toast%' AND ca.relam = cb.relam " \
+              "AND a.indexprs is null AND b.indexprs is null AND a.indpred is null AND b.indpred is null AND NOT a.indisprimary AND a.indisvalid AND b.indisvalid " \
+              "AND (b.indkey::text || ' ') like (a.indkey::text || ' %') AND (b.indclass::text || ' ') like (a.indclass::text || ' %') " \
+              "AND (NOT a.indisunique OR (b.indisunique AND a.indkey::text = b.indkey::text)) " \
+              "AND (a.indkey::text <> b.indkey::text OR a.indexrelid > b.indexrelid) ORDER BY 4 desc"
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
+        rc, results = self.executecmd(cmd, False)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get duplicate indexes."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+
+        redundant = {}
+        for aline in results.split('\n'):
+            if aline.strip() == '':
+                continue
+            cols = aline.split('|')
+            # only report an index once even if it is a prefix of several others
+            if cols[0] not in redundant:
+                redundant[cols[0]] = (int(cols[3]), cols[1], cols[2], cols[4])
+
+        self.record('duplicateindexes.count', len(redundant))
+        self.record('duplicateindexes.bytes', sum(anindex[0] for anindex in redundant.values()))
+        if len(redundant) == 0:
+            marker = MARK_OK
+            msg = "No duplicate or prefix redundant indexes were found."
+        else:
+            totalsize = sum(anindex[0] for anindex in redundant.values())
+            marker = MARK_WARN
+            msg = "%d duplicate or prefix redundant indexes were found using %s." % (len(redundant), self.convert_bytes_to_humanfriendly(totalsize))
+            for indexname, (size, coveredby, tablename, kind) in list(redundant.items())[:top]:
+                msg += "\n        %s on %s  size=%s  %s of %s" % (indexname, tablename, self.convert_bytes_to_humanfriendly(size), kind, coveredby)
+
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def check_shortconns(self):
+        ###################################
+        # Check for short-lived connections
+        ###################################
+        rc, results = self.run_query('shortconns')
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get average connection time."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+
+        avgsecs    = int(results)
+        self.record('shortconns.avgsecs', avgsecs)
+        maxavgsecs = self.get_setting('shortconns', 'maxavgsecs')
+        minavgsecs = self.get_setting('shortconns', 'minavgsecs')
+        if avgsecs > maxavgsecs:
+            # default is 48 hours, so warn to refresh connections
+            marker = MARK_WARN
+            msg = "Connections average more than %d hours (%d minutes). Consider refreshing these connections 2-3 times per day." % (maxavgsecs / 3600, avgsecs / 60)
+        elif avgsecs >= minavgsecs:
+            marker = MARK_OK
+            msg = "Connections average more than %d minutes (%d). This seems acceptable." % (minavgsecs / 60, avgsecs / 60)
+        else:
+            marker = MARK_WARN
+            msg = "Connections average less than %d minutes (%d).  Use or tune a connection pooler to keep these connections alive longer." % (minavgsecs / 60, avgsecs / 60)
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def check_freeze(self):
+        ####################################
+        # Check for vacuum freeze candidates
+        ####################################
+        # WITH settings AS (select s.setting from pg_settings s where s.name = 'autovacuum_freeze_max_age') select count(c.*) from settings s, pg_class c, pg_namespace n WHERE n.oid = c.relnamespace and c.relkind = 'r' and pg_table_size(c.oid) > 1073741824 and round((age(c.relfrozenxid)::float / s.setting::float) * 100) > 50;
+        #  WITH settings AS (select s.setting from pg_settings s where s.name = 'autovacuum_freeze_max_age') select c.relname, pg_table_size(c.oid) as size, c.relpages * 8192 as size_calculated,c.relpages, c.reltuples, s.setting as autovacuum_freeze_max_age from settings s, pg_class c, pg_namespace n WHERE n.oid = c.relnamespace and c.relkind = 'r'  and n.nspname not like 'pg_%' order by 2 desc limit 20;
+        sql="WITH settings AS (select s.setting from pg_settings s where s.name = 'autovacuum_freeze_max_age') select count(c.*) from settings s, pg_class c, pg_namespace n " \
+            "WHERE n.oid = c.relnamespace and c.relkind = 'r' and (c.relpages::bigint * 8192)::bigint > %d and round((age(c.relfrozenxid)::float / s.setting::float) * 100) > %d" \
+            % (self.get_setting('freeze', 'minbytes'), self.get_setting('freeze', 'agepct'))
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
+        rc, results = self.executecmd(cmd, False)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get vacuum freeze candidate count."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+        self.record('freeze.count', int(results))
+
+        if int(results) == 0:
+            marker = MARK_OK
+            self.freezecandidates = False
+            msg = "No vacuum freeze candidates were found."
+        else:
+            marker = MARK_WARN
+            self.freezecandidates = True
+            msg = "%d vacuum freeze candidates were found." % int(results)
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def check_sequences(self):
+        #######################################################
+        # Check for sequences and integer keys running out of values
+        #######################################################
+        # One catalog query for all sequences: the usable limit is the sequence bound or the max of the smallest int column
+        # that owns it (serial/identity), whichever comes first.  The consumption rate comes from last_value in the previous run.
+        sql = "select quote_ident(n.nspname) || '.' || quote_ident(c.relname), coalesce(case when has_sequence_privilege(c.oid, 'SELECT,USAGE') then pg_sequence_last_value(c.oid) end, s.seqstart), " \
+              "s.seqincrement, s.seqmin, s.seqmax, s.seqcycle, coalesce(min(case a.atttypid when 'int2'::regtype then 32767 when 'int4'::regtype then 2147483647 end), 9223372036854775807), " \
+              "coalesce(string_agg(quote_ident(t.relname) || '.' || quote_ident(a.attname) || ' ' || format_type(a.atttypid, a.atttypmod), ', '), '') " \
+              "from pg_sequence s join pg_class c on c.oid = s.seqrelid join pg_namespace n on n.oid = c.relnamespace " \
+              "left join pg_depend d on d.classid = 'pg_class'::regclass and d.objid = s.seqrelid and d.refclassid = 'pg_class'::regclass and d.refobjsubid > 0 and d.deptype in ('a', 'i') " \
+              "left join pg_attribute a on a.attrelid = d.refobjid and a.attnum = d.refobjsubid left join pg_class t on t.oid = d.refobjid " \
+              "where n.nspname !~ '^pg_temp' group by 1, 2, 3, 4, 5, 6"
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
+        rc, results = self.executecmd(cmd, False)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get sequences."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+
+        now     = int(self.now())
+        prev    = self.state.get('sequences', {})
+        values  = {}
+        risks   = []
+        maxpct  = 0.0
+        for aline in results.split('\n'):
+            if aline.strip() == '':
+                continue
+            cols = aline.split('|')
+            seqname, lastvalue, increment, seqmin, seqmax, cycle, typemax, columns = cols[0], int(cols[1]), int(cols[2]), int(cols[3]), int(cols[4]), cols[5] == 't', int(cols[6]), cols[7]
+            values[seqname] = lastvalue
+            if increment > 0:
+                limit = min(seqmax, typemax)
+                total = limit - seqmin
+                used  = lastvalue - seqmin
+            else:
+                limit = max(seqmin, -typemax - 1)
+                total = seqmax - limit
+                used  = seqmax - lastvalue
+            if cycle and limit in (seqmin, seqmax):
+                # wraps around at its own bound instead of failing
+                continue
+            pct = used * 100.0 / total if total > 0 else 100.0
+            maxpct = max(maxpct, pct)
+
+            etadays = None
+            if seqname in prev.get('values', {}) and now > prev['ts']:
+                perday = (lastvalue - prev['values'][seqname]) * 86400.0 / (now - prev['ts'])
+                if perday * increment > 0:
+                    etadays = (limit - lastvalue) / perday
+            if pct >= self.get_setting('sequences', 'warnpct') or (etadays is not None and etadays < self.get_setting('sequences', 'etadays')):
+                risks.append([pct, seqname, columns, limit, etadays])
+        self.state['sequences'] = {'ts': now, 'values': values}
+        self.record('sequences.count', len(values))
+        self.record('sequences.maxpct', maxpct)
+
+        if len(risks) == 0:
+            marker = MARK_OK
+            msg = "No sequences are close to running out of values (%d checked, highest %.1f%% used)." % (len(values), maxpct)
+            self.emit(marker, msg)
+            return SUCCESS, ""
+
+        marker = MARK_WARN
+        msg = "%d sequences are close to running out of values." % len(risks)
+        for pct, seqname, columns, limit, etadays in sorted(risks, key=lambda x: (x[4] if x[4] is not None else float('inf'), -x[0]))[:self.get_setting('sequences', 'top')]:
+            eta = "about %.1f days left at the current rate" % etadays if etadays is not None else "no consumption rate yet"
+            msg += "\n        %s %.1f%% of %d used, %s%s" % (seqname, pct, limit, eta, " (" + columns + ")" if columns != '' else "")
+        subject = "%d sequences are close to running out of values." % len(risks)
+        if self.alert(SEQUENCES):
+            rc = self.send_alert(self.to, self.from_, subject, msg)
+            if rc != 0:
+                self.writeout("mail error")
+                return 1, "mail error"
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def check_analyze(self):
+        ##############################
+        # Check for analyze candidates
+        ##############################
+        livepct   = self.get_setting('analyze', 'livepct')
+        staledays = self.get_setting('analyze', 'staledays')
+        sql="select count(*) from pg_namespace n, pg_class c, pg_tables t, pg_stat_user_tables u where c.relnamespace = n.oid and n.nspname = t.schemaname and t.tablename = c.relname and t.schemaname = u.schemaname and t.tablename = u.relname and n.nspname not in ('information_schema','pg_catalog') and (((c.reltuples > 0 and round((u.n_live_tup::float / c.reltuples::float) * 100) < %d)) OR ((last_vacuum is null and last_autovacuum is null and last_analyze is null and last_autoanalyze is null ) or (now()::date  - last_vacuum::date > %d AND now()::date - last_autovacuum::date > %d AND now()::date  - last_analyze::date > %d AND now()::date  - last_autoanalyze::date > %d)))" \
+            % (livepct, staledays, staledays, staledays, staledays)
         cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
         rc, results = self.executecmd(cmd, False)
         if rc != SUCCESS:
-            errors = "[ERROR] Unable to get table/index bloat count."
+            errors = "Unable to get vacuum analyze candidate count: %d %s\nsql=%s\n" % (rc, results, sql)
             aline = "%s" % (errors)
             self.writeout(aline)
             return rc, errors
+        self.record('analyze.count', int(results))
 
         if int(results) == 0:
             marker = MARK_OK
-            self.bloatedtables = False
-            msg = "No bloated tables/indexes were found."
+            self.analyzecandidates = False
+            msg = "No vacuum analyze candidates were found."
         else:
             marker = MARK_WARN
-            self.bloatedtables = True
-            msg = "%d bloated tables/indexes were found." % int(results)
-
-        print (marker+msg)
-
+            self.analyzecandidates = True
+            msg = "%d vacuum analyze candidate(s) were found." % int(results)
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
-        ##########################
-        # Check for unused indexes
-        ##########################
-        sql="SELECT count(*) FROM pg_stat_user_indexes JOIN pg_index USING(indexrelid) WHERE idx_scan = 0 AND idx_tup_read = 0 AND idx_tup_fetch = 0 AND NOT indisprimary AND NOT indisunique AND NOT indisexclusion AND indisvalid AND indisready AND pg_relation_size(indexrelid) > 8192"
+    ###########################################################
+    def check_autovacuum(self):
+        ###########################################
+        # Check autovacuum effectiveness over time
+        ###########################################
+        # Samples the hottest tables and running vacuums each run and compares them to the previous sample kept in the state file
+        # to find tables where dead tuples keep piling up past the autovacuum threshold without autovacuum getting to them,
+        # autovacuums that disappeared without completing (cancelled), saturated workers and long running vacuums.
+        trackmax = self.get_setting('autovacuum', 'trackmax')
+        longmins = self.get_setting('autovacuum', 'longmins')
+        top      = self.get_setting('autovacuum', 'top')
+
+        sql = "SELECT s.relid, s.schemaname || '.' || s.relname, s.n_dead_tup, s.n_mod_since_analyze, s.vacuum_count, s.autovacuum_count, s.autoanalyze_count, " \
+              "cast(current_setting('autovacuum_vacuum_threshold')::float + current_setting('autovacuum_vacuum_scale_factor')::float * greatest(c.reltuples, 0) as bigint) " \
+              "FROM pg_stat_user_tables s JOIN pg_class c ON c.oid = s.relid ORDER BY s.n_tup_upd + s.n_tup_del desc LIMIT %d" % trackmax
         cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
         rc, results = self.executecmd(cmd, False)
         if rc != SUCCESS:
-            errors = "[ERROR] Unable to get unused indexes count."
+            errors = "[ERROR] Unable to get autovacuum table stats."
             aline = "%s" % (errors)
             self.writeout(aline)
             return rc, errors
+        tables = {}
+        for aline in results.split('\n'):
+            if aline.strip() == '':
+                continue
+            cols = aline.split('|')
+            # [name, n_dead_tup, n_mod_since_analyze, vacuum_count, autovacuum_count, autoanalyze_count, vacuum threshold]
+            tables[cols[0]] = [cols[1]] + [int(acol) for acol in cols[2:8]]
 
-        if int(results) == 0:
-            marker = MARK_OK
-            self.unusedindexes = False
-            msg = "No unused indexes were found."
-        else:
-            marker = MARK_WARN
-            self.unusedindexes = True
-            msg = "%d unused indexes were found." % int(results)
-
-        print (marker+msg)
-
-        ###################################
-        # Check for short-lived connections
-        ###################################
-        sql="select cast(extract(epoch from avg(now()-backend_start)) as integer) as age from pg_stat_activity"
+        sql = "SELECT p.pid, p.relid, p.relid::regclass, p.phase, p.heap_blks_total, p.heap_blks_scanned, cast(extract(epoch from now() - a.xact_start) as bigint), " \
+              "case when a.query like 'autovacuum:%' then 'autovacuum' else 'vacuum' end FROM pg_stat_progress_vacuum p JOIN pg_stat_activity a ON a.pid = p.pid " \
+              "WHERE p.datid = (SELECT oid FROM pg_database WHERE datname = current_database())"
         cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
         rc, results = self.executecmd(cmd, False)
         if rc != SUCCESS:
-            errors = "[ERROR] Unable to get average connection time."
+            errors = "[ERROR] Unable to get vacuum progress."
             aline = "%s" % (errors)
             self.writeout(aline)
             return rc, errors
+        vacuums = {}
+        for aline in results.split('\n'):
+            if aline.strip() == '':
+                continue
+            cols = aline.split('|')
+            # [relid, name, phase, heap_blks_total, heap_blks_scanned, seconds, vacuum type]
+            vacuums[cols[0]] = [cols[1], cols[2], cols[3], int(cols[4]), int(cols[5]), int(cols[6]), cols[7]]
 
-        avgsecs = int(results)
-        if avgsecs > 172800:
-            # 24 hours, so warn to refresh connections
-            marker = MARK_WARN
-            msg = "Connections average more than 24 hours (%d minutes). Consider refreshing these connections 2-3 times per day." % (avgsecs / 60)
-        elif avgsecs >= 120:
+        rc, results = self.run_query('autovacuum.workers')
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get autovacuum workers."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+        cols = results.split('|')
+        workers     = int(cols[0])
+        max_workers = int(cols[1])
+
+        now     = int(self.now())
+        prev    = self.state.get('autovacuum', {})
+        minutes = (now - prev.get('ts', now)) / 60
+        self.state['autovacuum'] = {'ts': now, 'tables': tables, 'vacuums': vacuums}
+
+        problems = []
+        if minutes > 0:
+            prevtables  = prev.get('tables', {})
+            prevvacuums = prev.get('vacuums', {})
+            for relid, (name, dead, modified, vacuum_count, autovacuum_count, autoanalyze_count, threshold) in tables.items():
+                last = prevtables.get(relid)
+                if last is None:
+                    continue
+                vacuumed = vacuum_count > last[3] or autovacuum_count > last[4]
+                rate = (dead - last[1]) / minutes
+                if not vacuumed and dead > threshold and rate > 0:
+                    problems.append((dead, "%s: autovacuum behind, dead tuples=%d (threshold %d) growing %d/min with no vacuum in %d minutes" % (name, dead, threshold, rate, minutes)))
+
+            # a vacuum seen last time that is gone now without the count moving did not finish
+            for pid, (relid, name, phase, total, scanned, secs, vactype) in prevvacuums.items():
+                if vactype != 'autovacuum' or (pid in vacuums and vacuums[pid][0] == relid):
+                    continue
+                last = prevtables.get(relid)
+                current = tables.get(relid)
+                if last is not None and current is not None and current[4] == last[4]:
+                    problems.append((current[1], "%s: autovacuum cancelled in phase '%s' after %d%% scanned" % (name, phase, (scanned * 100 / total) if total > 0 else 0)))
+
+        for pid, (relid, name, phase, total, scanned, secs, vactype) in vacuums.items():
+            if secs < longmins * 60:
+                continue
+            pct  = (scanned * 100 / total) if total > 0 else 0
+            last = prev.get('vacuums', {}).get(pid)
+            if last is not None and last[0] == relid and minutes > 0:
+                blkrate = (scanned - last[4]) / minutes
+                if blkrate > 0:
+                    progress = "%d blocks/min, about %d minutes to finish scanning" % (blkrate, (total - scanned) / blkrate)
+                else:
+                    progress = "no scan progress since last run"
+            else:
+                progress = "progress rate N/A"
+            problems.append((scanned, "%s: %s running %d minutes, phase '%s', %d%% scanned, %s" % (name, vactype, secs / 60, phase, pct, progress)))
+
+        self.record('autovacuum.workers', workers)
+        if workers >= max_workers:
+            problems.append((sys.maxsize, "autovacuum workers saturated: %d of %d autovacuum_max_workers busy" % (workers, max_workers)))
+
+        self.record('autovacuum.problems', len(problems))
+        if len(problems) == 0:
             marker = MARK_OK
-            msg = "Connections average more than 2 minutes (%d). This seems acceptable." % (avgsecs / 60)
-        elif avgsecs < 200:
+            msg = "Autovacuum is keeping up (%d of %d workers busy, %d hot tables tracked)." % (workers, max_workers, len(tables))
+        else:
+            problems.sort(reverse=True)
             marker = MARK_WARN
-            msg = "Connections average less than 2 minutes (%d).  Use or tune a connection pooler to keep these connections alive longer." % (avgsecs / 60)
-        print (marker+msg)
-
+            msg = "%d autovacuum problem(s) detected." % len(problems)
+            for weight, problem in problems[:top]:
+                msg += "\n        " + problem
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
-        ####################################
-        # Check for vacuum freeze candidates
-        ####################################
-        # WITH settings AS (select s.setting from pg_settings s where s.name = 'autovacuum_freeze_max_age') select count(c.*) from settings s, pg_class c, pg_namespace n WHERE n.oid = c.relnamespace and c.relkind = 'r' and pg_table_size(c.oid) > 1073741824 and round((age(c.relfrozenxid)::float / s.setting::float) * 100) > 50;
-        #  WITH settings AS (select s.setting from pg_settings s where s.name = 'autovacuum_freeze_max_age') select c.relname, pg_table_size(c.oid) as size, c.relpages * 8192 as size_calculated,c.relpages, c.reltuples, s.setting as autovacuum_freeze_max_age from settings s, pg_class c, pg_namespace n WHERE n.oid = c.relnamespace and c.relkind = 'r'  and n.nspname not like 'pg_%' order by 2 desc limit 20;
-        sql="WITH settings AS (select s.setting from pg_settings s where s.name = 'autovacuum_freeze_max_age') select count(c.*) from settings s, pg_class c, pg_namespace n " \
-            "WHERE n.oid = c.relnamespace and c.relkind = 'r' and (c.relpages::bigint * 8192)::bigint > 1073741824 and round((age(c.relfrozenxid)::float / s.setting::float) * 100) > 50"
+    ###########################################################
+    def check_hotspots(self):
+        ###########################################
+        # Check table access patterns between runs
+        ###########################################
+        # Compares pg_stat_user_tables counters to the previous sample kept in the state file and ranks the tables by rows
+        # read with sequential scans since then (missing indexes) and by updates that were not HOT (fillfactor too high or
+        # an indexed column updated), where every index of the table gets a new entry for the row.
+        # The state keeps the counters of the top tables of the last interval and of the next chunk of trackmax tables in
+        # relid order, so a run compares those and the chunks rotate through all tables without keeping them all.  Only
+        # the counters are sampled and kept, and the names, indexes and fillfactor are looked up for the top tables alone.
+        trackmax      = self.get_setting('hotspots', 'trackmax')
+        minrows       = self.get_setting('hotspots', 'minrows')
+        seqrowspermin = self.get_setting('hotspots', 'seqrowspermin')
+        seqpct        = self.get_setting('hotspots', 'seqpct')
+        updpermin     = self.get_setting('hotspots', 'updpermin')
+        hotpct        = self.get_setting('hotspots', 'hotpct')
+        top           = self.get_setting('hotspots', 'top')
+
+        now     = int(self.now())
+        prev    = self.state.get('hotspots', {})
+        minutes = (now - prev.get('ts', now)) / 60
+        prevtables = prev.get('tables', {})
+        cursor     = prev.get('cursor', 0)
+
+        # the tables sampled last run, then the next chunk after the cursor
+        tracked = "'{%s}'::oid[]" % ','.join(prevtables)
+        columns = "relid, seq_scan, seq_tup_read, coalesce(idx_scan, 0), n_tup_ins, n_tup_upd, n_tup_hot_upd, n_tup_del, n_live_tup"
+        sql = "SELECT %s FROM pg_stat_user_tables WHERE relid = any(%s) UNION ALL " \
+              "(SELECT %s FROM pg_stat_user_tables WHERE relid > %d AND relid <> all(%s) ORDER BY relid LIMIT %d)" \
+              % (columns, tracked, columns, cursor, tracked, trackmax)
         cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
         rc, results = self.executecmd(cmd, False)
         if rc != SUCCESS:
-            errors = "[ERROR] Unable to get vacuum freeze candidate count."
+            errors = "[ERROR] Unable to get table access stats."
             aline = "%s" % (errors)
             self.writeout(aline)
             return rc, errors
 
-        if int(results) == 0:
+        tables   = {}
+        compared = 0
+        chunk    = 0
+        busy     = []
+        seqscans = []
+        nonhot   = []
+        for aline in results.split('\n'):
+            if aline.strip() == '':
+                continue
+            cols = aline.split('|')
+            # [seq_scan, seq_tup_read, idx_scan, n_tup_ins, n_tup_upd, n_tup_hot_upd, n_tup_del]
+            counters = [int(acol) for acol in cols[1:8]]
+            live     = int(cols[8])
+            last = prevtables.get(cols[0])
+            if last is None:
+                # next chunk: the baseline for the next run
+                tables[cols[0]] = counters
+                chunk  += 1
+                cursor  = max(cursor, int(cols[0]))
+                continue
+            deltas = [current - previous for current, previous in zip(counters, last)]
+            if len(last) != len(counters) or minutes <= 0 or min(deltas) < 0:
+                # stats were reset since the last run: a new baseline
+                tables[cols[0]] = counters
+                continue
+            compared += 1
+            dseqscan, dseqread, didxscan, dins, dupd, dhotupd, ddel = deltas
+            busy.append((dseqread, dupd - dhotupd, cols[0], counters))
+
+            if live >= minrows and dseqread > 0 and dseqread / minutes >= seqrowspermin and dseqscan * 100 / max(dseqscan + didxscan, 1) >= seqpct:
+                seqscans.append((dseqread, cols[0], dseqscan, didxscan, live))
+            if dupd > 0 and dupd / minutes >= updpermin and dhotupd * 100 / dupd < hotpct:
+                nonhot.append((dupd - dhotupd, cols[0], dins, dupd, dhotupd, ddel))
+
+        # the busiest tables of the interval by either ranking stay sampled every run, past the end of the relids the chunks start over
+        for dseqread, dnonhot, relid, counters in heapq.nlargest(top, [abusy for abusy in busy if abusy[0] > 0]) + \
+                                                  heapq.nlargest(top, [abusy for abusy in busy if abusy[1] > 0], key=lambda x: x[1]):
+            tables[relid] = counters
+        self.state['hotspots'] = {'ts': now, 'tables': tables, 'cursor': cursor if chunk >= trackmax else 0}
+        if minutes <= 0:
             marker = MARK_OK
-            self.freezecandidates = False
-            msg = "No vacuum freeze candidates were found."
-        else:
-            marker = MARK_WARN
-            self.freezecandidates = True
-            msg = "%d vacuum freeze candidates were found." % int(results)
-        print (marker+msg)
+            msg = "Table workload baseline collected for %d tables.  Hot spots are reported from the next run." % len(tables)
+            self.emit(marker, msg)
+            return SUCCESS, ""
 
+        self.record('hotspots.seqscans', len(seqscans))
+        self.record('hotspots.nonhot', len(nonhot))
+        if len(seqscans) == 0 and len(nonhot) == 0:
+            marker = MARK_OK
+            msg = "No table hot spots over the last %.1f minutes (%d tables compared)." % (minutes, compared)
+            self.emit(marker, msg)
+            return SUCCESS, ""
 
-        ##############################
-        # Check for analyze candidates
-        ##############################
-        sql="select count(*) from pg_namespace n, pg_class c, pg_tables t, pg_stat_user_tables u where c.relnamespace = n.oid and n.nspname = t.schemaname and t.tablename = c.relname and t.schemaname = u.schemaname and t.tablename = u.relname and n.nspname not in ('information_schema','pg_catalog') and (((c.reltuples > 0 and round((u.n_live_tup::float / c.reltuples::float) * 100) < 50)) OR ((last_vacuum is null and last_autovacuum is null and last_analyze is null and last_autoanalyze is null ) or (now()::date  - last_vacuum::date > 60 AND now()::date - last_autovacuum::date > 60 AND now()::date  - last_analyze::date > 60 AND now()::date  - last_autoanalyze::date > 60)))"
+        seqcount = len(seqscans)
+        hotcount = len(nonhot)
+        seqscans = heapq.nlargest(top, seqscans)
+        nonhot   = heapq.nlargest(top, nonhot)
+        relids   = sorted(set([hotspot[1] for hotspot in seqscans + nonhot]))
+        sql = "SELECT c.oid, n.nspname || '.' || c.relname, (SELECT count(*) FROM pg_index i WHERE i.indrelid = c.oid), " \
+              "coalesce((SELECT option_value FROM pg_options_to_table(c.reloptions) WHERE option_name = 'fillfactor'), '100') " \
+              "FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace WHERE c.oid in (%s)" % ', '.join(relids)
         cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
         rc, results = self.executecmd(cmd, False)
         if rc != SUCCESS:
-            errors = "Unable to get vacuum analyze candidate count: %d %s\nsql=%s\n" % (rc, results, sql)
+            errors = "[ERROR] Unable to get hot spot table details."
             aline = "%s" % (errors)
             self.writeout(aline)
             return rc, errors
+        details = {}
+        for aline in results.split('\n'):
+            if aline.strip() == '':
+                continue
+            cols = aline.split('|')
+            # [name, indexes, fillfactor]
+            details[cols[0]] = [cols[1], int(cols[2]), cols[3]]
+
+        marker = MARK_WARN
+        msg = "Table hot spots over the last %.1f minutes: %d with heavy sequential reads, %d with low HOT update ratios." \
+              % (minutes, seqcount, hotcount)
+        if len(seqscans) > 0:
+            msg += "\n        sequential reads (consider an index):"
+            for dseqread, relid, dseqscan, didxscan, live in seqscans:
+                # a table dropped since the sample has no details left
+                name = details.get(relid, [relid])[0]
+                msg += "\n        %s: %d rows/min read by %d sequential scans (%d%% of scans), %d live rows" \
+                       % (name, dseqread / minutes, dseqscan, dseqscan * 100 / max(dseqscan + didxscan, 1), live)
+        if len(nonhot) > 0:
+            msg += "\n        non-HOT updates (consider a lower fillfactor or not indexing updated columns):"
+            for weight, relid, dins, dupd, dhotupd, ddel in nonhot:
+                name, indexes, fillfactor = details.get(relid, [relid, 0, '?'])
+                # each row written without HOT adds an entry to every index of the table
+                amplification = (dins + dupd - dhotupd) * indexes / (dins + dupd + ddel)
+                msg += "\n        %s: %d%% HOT of %d updates/min, fillfactor=%s, %d indexes, %.1f index writes per row written" \
+                       % (name, dhotupd * 100 / dupd, dupd / minutes, fillfactor, indexes, amplification)
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
-        if int(results) == 0:
+    ###########################################################
+    def read_sysfile(self, path):
+        # /proc and /sys files are read directly, but go through --capture/--replay like the commands do.  None if unreadable.
+        if self.replay != '':
+            rc, values, err = self.replay_probe("cat %s" % path)
+            return values if rc == SUCCESS else None
+        try:
+            with open(path) as f:
+                values = f.read().strip()
+        except OSError:
+            values = None
+        if self.capture != '':
+            self.capture_probe("cat %s" % path, SUCCESS if values is not None else 1, values or '', '')
+        return values
+
+    ###########################################################
+    def get_cgroup_limit(self):
+        # memory limit in bytes of the cgroup the postmaster runs in (our own if postmaster.pid is not readable), -1 if none.
+        # cgroup v2 lines look like "0::/system.slice/postgresql.service", v1 like "4:memory:/docker/abc".
+        pid = 'self'
+        postmaster = self.read_sysfile("%s/postmaster.pid" % self.datadir)
+        if postmaster is not None and postmaster.split('\n')[0].strip().isdigit():
+            pid = postmaster.split('\n')[0].strip()
+        cgroups = self.read_sysfile("/proc/%s/cgroup" % pid)
+        if cgroups is None:
+            return -1
+        for aline in cgroups.split('\n'):
+            parts = aline.split(':', 2)
+            if len(parts) < 3:
+                continue
+            if parts[0] == '0' and parts[1] == '':
+                limit = self.read_sysfile("/sys/fs/cgroup%s/memory.max" % parts[2].rstrip('/'))
+            elif 'memory' in parts[1].split(','):
+                limit = self.read_sysfile("/sys/fs/cgroup/memory%s/memory.limit_in_bytes" % parts[2].rstrip('/'))
+            else:
+                continue
+            # v1 reports no limit as a huge page aligned number
+            if limit is not None and limit.isdigit() and int(limit) < 2**60:
+                return int(limit)
+        return -1
+
+    ###########################################################
+    def check_memory(self):
+        #################################################
+        ### Memory and kernel settings vs the PG settings
+        #################################################
+        if not self.local or self.opsys != 'posix':
             marker = MARK_OK
-            self.analyzecandidates = False
-            msg = "No vacuum analyze candidates were found."
+            msg = "N/A  PG Host is remote. No server memory info is available."
+            self.emit(marker, msg)
+            return SUCCESS, ""
+
+        results = self.read_sysfile("/proc/meminfo")
+        if results is None:
+            errors = "[ERROR] Unable to read /proc/meminfo."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return ERROR, errors
+        # values in kB except the HugePages_ counts
+        meminfo = {}
+        for aline in results.split('\n'):
+            parts = aline.replace(':', ' ').split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                meminfo[parts[0]] = int(parts[1])
+        vm = {}
+        for name in ('overcommit_memory', 'overcommit_ratio', 'swappiness'):
+            value = self.read_sysfile("/proc/sys/vm/%s" % name)
+            vm[name] = int(value) if value is not None and value.isdigit() else -1
+        self.overcommit_memory = vm['overcommit_memory']
+        self.overcommit_ratio  = vm['overcommit_ratio']
+        thp = self.read_sysfile("/sys/kernel/mm/transparent_hugepage/enabled") or ''
+
+        # the memory PG can really use is the smaller of RAM and the cgroup limit
+        rammb   = meminfo.get('MemTotal', 0) / 1024
+        limit   = self.get_cgroup_limit()
+        memmb   = min(rammb, limit / 1048576) if limit > 0 else rammb
+        where   = "cgroup limit" if limit > 0 and limit / 1048576 < rammb else "RAM"
+        if memmb <= 0:
+            errors = "[ERROR] Unable to get total memory."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return ERROR, errors
+        self.record('memory.total_mb', memmb)
+
+        problems = []
+        sharedpct = float(self.shared_buffers) * 100 / memmb
+        if sharedpct > self.get_setting('memory', 'maxsharedpct'):
+            problems.append("shared_buffers=%d MB is %d%% of %s (%d MB), leaving little for work_mem and the OS cache." % (self.shared_buffers, sharedpct, where, memmb))
+        elif sharedpct < self.get_setting('memory', 'minsharedpct') and memmb >= 4096:
+            problems.append("shared_buffers=%d MB is only %d%% of %s (%d MB)." % (self.shared_buffers, sharedpct, where, memmb))
+        if float(self.eff_cache_size) > memmb:
+            problems.append("effective_cache_size=%d MB is more than %s (%d MB)." % (self.eff_cache_size, where, memmb))
+
+        # worst case: every connection using one work_mem at once, every autovacuum worker its maintenance_work_mem
+        exposure    = float(self.shared_buffers) + float(self.work_mem) * self.max_connections + float(self.maint_work_mem) * self.autovacuum_max_workers
+        exposurepct = exposure * 100 / memmb
+        self.record('memory.exposure_pct', exposurepct)
+        if exposurepct > self.get_setting('memory', 'exposurepct'):
+            problems.append("worst case memory is %d%% of %s: shared_buffers=%d MB + work_mem=%g MB x max_connections=%d + maintenance_work_mem=%g MB x autovacuum_max_workers=%d = %d MB of %d MB." \
+                            % (exposurepct, where, self.shared_buffers, float(self.work_mem), self.max_connections, float(self.maint_work_mem), self.autovacuum_max_workers, exposure, memmb))
+
+        # huge pages: PG15+ says how many its shared memory needs, before that shared_buffers is the estimate
+        pagekb   = meminfo.get('Hugepagesize', 2048)
+        neededmb = self.shmem_hugepages * pagekb / 1024 if self.shmem_hugepages > 0 else float(self.shared_buffers)
+        hugemb   = meminfo.get('HugePages_Total', 0) * pagekb / 1024
+        coverage = min(hugemb * 100 / neededmb, 100) if neededmb > 0 else 0
+        self.record('memory.hugepage_coverage_pct', coverage)
+        if float(self.shared_buffers) >= self.get_setting('memory', 'hugepagesmb') and (coverage < 100 or self.huge_pages == 'off'):
+            problems.append("huge pages cover %d%% of the %d MB shared memory (huge_pages=%s, vm.nr_hugepages=%d of %d kB).  Set vm.nr_hugepages to at least %d." \
+                            % (coverage, neededmb, self.huge_pages, meminfo.get('HugePages_Total', 0), pagekb, math.ceil(neededmb * 1024 / pagekb)))
+        if '[always]' in thp:
+            problems.append("transparent huge pages are set to always, which causes latency spikes.  Set it to madvise or never.")
+
+        if vm['swappiness'] > self.get_setting('memory', 'maxswappiness'):
+            problems.append("vm.swappiness=%d lets the kernel swap out PG memory.  Consider 1 to %d." % (vm['swappiness'], self.get_setting('memory', 'maxswappiness')))
+        if vm['overcommit_memory'] == 2 and meminfo.get('Committed_AS', 0) > meminfo.get('CommitLimit', 0) * 0.9:
+            problems.append("vm.overcommit_memory=2 and %d%% of the commit limit is used, so new backends may fail to allocate memory (overcommit_ratio=%d)." \
+                            % (meminfo['Committed_AS'] * 100 / max(meminfo['CommitLimit'], 1), vm['overcommit_ratio']))
+
+        # swapping is only seen as page counts going up between runs
+        vmstat = {}
+        for aline in (self.read_sysfile("/proc/vmstat") or '').split('\n'):
+            parts = aline.split()
+            if len(parts) == 2 and parts[0] in ('pswpin', 'pswpout'):
+                vmstat[parts[0]] = int(parts[1])
+        now  = int(self.now())
+        prev = self.state.get('memory', {})
+        self.state['memory'] = {'ts': now, 'vmstat': vmstat}
+        if 'ts' in prev and now > prev['ts'] and len(vmstat) == 2 and len(prev.get('vmstat', {})) == 2:
+            pages = vmstat['pswpin'] + vmstat['pswpout'] - prev['vmstat']['pswpin'] - prev['vmstat']['pswpout']
+            if pages >= 0:
+                permin = pages * 60.0 / (now - prev['ts'])
+                self.record('memory.swap_pages_per_min', permin)
+                if permin > self.get_setting('memory', 'swappagespermin'):
+                    problems.append("the server is swapping %d pages/min (in=%d out=%d since the last run, %d MB swap used)." \
+                                    % (permin, vmstat['pswpin'] - prev['vmstat']['pswpin'], vmstat['pswpout'] - prev['vmstat']['pswpout'],
+                                       (meminfo.get('SwapTotal', 0) - meminfo.get('SwapFree', 0)) / 1024))
+
+        if len(problems) == 0:
+            marker = MARK_OK
+            msg = "Memory settings fit the %s (%d MB): shared_buffers %d%%, worst case %d%%, huge page coverage %d%%, swappiness=%d, overcommit_memory=%d." \
+                  % (where, memmb, sharedpct, exposurepct, coverage, vm['swappiness'], vm['overcommit_memory'])
         else:
             marker = MARK_WARN
-            self.analyzecandidates = True
-            msg = "%d vacuum analyze candidate(s) were found." % int(results)
-        print (marker+msg)
+            msg = "%d memory configuration problem(s) detected (%s %d MB, MemAvailable %d MB):" % (len(problems), where, memmb, meminfo.get('MemAvailable', 0) / 1024)
+            for problem in problems:
+                msg += "\n        " + problem
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_dirsize(self):
         #############################
         ### Check for directory sizes
         #############################
@@ -1701,62 +4327,224 @@ class maint:
           cmd = "df -h %s | tail -n1 | awk '{print($5)}' | cut -d'%%' -f1" % self.datadir
           rc, results = self.executecmd(cmd, True)
           if rc != SUCCESS:
-              print ("[ERROR] Unable to get directory sizes.")
+              self.writeout("[ERROR] Unable to get directory sizes.")
+              return SUCCESS, ""
           else:
               #print ("df -h results = %s" % results)
               pctused = int(results)
-              if pctused > 75:
+              self.record('dirsize.pctused', pctused)
+              if pctused > self.get_setting('dirsize', 'maxpct'):
                   marker = MARK_WARN
                   msg = "Data Directory Usage is high: %d%% used" % pctused
                   subject = "Data Directory Usage is high: %d%% used" % pctused
                   if self.alert(DIRSIZE):
                       rc = self.send_alert(self.to, self.from_, subject, '')
                       if rc != 0:
-                          print("mail error")
-                          return 1
+                          self.writeout("mail error")
+                          return 1, "mail error"
               else:
                   marker = MARK_OK
                   msg = "Data Directory Usage is acceptable: %d%% used" % pctused
         else:
           marker = MARK_OK
           msg = "N/A  PG Host is remote. No server file usage is available."
-        print (marker+msg)
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_replication(self):
         #######################################################
         ### Check for streaming mode replication associated lag
         #######################################################
-        if self.checkreplication:
-            sql = "SELECT floor(EXTRACT(EPOCH FROM replay_lag)) from pg_stat_replication"
-            cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
-            rc, results = self.executecmd(cmd, False)
-            if rc != SUCCESS:
-                errors = "[ERROR] Unable to get replication info."
-                aline = "%s" % (errors)
-                self.writeout(aline)
-                return rc, errors
+        if not self.checkreplication:
+            return SUCCESS, ""
 
-            if results == "":
-                # no active replication detected
-                marker = MARK_WARN
-                msg = "No active streaming replication detected."
-                subject = "No active streaming replication detected."
-                if self.alert(REPLICATION):
-                    rc = self.send_alert(self.to, self.from_, subject, '')
-            elif int(results) == 0:
-                # no SR lag
-                marker = MARK_OK
-                msg = "Active replication with no lag."
-            elif int(results) < 10:
-                marker = MARK_OK
-                msg = "Active replication with slight lag: %s seconds."
-            else:
-                marker = MARK_WARN
-                msg = "Active replication with noticeable lag: %s seconds."
-                subject = "Active replication with noticeable lag: %s seconds."
-                if self.alert(REPLICATION):
-                    rc = self.send_alert(self.to, self.from_, subject, '')
-            print (marker+msg)
+        sql = "SELECT floor(EXTRACT(EPOCH FROM replay_lag)) from pg_stat_replication"
+        cmd = "psql %s -At -X -c \"%s\"" % (self.connstring, sql)
+        rc, results = self.executecmd(cmd, False)
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get replication info."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+
+        if results != "":
+            self.record('replication.lagsecs', int(results))
+        if results == "":
+            # no active replication detected
+            marker = MARK_WARN
+            msg = "No active streaming replication detected."
+            subject = "No active streaming replication detected."
+            if self.alert(REPLICATION):
+                rc = self.send_alert(self.to, self.from_, subject, '')
+        elif int(results) == 0:
+            # no SR lag
+            marker = MARK_OK
+            msg = "Active replication with no lag."
+        elif int(results) < self.get_setting('replication', 'maxlagsecs'):
+            marker = MARK_OK
+            msg = "Active replication with slight lag: %s seconds." % results
+        else:
+            marker = MARK_WARN
+            msg = "Active replication with noticeable lag: %s seconds." % results
+            subject = "Active replication with noticeable lag: %s seconds." % results
+            if self.alert(REPLICATION):
+                rc = self.send_alert(self.to, self.from_, subject, '')
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def check_sessions(self):
+        ###################################################
+        # Check connection churn and session lifecycles
+        ###################################################
+        # pg_stat_database counts every session that ended, so the delta since the last run sees the connections that came
+        # and went in between, which no pg_stat_activity snapshot can.  The rate is split over users/applications by their share
+        # of the backends started in the last minute, which makes the per client rates estimates.
+        rc, results = self.run_query('sessions')
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get session stats."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+        # [sessions, abandoned, fatal, killed, session_time ms]
+        counters = [int(acol) for acol in results.split('|')]
+
+        rc, results = self.run_query('sessions.clients')
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get client backend ages."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+        buckets = [0] * 6
+        clients = []
+        for aline in results.split('\n'):
+            if aline.strip() == '':
+                continue
+            cols = aline.split('|')
+            ages = [int(acol) for acol in cols[0:6]]
+            buckets = [buckets[i] + ages[i] for i in range(6)]
+            clients.append((sum(ages[0:3]), cols[6], '|'.join(cols[7:])))
+        histogram = "backend ages: <1s=%d <10s=%d <1m=%d <10m=%d <1h=%d 1h+=%d" % tuple(buckets)
+
+        now  = int(self.now())
+        prev = self.state.get('sessions', {})
+        self.state['sessions'] = {'ts': now, 'counters': counters}
+        if 'ts' not in prev or now <= prev['ts'] or counters[0] < prev['counters'][0]:
+            marker = MARK_OK
+            msg = "Session stats baseline collected, %s.  Connection rates are reported from the next run." % histogram
+            self.emit(marker, msg)
+            return SUCCESS, ""
+
+        secs      = now - prev['ts']
+        deltas    = [counters[i] - prev['counters'][i] for i in range(5)]
+        persec    = deltas[0] / secs
+        avgms     = deltas[4] / deltas[0] if deltas[0] > 0 else 0
+        abandoned = deltas[1] * 100 / deltas[0] if deltas[0] > 0 else 0
+        self.record('sessions.per_sec', persec)
+        self.record('sessions.avg_ms', avgms if deltas[0] > 0 else None)
+        self.record('sessions.abandoned_pct', abandoned if deltas[0] > 0 else None)
+
+        # clients that started backends in the last minute get their share of the measured rate
+        young    = sum(buckets[0:3])
+        poolable = []
+        for started, user, app in heapq.nlargest(self.get_setting('sessions', 'top'), clients):
+            if started == 0:
+                break
+            rate = persec * started / young
+            if rate >= self.get_setting('sessions', 'clientpersec'):
+                poolable.append("user=%s app=%s: about %.1f connections/sec (%d of the %d backends started in the last minute)" % (user, app if app != '' else 'N/A', rate, started, young))
+
+        problems = []
+        if persec >= self.get_setting('sessions', 'connspersec'):
+            problems.append("%.1f new connections/sec, sessions last %d ms on average.  Put these clients behind a connection pooler." % (persec, avgms))
+        if deltas[0] > 0 and abandoned >= self.get_setting('sessions', 'abandonedpct'):
+            problems.append("%d%% of sessions were abandoned (client went away without closing the connection), fatal=%d killed=%d." % (abandoned, deltas[2], deltas[3]))
+
+        if len(problems) == 0 and len(poolable) == 0:
+            marker = MARK_OK
+            msg = "%.1f new connections/sec over the last %.1f minutes, sessions last %d ms on average, %s." % (persec, secs / 60, avgms, histogram)
+        else:
+            marker = MARK_WARN
+            msg = "Connection churn detected over the last %.1f minutes, %s." % (secs / 60, histogram)
+            for problem in problems:
+                msg += "\n        " + problem
+            if len(poolable) > 0:
+                msg += "\n        pooler candidates:"
+                for client in poolable:
+                    msg += "\n        " + client
+        self.emit(marker, msg)
+        return SUCCESS, ""
+
+    ###########################################################
+    def check_standby(self):
+        ###################################################################
+        ### Standby profile: replay lag, WAL receiver and recovery conflicts
+        ###################################################################
+        rc, results = self.run_query('standby')
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get standby replay info."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+        cols = results.split('|')
+        lagsecs      = int(cols[0])
+        lagbytes     = int(cols[1])
+        paused       = cols[2] == 't'
+        receiver     = cols[3]
+        receiversecs = int(cols[4])
+
+        rc, results = self.run_query('standby.conflicts')
+        if rc != SUCCESS:
+            errors = "[ERROR] Unable to get recovery conflicts."
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+        # [tablespace, lock, snapshot, bufferpin, deadlock]
+        conflicts = [int(acol) for acol in results.split('|')]
+        now  = int(self.now())
+        prev = self.state.get('standby', {})
+        self.state['standby'] = {'ts': now, 'conflicts': conflicts}
+        perhour = None
+        deltas  = [0] * 5
+        if 'ts' in prev and now > prev['ts'] and sum(conflicts) >= sum(prev['conflicts']):
+            deltas  = [conflicts[i] - prev['conflicts'][i] for i in range(5)]
+            perhour = sum(deltas) * 3600.0 / (now - prev['ts'])
+
+        if lagsecs > -1:
+            self.record('standby.replaylagsecs', lagsecs)
+        self.record('standby.replaylagbytes', lagbytes)
+        self.record('standby.conflicts_per_hour', perhour)
+
+        problems = []
+        maxlagsecs = self.get_setting('standby', 'maxlagsecs')
+        if self.get_setting('standby', 'streaming') and receiver != 'streaming':
+            problems.append("WAL receiver is %s, not streaming from the primary." % receiver)
+        if paused:
+            problems.append("WAL replay is paused.")
+        if lagsecs > maxlagsecs:
+            problems.append("Replay lag is %d seconds with %s received but not replayed yet." % (lagsecs, self.convert_bytes_to_humanfriendly(lagbytes)))
+        if perhour is not None and perhour > self.get_setting('standby', 'conflictsperhour'):
+            problems.append("Recovery conflicts cancelled %.1f queries/hour: tablespace=%d lock=%d snapshot=%d bufferpin=%d deadlock=%d.  Consider hot_standby_feedback or max_standby_streaming_delay." \
+                            % (perhour, deltas[0], deltas[1], deltas[2], deltas[3], deltas[4]))
+
+        lag = "%d seconds" % lagsecs if lagsecs > -1 else "N/A (nothing replayed yet)"
+        if len(problems) == 0:
+            marker = MARK_OK
+            msg = "Standby is %s, replay lag %s, last message from the primary %d seconds ago." % (receiver, lag, receiversecs)
+        else:
+            marker = MARK_WARN
+            msg = "Standby problems detected (replay lag %s):" % lag
+            for problem in problems:
+                msg += "\n        " + problem
+            subject = "Standby problems detected: " + problems[0]
+            if self.alert(REPLICATION):
+                rc = self.send_alert(self.to, self.from_, subject, '')
+        self.emit(marker, msg)
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_pglog(self):
         #############################################
         ### Check for PG Warnings/Errors from its log
         #############################################
@@ -1770,151 +4558,158 @@ class maint:
             if self.logdir[0] != '/':
                 self.logdir = self.datadir + '/' + self.logdir
             #print ("datadir=%s  logdir=%s" % (self.datadir, self.logdir))
+        return SUCCESS, ""
 
-
-
-
+    ###########################################################
+    def check_pgbouncer(self):
         #######################################
         ### Check for PGBouncer Warnings/Errors
         #######################################
-        if self.checkpgbouncer:
-            # see if pgbouncer is running
-            #ps -ef | grep pgbouncer | grep 'pgbouncer.ini' | grep -v '\-\-color=auto' |  awk '{ print $2 }'
-            cmd = "ps -ef | grep pgbouncer | grep 'pgbouncer.ini' | grep -v 'grep' |  awk '{ print $2 }'"
-            rc, results = self.executecmd(cmd, True)
-            if rc != SUCCESS:
-                errors = "%s\n" % (results)
-                aline = "%s" % (errors)
-                self.writeout(aline)
-                return rc, errors
-            pid = results.strip()
-            if pid.isnumeric():
-                marker = MARK_OK
-                msg = 'PGBouncer is running.'
-            else:
-                marker = MARK_WARN
-                subject = "PGBouncer is not running"
-                msg = "PGBouncer is not running"
-                if self.alert(PGBOUNCER1):
-                    rc = self.send_alert(self.to, self.from_, subject, msg)
-            print (marker+msg)
+        if not self.checkpgbouncer:
+            return SUCCESS, ""
 
-            # requires execute, read permissions on the pgbouncer log file
-            #2023-12-17 03:21:46.320 EST [16494] WARNING C-0x124c458: table_management/pgappuser@unix(16494):6432 pooler error: client_login_timeout (server down)
-            #2023-12-19 06:56:08.976 EST [14799] WARNING C-0x180d3e0: (nodb)/(nouser)@10.2.220.218:42172 unsupported startup parameter: replication=true
-            logfile = '/var/log/pgbouncer/pgbouncer.log'
-            cmd = "grep 'WARNING' " + logfile + " | tail -1"
-            rc, results = self.executecmd(cmd, True)
-            if rc != SUCCESS:
-                errors = "%s\n" % (results)
-                aline = "%s" % (errors)
-                self.writeout(aline)
-                return rc, errors
+        # see if pgbouncer is running
+        #ps -ef | grep pgbouncer | grep 'pgbouncer.ini' | grep -v '\-\-color=auto' |  awk '{ print $2 }'
+        cmd = "ps -ef | grep pgbouncer | grep 'pgbouncer.ini' | grep -v 'grep' |  awk '{ print $2 }'"
+        rc, results = self.executecmd(cmd, True)
+        if rc != SUCCESS:
+            errors = "%s\n" % (results)
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+        pid = results.strip()
+        if pid.isnumeric():
+            marker = MARK_OK
+            msg = 'PGBouncer is running.'
+        else:
+            marker = MARK_WARN
+            subject = "PGBouncer is not running"
+            msg = "PGBouncer is not running"
+            if self.alert(PGBOUNCER1):
+                rc = self.send_alert(self.to, self.from_, subject, msg)
+        self.emit(marker, msg)
+
+        # requires execute, read permissions on the pgbouncer log file
+        #2023-12-17 03:21:46.320 EST [16494] WARNING C-0x124c458: table_management/pgappuser@unix(16494):6432 pooler error: client_login_timeout (server down)
+        #2023-12-19 06:56:08.976 EST [14799] WARNING C-0x180d3e0: (nodb)/(nouser)@10.2.220.218:42172 unsupported startup parameter: replication=true
+        logfile = self.get_setting('pgbouncer', 'logfile')
+        cmd = "grep 'WARNING' " + logfile + " | tail -1"
+        rc, results = self.executecmd(cmd, True)
+        if rc != SUCCESS:
+            errors = "%s\n" % (results)
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
 
+        #print("pgbouncer results: %s" % results)
+        ##### uncomment the following and change date to current time + 1 minute to test the warning
+        #####results = "2023-12-20 17:55:01.449 EST [3471] WARNING C-0x12a3230: (nodb)/dynatracereadonly@127.0.0.1:49738 pooler error: no such database: eventstore"
+        parsed = results.split('EST')
+        adatetimestr = parsed[0].strip()
+        # chop off the microseconds
+        adatetimestr = adatetimestr[:-4]
+
+        # fake a warning
+        #adatetimestr="2023-12-19 08:30:00"
+        #print("adatetimestr=%s" % adatetimestr)
+        adatetimeobj = datetime.strptime(adatetimestr, "%Y-%m-%d %H:%M:%S")
+        msg = parsed[1].strip()
+        # check for  password authentication failed messages and ignore
+        if 'password authentication failed' in msg:
+            # we ignore these bad password warnings
+            marker = MARK_OK
+            msg = 'No PGBouncer Warnings Found.'
+            self.emit(marker, msg)
+        else:
+            dt1 = self.clock()
+            diff = dt1 - adatetimeobj
+            secs = diff.seconds
+            # Assuming this program runs every minute, alert if a warning happened in the last 2 minutes
             #print("pgbouncer results: %s" % results)
-            ##### uncomment the following and change date to current time + 1 minute to test the warning
-            #####results = "2023-12-20 17:55:01.449 EST [3471] WARNING C-0x12a3230: (nodb)/dynatracereadonly@127.0.0.1:49738 pooler error: no such database: eventstore"
-            parsed = results.split('EST')
-            adatetimestr = parsed[0].strip()
-            # chop off the microseconds
-            adatetimestr = adatetimestr[:-4]
-
-            # fake a warning
-            #adatetimestr="2023-12-19 08:30:00"
-            #print("adatetimestr=%s" % adatetimestr)
-            adatetimeobj = datetime.strptime(adatetimestr, "%Y-%m-%d %H:%M:%S")
-            msg = parsed[1].strip()
-            # check for  password authentication failed messages and ignore
-            if 'password authentication failed' in msg:
-                # we ignore these bad password warnings
-                marker = MARK_OK
-                msg = 'No PGBouncer Warnings Found.'
-                print (marker+msg)
-            else:
-                dt1 = datetime.now()
-                diff = dt1 - adatetimeobj
-                secs = diff.seconds
-                # Assuming this program runs every minute, alert if a warning happened in the last 2 minutes
-                #print("pgbouncer results: %s" % results)
-                #print ("secs=%d" % (secs))
-                if secs < 120:
-                    marker = MARK_WARN
-                    subject = "PGBouncer Warning"
-                    #if self.alert(PGBOUNCER2):
-                    rc = self.send_alert(self.to, self.from_, subject, results)
-                else:
-                    marker = MARK_OK
-                    msg = 'No PGBouncer Warnings Found.'
-                print (marker+msg)
-
-            # now start checking PGBouncer show commands assuming they are available through PG as external views
-            cmd = "psql -At -h localhost -d dxpcore -U pgbouncer -p 6432 -c \"select count(*) from pgbouncer.pools where database <> 'pgbouncer' and cl_waiting > 0\""
-            rc, results = self.executecmd(cmd, True)
-            if rc != SUCCESS:
-                errors = "%s\n" % (results)
-                aline = "%s" % (errors)
-                self.writeout(aline)
-                return rc, errors
-
-            waits = int(results)
-            if waits > 0:
+            #print ("secs=%d" % (secs))
+            if secs < self.get_setting('pgbouncer', 'warnsecs'):
                 marker = MARK_WARN
                 subject = "PGBouncer Warning"
-                msg = "Clients waiting for connections (%d)" % waits
-                if self.alert(PGBOUNCER3):
-                    rc = self.send_alert(self.to, self.from_, subject, msg)
+                if self.alert(PGBOUNCER2):
+                    rc = self.send_alert(self.to, self.from_, subject, results)
             else:
                 marker = MARK_OK
-                msg = 'No PGBouncer clients waiting for PG connections.'
-            print (marker+msg)
+                msg = 'No PGBouncer Warnings Found.'
+            self.emit(marker, msg)
 
-            #Show free clients and servers that are close to zero.
-            #select count(*) free_clients from pgbouncer.lists where list = 'free_clients' and items < 5;
-            #select count(*) free_servers from pgbouncer.lists where list = 'free_servers' and items < 5;
-            #Show caches that are low in free memory.
-            #select name, size, free, round(round((free/size::decimal)::decimal,2) * 100) percent_free from pgbouncer.mem where  round(round((free/size::decimal)::decimal,2) * 100) < 10;
+        # now start checking PGBouncer show commands assuming they are available through PG as external views
+        cmd = "psql -At -h localhost -d dxpcore -U pgbouncer -p 6432 -c \"select count(*) from pgbouncer.pools where database <> 'pgbouncer' and cl_waiting > 0\""
+        rc, results = self.executecmd(cmd, True, False)
+        if rc != SUCCESS:
+            errors = "%s\n" % (results)
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
 
+        waits = int(results)
+        self.record('pgbouncer.waiting', waits)
+        if waits > 0:
+            marker = MARK_WARN
+            subject = "PGBouncer Warning"
+            msg = "Clients waiting for connections (%d)" % waits
+            if self.alert(PGBOUNCER3):
+                rc = self.send_alert(self.to, self.from_, subject, msg)
+        else:
+            marker = MARK_OK
+            msg = 'No PGBouncer clients waiting for PG connections.'
+        self.emit(marker, msg)
+
+        #Show free clients and servers that are close to zero.
+        #select count(*) free_clients from pgbouncer.lists where list = 'free_clients' and items < 5;
+        #select count(*) free_servers from pgbouncer.lists where list = 'free_servers' and items < 5;
+        #Show caches that are low in free memory.
+        #select name, size, free, round(round((free/size::decimal)::decimal,2) * 100) percent_free from pgbouncer.mem where  round(round((free/size::decimal)::decimal,2) * 100) < 10;
+        return SUCCESS, ""
 
+    ###########################################################
+    def check_pgbackrest(self):
         ###############################
         ### Check for PGBackrest Errors
         ###############################
-        if self.checkpgbackrest:
-            # check repo's last line in the log file.  /var/log/pgbackrest/certship-backup.log
-            # It should be something like this:
-            #2023-12-19 02:00:22.027 P00   INFO: backup command end: completed successfully (20837ms)
-
-            # also check output from pgbackrest info command to see date of last backup to see if was yesterday or today
-            #pgbackrest info | grep 'timestamp start/stop' | tail -1 | awk '{ print $3 }' --> 2023-12-19
-            cmd = "pgbackrest info | grep 'timestamp start/stop' | tail -1 | awk '{ print $3 }'"
-            rc, results = self.executecmd(cmd, True)
-            if rc != SUCCESS:
-                errors = "%s\n" % (results)
-                aline = "%s" % (errors)
-                self.writeout(aline)
-                return rc, errors
+        if not self.checkpgbackrest:
+            return SUCCESS, ""
 
-            #print("pgbackrest results = %s" % results)
-            # consider old if older than 2 days
-            if datetime.strptime(results, "%Y-%m-%d") + timedelta(days=2) < datetime.today():
-                marker = MARK_WARN
-                subject = "PGBackrest Warning"
-                msg = "Last backup is older than 2 days (%s) " % results
-
-                # get additional details
-                #ssh Q-LAB-PG-BACKUP "tail -n 7 /var/log/pgbackrest/certship-backup.log"
-                #ssh Q-LAB-PG-BACKUP "grep -A7 'PROCESS START' /var/log/pgbackrest/certship-backup.log | tail -7"
-                cmd = "ssh Q-LAB-PG-BACKUP \"grep -A7 'PROCESS START' /var/log/pgbackrest/certship-backup.log | tail -7\""
-                rc, results = self.executecmd(cmd, True)
-                if rc == SUCCESS:
-                    msg = msg + "\n" + results
-                if self.alert(PGBACKREST1):
-                    rc = self.send_alert(self.to, self.from_, subject, msg)
-            else:
-                marker = MARK_OK
-                msg = 'Latest PGBackrest date is less than 2 days old: %s' % results
-            print (marker+msg)
+        # check repo's last line in the log file.  /var/log/pgbackrest/certship-backup.log
+        # It should be something like this:
+        #2023-12-19 02:00:22.027 P00   INFO: backup command end: completed successfully (20837ms)
 
+        # also check output from pgbackrest info command to see date of last backup to see if was yesterday or today
+        #pgbackrest info | grep 'timestamp start/stop' | tail -1 | awk '{ print $3 }' --> 2023-12-19
+        cmd = "pgbackrest info | grep 'timestamp start/stop' | tail -1 | awk '{ print $3 }'"
+        rc, results = self.executecmd(cmd, True)
+        if rc != SUCCESS:
+            errors = "%s\n" % (results)
+            aline = "%s" % (errors)
+            self.writeout(aline)
+            return rc, errors
+
+        #print("pgbackrest results = %s" % results)
+        # consider old if older than 2 days by default
+        maxagedays = self.get_setting('pgbackrest', 'maxagedays')
+        self.record('pgbackrest.agedays', (self.clock() - datetime.strptime(results, "%Y-%m-%d")).days)
+        if datetime.strptime(results, "%Y-%m-%d") + timedelta(days=maxagedays) < self.clock():
+            marker = MARK_WARN
+            subject = "PGBackrest Warning"
+            msg = "Last backup is older than %d days (%s) " % (maxagedays, results)
 
+            # get additional details
+            #ssh Q-LAB-PG-BACKUP "tail -n 7 /var/log/pgbackrest/certship-backup.log"
+            #ssh Q-LAB-PG-BACKUP "grep -A7 'PROCESS START' /var/log/pgbackrest/certship-backup.log | tail -7"
+            cmd = "ssh Q-LAB-PG-BACKUP \"grep -A7 'PROCESS START' /var/log/pgbackrest/certship-backup.log | tail -7\""
+            rc, results = self.executecmd(cmd, True)
+            if rc == SUCCESS:
+                msg = msg + "\n" + results
+            if self.alert(PGBACKREST1):
+                rc = self.send_alert(self.to, self.from_, subject, msg)
+        else:
+            marker = MARK_OK
+            msg = 'Latest PGBackrest date is less than %d days old: %s' % (maxagedays, results)
+        self.emit(marker, msg)
         return SUCCESS, ""
 
 
@@ -1949,6 +4744,18 @@ def setupOptionParser():
     parser.add_option("-r", "--checkreplication", dest="checkreplication", help="Check Replication",            default=False, action="store_true")
     parser.add_option("-x", "--checkpgbouncer",   dest="checkpgbouncer",   help="Check PGBouncer",              default=False, action="store_true")
     parser.add_option("-y", "--checkpgbackrest",  dest="checkpgbackrest",  help="Check PGBackrest",             default=False, action="store_true")
+    parser.add_option("-f", "--configfile",       dest="configfile",       help="check registry config file",   default="",metavar="CONFIGFILE")
+    parser.add_option("--since",                  dest="since",            help="query: start of time range",   default="1d",metavar="SINCE")
+    parser.add_option("--until",                  dest="until",            help="query: end of time range",     default="now",metavar="UNTIL")
+    parser.add_option("--rollup",                 dest="rollup",           help="query: raw, 1m or 1h",         default="",metavar="ROLLUP")
+    parser.add_option("-a", "--adaptive",         dest="adaptive",         help="Defer expensive checks under pressure", default=False, action="store_true")
+    parser.add_option("--validate-catalog",       dest="validatecatalog",  help="EXPLAIN all catalog queries and exit", default=False, action="store_true")
+    parser.add_option("--interval",               dest="interval", type=int, help="run every INTERVAL seconds until killed", default=0,metavar="INTERVAL")
+    parser.add_option("--format",                 dest="outformat",        help="output format: text, json or ndjson", default="text",metavar="FORMAT")
+    parser.add_option("--all-databases",          dest="alldatabases",     help="run the per database checks in every database", default=False, action="store_true")
+    parser.add_option("--jobs",                   dest="jobs", type=int,   help="--all-databases: databases checked in parallel", default=0,metavar="JOBS")
+    parser.add_option("--capture",                dest="capture",          help="record every probe result to FILE", default="",metavar="FILE")
+    parser.add_option("--replay",                 dest="replay",           help="run the checks against recorded FILE[,FILE...]", default="",metavar="FILE")
 
 
     return parser
@@ -1958,32 +4765,67 @@ def setupOptionParser():
 #################################################################
 #################### MAIN ENTRY POINT ###########################
 #############################################@###################
+# runs as a script, the module can also be imported (tests)
+if __name__ == '__main__':
+    optionParser   = setupOptionParser()
+    (options,args) = optionParser.parse_args()
 
-optionParser   = setupOptionParser()
-(options,args) = optionParser.parse_args()
+    # load the instance
+    pg = maint()
 
-# load the instance
-pg = maint()
+    # query subcommand works from the local check history only, so no PG connection is needed
+    if len(args) > 0 and args[0] == 'query':
+        rc, errors = pg.query_history(options.dbhost, options.dbport, options.database, args[1:], options.since, options.until, options.rollup)
+        if rc != SUCCESS:
+            print (errors)
+            sys.exit(1)
+        sys.exit(0)
+
+    # Load and validate parameters
+    rc, errors = pg.set_dbinfo(options.dbhost, options.dbport, options.dbuser, options.database, options.schema, \
+                               options.genchecks, options.waitslocks, options.longquerymins, options.idleintransmins, \
+                               options.idleconnmins,  options.cpus, options.environment, options.testmode, options.verbose, \
+                               options.debug, options.slacknotify, options.mailnotify, options.checkreplication, options.checkpgbouncer, options.checkpgbackrest, options.configfile, options.adaptive, options.outformat, options.interval, \
+                               options.alldatabases, options.jobs, options.capture, options.replay, sys.argv)
+    if rc != SUCCESS:
+        pg.writeout(errors)
+        pg.cleanup()
+        #optionParser.print_help()
+        sys.exit(1)
+
+    if options.validatecatalog:
+        rc, errors = pg.validate_catalog()
+        pg.cleanup()
+        if rc != SUCCESS:
+            pg.writeout(errors)
+            sys.exit(1)
+        sys.exit(0)
 
-# Load and validate parameters
-rc, errors = pg.set_dbinfo(options.dbhost, options.dbport, options.dbuser, options.database, options.schema, \
-                           options.genchecks, options.waitslocks, options.longquerymins, options.idleintransmins, \
-                           options.idleconnmins,  options.cpus, options.environment, options.testmode, options.verbose, \
-                           options.debug, options.slacknotify, options.mailnotify, options.checkreplication, options.checkpgbouncer, options.checkpgbackrest, sys.argv)
-if rc != SUCCESS:
-    print (errors)
-    pg.cleanup()
-    #optionParser.print_help()
-    sys.exit(1)
+    #print ("globals=%s" % globals())
+    #print ("locals=%s" % locals())
 
-#print ("globals=%s" % globals())
-#print ("locals=%s" % locals())
+    if options.replay == '':
+        rc, results = pg.do_report()
+    while options.interval > 0:
+        # daemon mode: the catalog probes keep one psql session with their statements prepared across cycles
+        try:
+            time.sleep(max(pg.timestart + options.interval - pg.now(), 0))
+        except KeyboardInterrupt:
+            break
+        pg.next_cycle()
+        # every cycle starts with the PG host up check, which also catches a standby promoted since the last cycle
+        rc, results = pg.start_run()
+        if rc == SUCCESS:
+            rc, results = pg.do_report()
+    while pg.next_replay():
+        # every recorded run starts like a fresh one, including the PG host up check
+        rc, results = pg.start_run()
+        if rc == SUCCESS:
+            rc, results = pg.do_report()
+    if rc < SUCCESS:
+        pg.cleanup()
+        sys.exit(1)
 
-rc, results = pg.do_report()
-if rc < SUCCESS:
     pg.cleanup()
-    sys.exit(1)
-
-pg.cleanup()
 
-sys.exit(0)
+    sys.exit(0)
@@ -0,0 +1,32 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pg_check
+
+
+@pytest.fixture
+def pg(tmp_path):
+    # a maint instance as set_dbinfo() leaves it, without a server: state, history and alert log go to tmp_path
+    pg = pg_check.maint()
+    pg.programdir     = str(tmp_path)
+    pg.dbport         = '5432'
+    pg.database       = 'mydb'
+    pg.environment    = 'PROD'
+    pg.pgversionmajor = pg_check.Decimal('16')
+    pg.pgversionminor = '16.1'
+    pg.queries        = pg.resolve_queries(pg.pgversionmajor)
+    return pg
+
+
+@pytest.fixture
+def config(pg, tmp_path):
+    # writes a config file and loads it the way -f does
+    def load(text):
+        afile = tmp_path / 'pg_check.conf'
+        afile.write_text(text)
+        pg.configfile = str(afile)
+        return pg.load_config()
+    return load
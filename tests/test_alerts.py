@@ -0,0 +1,164 @@
+import json
+
+import pytest
+
+from pg_check import SUCCESS, WAITS, ACTIVECONNS
+
+
+@pytest.fixture
+def spool(pg, config, tmp_path):
+    # every notification ends up in a spool file, one json event per line
+    path = tmp_path / 'alerts.json'
+    config("[alerts]\nbreaches = 2\nclears = 2\nrenotify = 900,3600\n[notifier.spool]\ntype = spool\npath = %s\n" % path)
+    assert pg.load_notifiers() == (SUCCESS, '')
+    pg.load_state()
+
+    def events():
+        if not path.exists():
+            return []
+        return [json.loads(aline) for aline in path.read_text().splitlines()]
+    return events
+
+
+def run(pg, checkid, alerttype=None):
+    # one run of a check that breaches alerttype, or is clean when it is None
+    pg.start_check(checkid)
+    notify = False
+    if alerttype is not None:
+        notify = pg.alert(alerttype)
+        if notify:
+            pg.send_alert(pg.to, pg.from_, 'subject', 'body')
+    pg.end_check(SUCCESS, '')
+    return notify
+
+
+def test_pending_firing_resolved(pg, spool):
+    assert not run(pg, 'waits', WAITS)
+    assert pg.state['alerts']['waits:Waits']['status'] == 'PENDING'
+    assert run(pg, 'waits', WAITS)
+    assert pg.state['alerts']['waits:Waits']['status'] == 'FIRING'
+    # renotify wait not reached yet
+    assert not run(pg, 'waits', WAITS)
+
+    run(pg, 'waits')
+    assert pg.state['alerts']['waits:Waits']['clears'] == 1
+    run(pg, 'waits')
+    assert 'waits:Waits' not in pg.state['alerts']
+
+    events = spool()
+    assert [event['status'] for event in events] == ['firing', 'resolved']
+    assert events[1]['type'] == WAITS
+    assert events[1]['subject'].startswith('Resolved:')
+
+
+def test_pending_clears_silently(pg, spool):
+    run(pg, 'waits', WAITS)
+    run(pg, 'waits')
+    assert pg.state['alerts'] == {}
+    assert spool() == []
+
+
+def test_breach_resets_clears(pg, spool):
+    run(pg, 'waits', WAITS)
+    run(pg, 'waits', WAITS)
+    run(pg, 'waits')
+    run(pg, 'waits', WAITS)
+    assert pg.state['alerts']['waits:Waits']['clears'] == 0
+    run(pg, 'waits')
+    assert 'waits:Waits' in pg.state['alerts']
+
+
+def test_renotify(pg, spool):
+    run(pg, 'waits', WAITS)
+    run(pg, 'waits', WAITS)
+    pg.state['alerts']['waits:Waits']['notified'] -= 901
+    assert run(pg, 'waits', WAITS)
+    # the second interval applies after the second notification
+    pg.state['alerts']['waits:Waits']['notified'] -= 901
+    assert not run(pg, 'waits', WAITS)
+    pg.state['alerts']['waits:Waits']['notified'] -= 3600
+    assert run(pg, 'waits', WAITS)
+    assert pg.state['alerts']['waits:Waits']['notifies'] == 3
+
+
+def test_one_breach_per_check_run(pg, spool):
+    pg.start_check('waits')
+    assert not pg.alert(WAITS)
+    assert not pg.alert(WAITS)
+    pg.end_check(SUCCESS, '')
+    assert pg.state['alerts']['waits:Waits']['breaches'] == 1
+
+
+def test_alerts_kept_per_check(pg, spool):
+    # two checks raising the same alert type neither add up their breaches nor clear each other
+    run(pg, 'activeconns', ACTIVECONNS)
+    run(pg, 'waitprofile', ACTIVECONNS)
+    assert pg.state['alerts']['activeconns:ActiveConns']['status'] == 'PENDING'
+    assert pg.state['alerts']['waitprofile:ActiveConns']['status'] == 'PENDING'
+    run(pg, 'activeconns', ACTIVECONNS)
+    run(pg, 'waitprofile')
+    assert pg.state['alerts']['activeconns:ActiveConns']['status'] == 'FIRING'
+    assert 'waitprofile:ActiveConns' not in pg.state['alerts']
+
+
+def test_alerts_survive_state_file(pg, spool):
+    run(pg, 'waits', WAITS)
+    pg.save_state()
+    pg.state = {'lastrun': {}}
+    pg.load_state()
+    assert run(pg, 'waits', WAITS)
+
+
+def test_resolved_status_when_sweeping(pg, spool):
+    # --all-databases prefixes the database to the subject, which must not turn a resolution into a new incident
+    pg.sweeping = True
+    run(pg, 'waits', WAITS)
+    run(pg, 'waits', WAITS)
+    run(pg, 'waits')
+    run(pg, 'waits')
+    events = spool()
+    assert [event['status'] for event in events] == ['firing', 'resolved']
+    assert events[1]['subject'].startswith('mydb: Resolved:')
+
+
+def test_resolved_notifications_off(pg, spool, config, tmp_path):
+    config("[alerts]\nresolved = off\n[notifier.spool]\ntype = spool\npath = %s\n" % (tmp_path / 'alerts.json'))
+    run(pg, 'waits', WAITS)
+    run(pg, 'waits', WAITS)
+    run(pg, 'waits')
+    run(pg, 'waits')
+    assert [event['status'] for event in spool()] == ['firing']
+
+
+def test_alert_log(pg, spool, tmp_path):
+    run(pg, 'waits', WAITS)
+    run(pg, 'waits', WAITS)
+    lines = (tmp_path / 'pg_check.alerts').read_text().splitlines()
+    assert len(lines) == 1 and lines[0].endswith('*' + WAITS)
+
+
+def test_resolved_send_retried(pg, spool, monkeypatch):
+    run(pg, 'waits', WAITS)
+    run(pg, 'waits', WAITS)
+    run(pg, 'waits')
+    # the notifier is down when the alert resolves: it stays RESOLVING and is sent again on the next clean run
+    monkeypatch.setattr(pg.notifiers[0], 'send', lambda event: 1)
+    run(pg, 'waits')
+    assert pg.state['alerts']['waits:Waits']['status'] == 'RESOLVING'
+    assert [event['status'] for event in spool()] == ['firing']
+    monkeypatch.undo()
+    run(pg, 'waits')
+    assert 'waits:Waits' not in pg.state['alerts']
+    assert [event['status'] for event in spool()] == ['firing', 'resolved']
+
+
+def test_breach_while_resolving(pg, spool, monkeypatch):
+    run(pg, 'waits', WAITS)
+    run(pg, 'waits', WAITS)
+    monkeypatch.setattr(pg.notifiers[0], 'send', lambda event: 1)
+    run(pg, 'waits')
+    run(pg, 'waits')
+    assert pg.state['alerts']['waits:Waits']['status'] == 'RESOLVING'
+    run(pg, 'waits', WAITS)
+    assert pg.state['alerts']['waits:Waits']['status'] == 'FIRING'
+    assert pg.state['alerts']['waits:Waits']['clears'] == 0
@@ -0,0 +1,33 @@
+import json
+
+import pg_check
+from pg_check import SUCCESS
+
+
+def test_sweep_keeps_main_database_state(pg, monkeypatch, tmp_path):
+    # the sweep includes the -d database, whose state file is the main run's
+    pg.alldatabases = True
+    pg.tempdir      = str(tmp_path)
+    pg.dir_delim    = '/'
+    pg.load_state()
+    pg.state['lastrun']['connections'] = 1
+    monkeypatch.setattr(pg, 'executecmd', lambda cmd, expect: (SUCCESS, 'mydb|5\nother|5'))
+
+    def run_checks(self, checkids):
+        self.state['lastrun']['sequences'] = 2
+        self.state.setdefault('samples', []).append(self.database)
+        return SUCCESS, ''
+    monkeypatch.setattr(pg_check.maint, 'run_checks', run_checks)
+    monkeypatch.setattr(pg_check.maint, 'prefetch', lambda self, checkids: None)
+    monkeypatch.setattr(pg_check.maint, 'flush_history', lambda self: None)
+
+    for run in (1, 2):
+        pg.start_check('alldatabases')
+        assert pg.sweep_databases() == (SUCCESS, '')
+        pg.save_state()
+
+    mydb  = json.loads((tmp_path / 'pg_check_local_5432_mydb.state').read_text())
+    other = json.loads((tmp_path / 'pg_check_local_5432_other.state').read_text())
+    assert mydb['lastrun'] == {'connections': 1, 'sequences': 2}
+    assert mydb['samples'] == ['mydb', 'mydb']
+    assert other['samples'] == ['other', 'other']
@@ -0,0 +1,118 @@
+# The query catalog and the SQL checks run inline, against every supported PG major version: each version a check runs on
+# resolves every probe of the check to exactly one variant, and no query uses a catalog column, view or function the
+# version does not have.  The server is never needed, so this runs wherever the tests do.
+import ast
+import inspect
+import re
+import textwrap
+
+import pytest
+
+import pg_check
+from pg_check import Decimal, QUERIES, CHECKS, SUPPORTED
+
+# catalog features by the PG major versions that have them: (first, last), '' means open ended
+FEATURES = {
+    r'\bprocpid\b|\bcurrent_query\b':                                 ('', '9.1'),
+    r'\bwaiting\b':                                                   ('', '9.5'),
+    r'\bxlog\b|_xlog_|pg_xlog':                                       ('', '9.6'),
+    r'\bTABLESAMPLE\b':                                               ('9.5', ''),
+    r'\bwait_event(_type)?\b':                                        ('9.6', ''),
+    r'\bpg_stat_progress_vacuum\b|\bpg_stat_wal_receiver\b':          ('9.6', ''),
+    r'\bpg_size_bytes\b':                                             ('9.6', ''),
+    r'\bbackend_type\b':                                              ('10', ''),
+    r'\bpg_current_wal_lsn\b|\bpg_last_wal_\w+|\bpg_wal_lsn_diff\b':  ('10', ''),
+    r'\bpg_is_wal_replay_paused\b':                                   ('10', ''),
+    r'\bpg_sequence\b':                                               ('10', ''),
+    r'\bpg_stat_wal\b|\bsessions_abandoned\b|\bsession_time\b':       ('14', ''),
+    r'\bpg_stat_io\b':                                                ('16', ''),
+    r'\bpg_stat_checkpointer\b|\bnum_timed\b|\bnum_requested\b':      ('17', ''),
+}
+
+
+def in_range(version, minver, maxver):
+    return (minver == '' or version >= Decimal(minver)) and (maxver == '' or version <= Decimal(maxver))
+
+
+def applies(checkid, version):
+    meta = CHECKS[checkid]
+    return in_range(version, meta['minver'], meta['maxver'])
+
+
+def unsupported(sql, version):
+    return [pattern for pattern, (first, last) in FEATURES.items() if re.search(pattern, sql, re.I) and not in_range(version, first, last)]
+
+
+def check_sql(method):
+    # SQL string literals of a check method, leaving out comments and docstrings and anything under an
+    # if on the server version, which picks the query for the version itself
+    found = []
+
+    def visit(node, guarded):
+        if isinstance(node, ast.If) and 'pgversionmajor' in ast.dump(node.test):
+            guarded = True
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant):
+            return
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and not guarded and re.search(r'\b(select|from)\b', node.value, re.I):
+            found.append(node.value)
+        for child in ast.iter_child_nodes(node):
+            visit(child, guarded)
+    visit(ast.parse(textwrap.dedent(inspect.getsource(method))), False)
+    return found
+
+
+@pytest.mark.parametrize('aversion', SUPPORTED)
+def test_catalog_resolves(pg, aversion):
+    version = Decimal(aversion)
+    queries = pg.resolve_queries(version)
+    for name, variants in QUERIES.items():
+        checkid = name.split('.')[0]
+        assert checkid in CHECKS, name
+        matches = [sql for minver, maxver, sql in variants if in_range(version, minver, maxver)]
+        assert len(matches) <= 1, "%s has overlapping variants for PG %s" % (name, aversion)
+        if applies(checkid, version):
+            assert queries[name] is not None, "%s has no variant for PG %s, where the %s check runs" % (name, aversion, checkid)
+
+
+@pytest.mark.parametrize('aversion', SUPPORTED)
+def test_catalog_features(pg, aversion):
+    version = Decimal(aversion)
+    for name, sql in pg.resolve_queries(version).items():
+        if sql is None or not applies(name.split('.')[0], version):
+            continue
+        assert unsupported(sql, version) == [], "%s resolved for PG %s" % (name, aversion)
+
+
+def test_catalog_params():
+    # queries with params are formatted with them, so a literal % is %%, while a query without params is sent as is
+    for name, variants in QUERIES.items():
+        for minver, maxver, sql in variants:
+            conversions = re.findall(r'%([ds])', sql.replace('%%', ''))
+            if len(conversions) == 0:
+                assert '%%' not in sql, name
+                continue
+            sql % tuple(1 if conversion == 'd' else '' for conversion in conversions)
+
+
+@pytest.mark.parametrize('aversion', SUPPORTED)
+def test_bgwriter_buffers(pg, aversion):
+    # buffers written by checkpoints, the background writer and backends, each counted once
+    sql = pg.resolve_queries(Decimal(aversion))['bgwriter.buffers']
+    terms = [aterm.strip() for aterm in re.match(r'select (.*) as buffers from', sql).group(1).split(' + ')]
+    assert len(terms) == 3 and len(set(terms)) == 3, sql
+
+
+def test_batch_probes():
+    for name in pg_check.BATCH:
+        assert name in QUERIES
+
+
+@pytest.mark.parametrize('aversion', SUPPORTED)
+def test_check_sql_features(aversion):
+    version = Decimal(aversion)
+    for checkid in CHECKS:
+        method = getattr(pg_check.maint, 'check_' + checkid, None)
+        if method is None or not applies(checkid, version):
+            continue
+        for sql in check_sql(method):
+            assert unsupported(sql, version) == [], "check_%s on PG %s: %s" % (checkid, aversion, sql[:80])
@@ -0,0 +1,78 @@
+import re
+import time
+
+from pg_check import SUCCESS
+
+
+def sample(pg, monkeypatch, rows, details='16500|public.orders|4|100\n16501|public.events|3|90'):
+    # one run of the hotspots check against canned pg_stat_user_tables counters
+    def executecmd(cmd, expect):
+        if 'pg_stat_user_tables' in cmd:
+            return SUCCESS, '\n'.join('|'.join(str(acol) for acol in row) for row in rows)
+        return SUCCESS, details
+    monkeypatch.setattr(pg, 'executecmd', executecmd)
+    pg.start_check('hotspots')
+    assert pg.check_hotspots() == (SUCCESS, '')
+    return '\n'.join(msg for marker, msg in pg.checkout)
+
+
+def test_ranked_by_interval_deltas(pg, monkeypatch):
+    pg.outformat = 'json'
+    # relid, seq_scan, seq_tup_read, idx_scan, n_tup_ins, n_tup_upd, n_tup_hot_upd, n_tup_del, n_live_tup
+    old = [16500, 10, 1000, 0, 0, 0, 0, 0, 500000], [16503, 9000, 10 ** 12, 0, 0, 0, 0, 0, 500000]
+    assert 'baseline' in sample(pg, monkeypatch, old)
+    pg.state['hotspots']['ts'] -= 60
+    # 16503 has the largest lifetime counters but was idle since the last run
+    new = [16500, 60, 6001000, 0, 0, 0, 0, 0, 500000], [16503, 9000, 10 ** 12, 0, 0, 0, 0, 0, 500000]
+    msg = sample(pg, monkeypatch, new)
+    assert 'public.orders: 6000000 rows/min read by 50 sequential scans' in msg
+    assert '16503' not in msg
+
+
+def test_no_updates_with_zero_threshold(pg, monkeypatch, config):
+    config("[hotspots]\nupdpermin = 0\n")
+    pg.outformat = 'json'
+    rows = [[16500, 1, 1, 1, 0, 0, 0, 0, 10], [16501, 1, 1, 1, 10, 100, 0, 0, 10]]
+    sample(pg, monkeypatch, rows)
+    pg.state['hotspots']['ts'] -= 60
+    rows[1][5] += 100
+    msg = sample(pg, monkeypatch, rows)
+    assert 'public.events: 0% HOT of 100 updates/min, fillfactor=90, 3 indexes' in msg
+    assert 'public.orders' not in msg
+
+
+def test_stats_reset(pg, monkeypatch):
+    pg.outformat = 'json'
+    sample(pg, monkeypatch, [[16500, 100, 10 ** 9, 0, 0, 0, 0, 0, 500000]])
+    pg.state['hotspots']['ts'] = int(time.time()) - 60
+    msg = sample(pg, monkeypatch, [[16500, 1, 10, 0, 0, 0, 0, 0, 500000]])
+    assert msg.startswith('No table hot spots')
+
+
+def test_chunks_rotate(pg, monkeypatch, config):
+    # 7 tables sampled 2 at a time: a table busy since the last run is found when its chunk comes around and then
+    # stays sampled every run, and the state never holds more than the chunk and the top tables
+    config("[hotspots]\ntrackmax = 2\ntop = 1\n")
+    pg.outformat = 'json'
+    counters = {relid: [relid, 1, 1, 1, 0, 0, 0, 0, 500000] for relid in range(16500, 16507)}
+
+    def executecmd(cmd, expect):
+        if 'pg_stat_user_tables' not in cmd:
+            return SUCCESS, '16505|public.orders|4|100'
+        tracked = [int(relid) for relid in re.search(r"any\('\{([0-9,]*)\}'", cmd).group(1).split(',') if relid != '']
+        cursor  = int(re.search(r"relid > ([0-9]+)", cmd).group(1))
+        relids  = tracked + sorted(relid for relid in counters if relid > cursor and relid not in tracked)[:2]
+        return SUCCESS, '\n'.join('|'.join(str(acol) for acol in counters[relid]) for relid in relids)
+    monkeypatch.setattr(pg, 'executecmd', executecmd)
+
+    found = []
+    for run in range(8):
+        counters[16505][1] += 100
+        counters[16505][2] += 60000000
+        pg.start_check('hotspots')
+        assert pg.check_hotspots() == (SUCCESS, '')
+        found.append('public.orders' in pg.checkout[-1][1])
+        assert len(pg.state['hotspots']['tables']) <= 3
+        pg.state['hotspots']['ts'] -= 60
+    # chunks 16500-1, 16502-3, 16504-5: compared from the run after its chunk was sampled, then every run
+    assert found == [False, False, False, True, True, True, True, True]
@@ -0,0 +1,62 @@
+# The orphan count query runs with psql -f, against a psql stub that, like psql, exits 0 on a failed statement unless
+# ON_ERROR_STOP is set, and then exits 3.
+import os
+import sys
+import time
+
+import pytest
+
+from pg_check import SUCCESS
+
+PSQL = '''#!%s
+import sys
+with open(%r, 'a') as log:
+    log.write(' '.join(sys.argv[1:]) + '\\n')
+if '-f' in sys.argv:
+    sql = open(sys.argv[sys.argv.index('-f') + 1]).read()
+    if 'public.dropped' in sql:
+        sys.stderr.write('psql:stats.sql:2: ERROR:  relation "public.dropped" does not exist\\n')
+        sys.exit(3 if 'ON_ERROR_STOP=1' in sys.argv else 0)
+    print(2)
+elif 'reltuples' in sys.argv[sys.argv.index('-c') + 1]:
+    print('t|100')
+else:
+    print(%r)
+'''
+
+
+@pytest.fixture
+def psql(pg, tmp_path, monkeypatch):
+    # installs the stub with the reference columns it reports and returns the log of its command lines
+    def install(columns):
+        bindir = tmp_path / 'bin'
+        bindir.mkdir(exist_ok=True)
+        log = tmp_path / 'psql.log'
+        stub = bindir / 'psql'
+        stub.write_text(PSQL % (sys.executable, str(log), columns))
+        stub.chmod(0o755)
+        monkeypatch.setenv('PATH', str(bindir) + os.pathsep + os.environ.get('PATH', ''))
+        pg.opsys     = os.name
+        pg.workfile  = str(tmp_path / 'stats.sql')
+        pg.outformat = 'json'
+        pg.start_check('largeobjects')
+        return log
+    return install
+
+
+def test_cached_columns_fail(pg, psql):
+    # a cached reference column was dropped since: the query fails and the list is rebuilt once
+    log = psql('public.docs|body')
+    pg.state['largeobjects'] = {'ts': int(time.time()), 'columns': [['public.dropped', 'body']]}
+    assert pg.check_largeobjects() == (SUCCESS, '')
+    assert pg.state['largeobjects']['columns'] == [['public.docs', 'body']]
+    assert '2 orphaned large objects were found (1 reference columns checked)' in pg.checkout[-1][1]
+    assert len([aline for aline in log.read_text().split('\n') if ' -f ' in aline]) == 2
+
+
+def test_fresh_columns_fail(pg, psql):
+    # the query fails with a freshly built list: an error, not a count of the error text
+    psql('public.dropped|body')
+    rc, errors = pg.check_largeobjects()
+    assert rc != SUCCESS
+    assert 'relation "public.dropped" does not exist' in errors
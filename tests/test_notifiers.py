@@ -0,0 +1,100 @@
+import json
+
+import pg_check
+from pg_check import SUCCESS, ERROR, PGHOSTUP, WAITS
+
+
+def event(severity='warning', environment='PROD'):
+    return {'severity': severity, 'environment': environment}
+
+
+def test_routes_by_severity():
+    anotifier = pg_check.spoolnotifier('s', {'path': '/dev/null', 'severity': 'warning'})
+    assert not anotifier.routes(event('info'))
+    assert anotifier.routes(event('warning'))
+    assert anotifier.routes(event('critical'))
+    assert pg_check.spoolnotifier('s', {'path': '/dev/null'}).routes(event('info'))
+
+
+def test_routes_by_environment():
+    anotifier = pg_check.spoolnotifier('s', {'path': '/dev/null', 'environments': 'PROD, QA'})
+    assert anotifier.routes(event(environment='PROD'))
+    assert anotifier.routes(event(environment='QA'))
+    assert not anotifier.routes(event(environment='DEV'))
+
+
+def test_invalid_severity():
+    try:
+        pg_check.spoolnotifier('s', {'path': '/dev/null', 'severity': 'loud'})
+    except ValueError as e:
+        assert 'loud' in str(e)
+    else:
+        assert False
+
+
+def test_load_notifiers_errors(pg, config):
+    config("[notifier.x]\ntype = pager\n")
+    rc, errors = pg.load_notifiers()
+    assert rc == ERROR and 'pager' in errors
+    pg.config = pg_check.configparser.ConfigParser()
+    config("[notifier.x]\ntype = webhook\n")
+    rc, errors = pg.load_notifiers()
+    assert rc == ERROR and 'url' in errors
+
+
+def test_send_alert_routing(pg, config, tmp_path):
+    config("[notifier.pager]\ntype = spool\nseverity = critical\npath = %s\n"
+           "[notifier.all]\ntype = spool\npath = %s\n"
+           "[notifier.dev]\ntype = spool\nenvironments = DEV\npath = %s\n" % (tmp_path / 'pager.json', tmp_path / 'all.json', tmp_path / 'dev.json'))
+    assert pg.load_notifiers() == (SUCCESS, '')
+    assert [anotifier.name for anotifier in pg.notifiers] == ['pager', 'all', 'dev']
+
+    pg.checkid   = 'waits'
+    pg.alerttype = WAITS
+    assert pg.send_alert('to', 'from', 'Waits detected', '') == 0
+    pg.checkid   = 'pghostup'
+    pg.alerttype = PGHOSTUP
+    assert pg.send_alert('to', 'from', 'PG Connection Refused.', '', 'resolved') == 0
+
+    def types(name):
+        path = tmp_path / (name + '.json')
+        if not path.exists():
+            return []
+        return [(event['type'], event['severity'], event['status']) for event in map(json.loads, path.read_text().splitlines())]
+    assert types('pager') == [(PGHOSTUP, 'critical', 'resolved')]
+    assert types('all') == [(WAITS, 'warning', 'firing'), (PGHOSTUP, 'critical', 'resolved')]
+    assert types('dev') == []
+
+
+def test_send_alert_failure(pg, config, tmp_path):
+    config("[notifier.bad]\ntype = spool\npath = %s\n" % (tmp_path / 'missing' / 'alerts.json'))
+    assert pg.load_notifiers() == (SUCCESS, '')
+    pg.checkid   = 'waits'
+    pg.alerttype = WAITS
+    assert pg.send_alert('to', 'from', 'Waits detected', '') != 0
+
+
+def test_replay_keeps_only_spools(pg, config, tmp_path):
+    config("[notifier.hook]\ntype = webhook\nurl = http://localhost:1/\n[notifier.spool]\ntype = spool\npath = %s\n" % (tmp_path / 'alerts.json'))
+    pg.replay      = 'capture.gz'
+    pg.mailnotify  = True
+    assert pg.load_notifiers() == (SUCCESS, '')
+    assert [anotifier.name for anotifier in pg.notifiers] == ['spool']
+
+
+def test_event_payload(monkeypatch):
+    sent = []
+    monkeypatch.setattr(pg_check.httpnotifier, 'post', lambda self, url, payload: sent.append(payload) or 0)
+    anotifier = pg_check.eventnotifier('pd', {'routing_key': 'key'})
+    base = {'instance': 'h_5432_mydb', 'check': 'waits', 'type': WAITS, 'severity': 'warning', 'environment': 'PROD', 'subject': 's', 'body': ''}
+    anotifier.send(dict(base, status='firing'))
+    anotifier.send(dict(base, status='resolved'))
+    assert [payload['event_action'] for payload in sent] == ['trigger', 'resolve']
+    assert sent[0]['dedup_key'] == sent[1]['dedup_key'] == 'h_5432_mydb/waits:Waits'
+    # the same alert type from another check is another incident
+    anotifier.send(dict(base, check='longquery', status='firing'))
+    assert sent[2]['dedup_key'] == 'h_5432_mydb/longquery:Waits'
+
+
+def test_base_send():
+    assert pg_check.notifier('base', {}).send({}) == pg_check.ERROR
@@ -0,0 +1,38 @@
+import gzip
+import json
+import time
+from datetime import datetime
+
+from pg_check import SUCCESS
+
+
+def capture(path, runs):
+    with gzip.open(str(path), 'at') as f:
+        for arun in runs:
+            f.write(json.dumps({'run': arun, 'cpus': 4, 'states': {}}) + '\n')
+
+
+def test_replay_clock(pg, tmp_path):
+    realtime = time.time
+    recorded = datetime(2024, 3, 4, 13, 30).timestamp()
+    capture(tmp_path / 'cap.gz', [recorded, recorded + 60])
+    pg.replay = str(tmp_path / 'cap.gz')
+    pg.load_state()
+    assert pg.load_replay() == (SUCCESS, '')
+
+    assert pg.next_replay()
+    assert abs(pg.clock().timestamp() - recorded) < 5
+    assert abs(pg.now() - recorded) < 5
+    # only the run's clock moves, not the process wide one
+    assert time.time is realtime and time.time() - recorded > 86400
+    # the hour of the week anomaly slot and record timestamps follow the recorded run, not the wall clock
+    assert pg.clock().strftime("%Y-%m-%d %H") == '2024-03-04 13'
+    pg.start_check('cachehit')
+    pg.outformat = 'json'
+    pg.emit('[ OK ]  ', 'ok')
+    pg.end_check(SUCCESS, '')
+    assert pg.records[0]['ts'].startswith('2024-03-04T13:3')
+
+    assert pg.next_replay()
+    assert abs(pg.clock().timestamp() - (recorded + 60)) < 5
+    assert pg.cpus == 4
@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+import pg_check
+from pg_check import Decimal, SUCCESS, ERROR
+
+
+def test_get_setting_defaults(pg):
+    assert pg.get_setting('bloat', 'ratio') == 20
+    assert pg.get_setting('bloat', 'interval') == 3600
+    assert pg.get_setting('bloat', 'enabled') is True
+    assert pg.get_setting('buffercache', 'enabled') is False
+    assert pg.get_setting('alerts', 'breaches') == 2
+    assert pg.get_setting('bloat', 'ratio', 5) == 5
+
+
+def test_get_setting_precedence(pg, config):
+    assert config("[bloat]\nratio = 10\ninterval = 60\n[bloat:PROD]\nratio = 30\n[bloat:DEV]\nratio = 40\n") == (SUCCESS, '')
+    # environment section, then the general section, then the registry default
+    assert pg.get_setting('bloat', 'ratio') == 30
+    assert pg.get_setting('bloat', 'interval') == 60
+    assert pg.get_setting('bloat', 'wastedbytes') == 10737418240
+    pg.environment = 'QA'
+    assert pg.get_setting('bloat', 'ratio') == 10
+
+
+def test_get_setting_types(pg, config):
+    config("[cachehit]\nlow = 50.5\n[buffercache]\nenabled = on\n[activeconns]\nmaxpct = 70\n[guardrails]\nwork_mem = 4MB\n")
+    assert pg.get_setting('cachehit', 'low') == Decimal('50.5')
+    assert pg.get_setting('buffercache', 'enabled') is True
+    assert pg.get_setting('activeconns', 'maxpct') == 70.0
+    assert isinstance(pg.get_setting('activeconns', 'maxpct'), float)
+    assert pg.get_setting('guardrails', 'work_mem') == '4MB'
+
+
+def test_config_unknown_section(pg, config):
+    rc, errors = config("[nosuchcheck]\nenabled = off\n")
+    assert rc == ERROR
+    assert 'nosuchcheck' in errors
+
+
+def test_check_enabled_disabled(pg, config):
+    config("[bloat]\nenabled = off\n")
+    assert not pg.check_enabled('bloat')
+    assert pg.check_enabled('cachehit')
+
+
+def test_check_enabled_versions(pg):
+    pg.pgversionmajor = Decimal('9.6')
+    assert not pg.check_enabled('sessions')
+    assert not pg.check_enabled('io')
+    assert pg.check_enabled('autovacuum')
+    pg.pgversionmajor = Decimal('14')
+    assert pg.check_enabled('sessions')
+    pg.pgversionmajor = Decimal('16')
+    assert pg.check_enabled('io')
+
+
+def test_check_enabled_maxver(pg, monkeypatch):
+    monkeypatch.setitem(pg_check.CHECKS, 'cachehit', dict(pg_check.CHECKS['cachehit'], maxver='12'))
+    pg.pgversionmajor = Decimal('12')
+    assert pg.check_enabled('cachehit')
+    pg.pgversionmajor = Decimal('13')
+    assert not pg.check_enabled('cachehit')
+
+
+def test_check_enabled_recovery(pg):
+    assert pg.check_enabled('freeze')
+    assert not pg.check_enabled('standby')
+    pg.in_recovery = True
+    assert not pg.check_enabled('freeze')
+    assert pg.check_enabled('standby')
+
+
+def test_check_enabled_interval(pg, config):
+    config("[bloat]\ninterval = 600\n")
+    assert pg.check_enabled('bloat')
+    pg.state['lastrun']['bloat'] = int(time.time()) - 60
+    assert not pg.check_enabled('bloat')
+    pg.state['lastrun']['bloat'] = int(time.time()) - 601
+    assert pg.check_enabled('bloat')
+    # interval 0 runs every time
+    pg.state['lastrun']['cachehit'] = int(time.time())
+    assert pg.check_enabled('cachehit')
+
+
+def test_pgoptions_tightest_timeout(pg, config):
+    config("[connections]\nstatement_timeout = 2500ms\n[bgwriter]\nstatement_timeout = 0\n")
+    assert 'statement_timeout=60s ' in pg.get_pgoptions('unusedindexes')
+    # probes of several checks in one query get the tightest of their timeouts
+    assert 'statement_timeout=10s ' in pg.get_pgoptions(['bgwriter', 'unusedindexes', 'cachehit'])
+    assert 'statement_timeout=2500ms ' in pg.get_pgoptions(['cachehit', 'connections'])
+    assert pg.timeout_ms('1min') == 60000 and pg.timeout_ms('250') == 250
+
+
+def test_prefetch_needs_json_build_object(pg, monkeypatch):
+    # json_build_object() is 9.4+, so 9.3 runs every probe on its own
+    monkeypatch.setattr(pg, 'run_query', lambda name, params=None: pytest.fail('batch ran on 9.3'))
+    pg.pgversionmajor = Decimal('9.3')
+    pg.queries = pg.resolve_queries(pg.pgversionmajor)
+    pg.prefetch(list(pg_check.CHECKS))
+    assert pg.batch == {}
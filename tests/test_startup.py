@@ -0,0 +1,87 @@
+# Startup path of a scheduled run: pg_check.py runs as a script under an audit hook that logs every subprocess it starts
+# and which lazily imported modules are loaded by then, against a psql stub that answers the first query and "show all".
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+import pg_check
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pg_check.py')
+LAZY   = ('sqlite3', 'http.client', 'concurrent.futures', 'syslog', 'gzip', 'smtplib')
+
+PSQL = '''#!%s
+import sys
+sql = sys.argv[sys.argv.index('-c') + 1] if '-c' in sys.argv else ''
+if 'pg_is_in_recovery()' in sql:
+    print('16.1-16.|f|1700000000/1700000000')
+elif sql == 'show all':
+    print('data_directory|/var/lib/pgsql/16/data|Sets the data directory.')
+    print('max_connections|100|Sets the maximum number of concurrent connections.')
+    print('shared_buffers|128MB|Sets the number of shared memory buffers.')
+'''
+
+DRIVER = '''
+import json, runpy, sys
+log = open(%r, 'a')
+def hook(event, args):
+    if event == 'subprocess.Popen':
+        log.write(json.dumps({'cmd': ' '.join(str(arg) for arg in args[1]), 'modules': [m for m in %r if m in sys.modules]}) + '\\n')
+        log.flush()
+sys.addaudithook(hook)
+sys.argv = [%r] + sys.argv[1:]
+runpy.run_path(%r, run_name='__main__')
+'''
+
+
+@pytest.fixture
+def startup(tmp_path):
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    psql = bindir / 'psql'
+    psql.write_text(PSQL % sys.executable)
+    psql.chmod(0o755)
+    # every check off, so a run is only the startup path and the end of run bookkeeping
+    conf = tmp_path / 'pg_check.conf'
+    conf.write_text(''.join("[%s]\nenabled = off\n" % checkid for checkid in pg_check.CHECKS))
+    log = tmp_path / 'popen.log'
+    # the driver sits in tmp_path, so that is the program directory for state, history and lock files
+    driver = tmp_path / 'driver.py'
+    driver.write_text(textwrap.dedent(DRIVER % (str(log), LAZY, SCRIPT, SCRIPT)))
+    env = dict(os.environ, PATH=str(bindir) + os.pathsep + os.environ.get('PATH', ''))
+
+    def run():
+        if log.exists():
+            log.unlink()
+        proc = subprocess.run([sys.executable, str(driver), '-d', 'mydb', '-p', '5499'], env=env, capture_output=True, text=True, timeout=60)
+        assert proc.returncode == 0, proc.stdout + proc.stderr
+        return [json.loads(aline) for aline in log.read_text().splitlines()]
+    return run
+
+
+def test_first_query_is_first_subprocess(startup):
+    calls = startup()
+    assert len(calls) >= 1
+    assert 'psql' in calls[0]['cmd'] and 'pg_is_in_recovery()' in calls[0]['cmd']
+    assert calls[0]['modules'] == []
+
+
+def test_settings_read_once(startup):
+    calls = startup()
+    assert ['show all' in acall['cmd'] for acall in calls] == [False, True]
+    # same postmaster start and config load time: the cached settings are used and the first query is the only one
+    calls = startup()
+    assert len(calls) == 1
+    assert 'pg_is_in_recovery()' in calls[0]['cmd']
+
+
+def test_first_query_recorded(startup, tmp_path):
+    startup()
+    conn = sqlite3.connect(str(tmp_path / 'pg_check.db'))
+    rows = conn.execute("select vsum from metrics where metric = 'startup.first_query_ms' and rollup = 'raw'").fetchall()
+    conn.close()
+    assert len(rows) == 1 and rows[0][0] >= 0
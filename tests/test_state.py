@@ -0,0 +1,54 @@
+import json
+import os
+
+
+def test_load_state_missing(pg):
+    pg.load_state()
+    assert pg.state == {'lastrun': {}}
+    assert pg.statefile.endswith('pg_check_local_5432_mydb.state')
+
+
+def test_state_round_trip(pg, tmp_path):
+    pg.load_state()
+    pg.state['lastrun']['bloat'] = 1700000000
+    pg.state['hotspots'] = {'ts': 1700000000, 'tables': {'16384': ['public.t', 1, 2]}}
+    pg.save_state()
+    assert not os.path.exists(pg.statefile + '.tmp')
+
+    pg.state = {'lastrun': {}}
+    pg.load_state()
+    assert pg.state['lastrun'] == {'bloat': 1700000000}
+    assert pg.state['hotspots']['tables']['16384'] == ['public.t', 1, 2]
+
+
+def test_state_per_instance(pg):
+    pg.load_state()
+    pg.state['lastrun']['bloat'] = 1
+    pg.save_state()
+    pg.database = 'other'
+    pg.state = {'lastrun': {}}
+    pg.load_state()
+    assert pg.state['lastrun'] == {}
+
+
+def test_corrupt_state(pg, tmp_path, capsys):
+    (tmp_path / 'pg_check_local_5432_mydb.state').write_text('{"lastrun": ')
+    pg.load_state()
+    assert pg.state == {'lastrun': {}}
+    assert 'Ignoring corrupt state file' in capsys.readouterr().out
+
+
+def test_replay_state_file(pg, tmp_path):
+    (tmp_path / 'pg_check_local_5432_mydb.state').write_text('{"lastrun": {"bloat": 1}}')
+    pg.replay = 'capture.gz'
+    pg.load_state()
+    assert pg.statefile.endswith('.replay.state')
+    assert pg.state['lastrun'] == {}
+
+
+def test_alert_state_migration(pg, tmp_path):
+    old = {'lastrun': {}, 'alerts': {'Waits': {'status': 'FIRING', 'check': 'waits', 'breaches': 3, 'clears': 0, 'since': 1, 'notified': 1, 'notifies': 1}}}
+    (tmp_path / 'pg_check_local_5432_mydb.state').write_text(json.dumps(old))
+    pg.load_state()
+    assert list(pg.state['alerts']) == ['waits:Waits']
+    assert pg.state['alerts']['waits:Waits']['type'] == 'Waits'
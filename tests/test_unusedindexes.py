@@ -0,0 +1,54 @@
+import time
+
+from pg_check import SUCCESS
+
+DAY = 86400
+
+
+def sample(pg, monkeypatch, rows):
+    # one run of the unusedindexes check against canned pg_stat_user_indexes rows:
+    # indexrelid, index, table, idx_scan, size, table writes, stats reset
+    monkeypatch.setattr(pg, 'executecmd', lambda cmd, expect: (SUCCESS, '\n'.join('|'.join(str(acol) for acol in row) for row in rows)))
+    pg.start_check('unusedindexes')
+    assert pg.check_unusedindexes() == (SUCCESS, '')
+    return '\n'.join(msg for marker, msg in pg.checkout)
+
+
+def age(pg, days):
+    # the samples were taken days earlier
+    for asample in pg.state['indexes'].values():
+        asample[1] -= days * DAY
+        asample[3] -= days * DAY
+        asample[5] -= days * DAY
+
+
+def test_new_index_after_old_reset(pg, monkeypatch):
+    pg.outformat = 'json'
+    oldreset = int(time.time()) - 365 * DAY
+    # created after a stats reset a year ago: not unused until it has gone unscanned for unuseddays since first seen
+    msg = sample(pg, monkeypatch, [[16401, 'public.ix_new', 'public.t1', 0, 81920000, 1000, oldreset]])
+    assert msg.startswith('No unused indexes')
+    age(pg, 3)
+    assert sample(pg, monkeypatch, [[16401, 'public.ix_new', 'public.t1', 0, 81920000, 1000, oldreset]]).startswith('No unused indexes')
+    age(pg, 5)
+    msg = sample(pg, monkeypatch, [[16401, 'public.ix_new', 'public.t1', 0, 81920000, 1000, oldreset]])
+    assert 'public.ix_new on public.t1' in msg and 'unused days=8' in msg
+
+
+def test_reset_after_first_seen(pg, monkeypatch):
+    pg.outformat = 'json'
+    sample(pg, monkeypatch, [[16401, 'public.ix_a', 'public.t1', 5, 81920000, 1000, 0]])
+    age(pg, 30)
+    # counters reset 2 days ago: a zero count only goes back to the reset
+    reset = int(time.time()) - 2 * DAY
+    assert sample(pg, monkeypatch, [[16401, 'public.ix_a', 'public.t1', 0, 81920000, 1000, reset]]).startswith('No unused indexes')
+    assert pg.state['indexes']['16401'][1] == reset
+    age(pg, 6)
+    assert 'unused days=8' in sample(pg, monkeypatch, [[16401, 'public.ix_a', 'public.t1', 0, 81920000, 1000, reset]])
+
+
+def test_scanned_index(pg, monkeypatch):
+    pg.outformat = 'json'
+    sample(pg, monkeypatch, [[16401, 'public.ix_a', 'public.t1', 5, 81920000, 1000, 0]])
+    age(pg, 10)
+    assert sample(pg, monkeypatch, [[16401, 'public.ix_a', 'public.t1', 6, 81920000, 1000, 0]]).startswith('No unused indexes')
@@ -0,0 +1,25 @@
+from pg_check import SUCCESS
+
+
+def sample(pg, monkeypatch, results):
+    # one run of the wait event sampler against canned psql output: sample, wait event type, wait event, count
+    pg.outformat = 'json'
+    monkeypatch.setattr(pg, 'executecmd', lambda cmd, expect: (SUCCESS, results))
+    pg.start_check('waitprofile')
+    return pg.check_waitprofile()
+
+
+def test_all_samples(pg, monkeypatch, tmp_path, config):
+    config("[waitprofile]\nseconds = 1\nintervalms = 500\n")
+    pg.workfile = str(tmp_path / 'stats.sql')
+    assert sample(pg, monkeypatch, "0|IO|DataFileRead|2\n0|*|*|10\n1|CPU|CPU|1\n1|*|*|10") == (SUCCESS, '')
+    assert 'AAS=1.50' in pg.checkout[-1][1]
+
+
+def test_failed_sample(pg, monkeypatch, tmp_path, config):
+    # the second sample failed: stderr came back in place of its rows
+    config("[waitprofile]\nseconds = 1\nintervalms = 500\n")
+    pg.workfile = str(tmp_path / 'stats.sql')
+    rc, errors = sample(pg, monkeypatch, "0|IO|DataFileRead|2\n0|*|*|10")
+    assert rc != SUCCESS
+    assert 'Unable to sample wait events' in errors